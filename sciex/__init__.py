@@ -5,3 +5,23 @@
 from sciex.components import *
 from sciex.result_types import *
 from sciex.functions import *
+from sciex.sweep import *
+from sciex import components, result_types, functions, sweep
+
+__all__ = (components.__all__ + result_types.__all__ + functions.__all__
+           + sweep.__all__ + ["components", "result_types", "functions",
+                              "util", "yaml", "concurrent"])
+
+def __getattr__(name):
+    # Modules that `from sciex import *` has always provided; they are
+    # slow to import, so they are imported when first used.
+    if name == "util":
+        import sciex.util
+        return sciex.util
+    elif name == "yaml":
+        import yaml
+        return yaml
+    elif name == "concurrent":
+        import concurrent.futures
+        return concurrent
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,148 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Mergeable accumulators for gathering results in a streaming fashion
+(see `Result.STREAMING`). An accumulator is updated with one result
+at a time, two accumulators of the same kind can be merged (e.g.
+partial results from parallel collectors), and `finalize` returns
+the summary. Memory use depends only on the accumulator, not on how
+many results were folded into it.
+
+Example:
+
+    class RewardsResult(YamlResult):
+        STREAMING = True
+
+        @classmethod
+        def init_accumulator(cls):
+            return Welford()
+
+        @classmethod
+        def accumulate(cls, accumulator, seed, result):
+            accumulator.update(sum(result))
+            return accumulator
+"""
+import numpy as np
+
+class Accumulator:
+    def update(self, value):
+        """Folds one value into the accumulator"""
+        raise NotImplementedError
+
+    def merge(self, other):
+        """Folds another accumulator of the same kind into
+        this one; returns this accumulator"""
+        raise NotImplementedError
+
+    def finalize(self):
+        """Returns the summary of the values folded in"""
+        raise NotImplementedError
+
+
+class Welford(Accumulator):
+    """Running count, mean and variance with Welford's algorithm.
+    Values can be numbers or numpy arrays of the same shape, in
+    which case the statistics are element-wise."""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + delta * (value - self.mean)
+
+    def merge(self, other):
+        # Chan et al.'s formula for combining two partial results
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def var(self):
+        """Sample variance (with Bessel's correction)"""
+        if self.count < 2:
+            return float("nan")
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return self.var ** 0.5
+
+    @property
+    def stderr(self):
+        if self.count < 2:
+            return float("nan")
+        return self.std / self.count ** 0.5
+
+    def finalize(self):
+        return {"mean": self.mean,
+                "std": self.std,
+                "stderr": self.stderr,
+                "_size": self.count}
+
+
+class Histogram(Accumulator):
+    """Histogram with fixed bin edges. Values can be numbers
+    or arrays; every element is counted. Elements below the
+    first or above the last edge are counted as underflow and
+    overflow."""
+    def __init__(self, bins=10, range=(0.0, 1.0)):
+        self.edges = np.histogram_bin_edges([], bins=bins, range=range)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def update(self, value):
+        value = np.asarray(value).ravel()
+        self.counts += np.histogram(value, bins=self.edges)[0]
+        self.underflow += int(np.count_nonzero(value < self.edges[0]))
+        self.overflow += int(np.count_nonzero(value > self.edges[-1]))
+
+    def merge(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Cannot merge histograms with different bin edges")
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def finalize(self):
+        return {"counts": self.counts,
+                "edges": self.edges,
+                "underflow": self.underflow,
+                "overflow": self.overflow}
+
+
+class AccumulatorDict(Accumulator):
+    """Accumulates dictionary-valued results, with one accumulator
+    per key. `factories` maps from key to a function that creates
+    the accumulator for that key, e.g. {"reward": Welford}."""
+    def __init__(self, factories):
+        self.accumulators = {key: factories[key]() for key in factories}
+
+    def update(self, value):
+        for key in self.accumulators:
+            if key in value:
+                self.accumulators[key].update(value[key])
+
+    def merge(self, other):
+        for key in self.accumulators:
+            self.accumulators[key].merge(other.accumulators[key])
+        return self
+
+    def finalize(self):
+        return {key: self.accumulators[key].finalize()
+                for key in self.accumulators}
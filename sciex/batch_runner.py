@@ -11,18 +11,36 @@ By default, a batch means the set of trials contained in a run script.
 Therefore, this program works by providing a file that contains either
 a list of trial paths, or the result that is output by Experiment.generate_run_scripts
 
-Processes have their own memory space, but modern operating systems
-implement copy-on-write - If you don't modify the resource, the memory
-for it won't be physically copied.
+The resource is passed to each worker process once, when the worker
+starts, rather than with every trial. With fork, the workers share the
+memory of the resource with the parent through copy-on-write, but
+merely reading Python objects touches their reference counts, so pages
+get copied over time. With --shm (or --mmap-dir), large numpy arrays and
+bytes in the resource are placed in shared memory (or memory-mapped
+files) instead, so all workers read the same physical memory; this also
+works with --spawn, where the resource would otherwise be pickled to
+every worker. See sciex.shared_resource.
 """
 import os
 import argparse
-import pickle
 import multiprocessing
+from sciex.trial_store import load_trial_file
+from sciex.trial_runner import execute_trial
+from sciex.result_cache import enable_result_cache
 
-def run_trial(trial, resource, logging):
-    trial.set_resource(resource)
-    trial.run(logging=logging)
+# The resource in the worker processes; set by `init_worker`
+_RESOURCE = None
+
+def init_worker(resource, shared):
+    global _RESOURCE
+    if shared:
+        from sciex.shared_resource import attach
+        resource = attach(resource)
+    _RESOURCE = resource
+
+def run_trial(trial, exp_path, logging, profile=False):
+    trial.set_resource(_RESOURCE)
+    execute_trial(trial, exp_path, logging=logging, profile=profile)
 
 def main():
     parser = argparse.ArgumentParser(description='Run a batch of trials.')
@@ -35,8 +53,23 @@ def main():
                         default=4)
     parser.add_argument("--logging", action="store_true")
     parser.add_argument("--spawn", action="store_true")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile each trial (see sciex.profiling)")
+    parser.add_argument("--shm", action="store_true",
+                        help="Put large arrays and bytes of the resource in shared memory")
+    parser.add_argument("--mmap-dir", type=str, default=None,
+                        help="Put large arrays and bytes of the resource in memory-mapped"\
+                        " files in this directory (instead of shared memory)")
+    parser.add_argument("--shm-min-bytes", type=int, default=1024*1024,
+                        help="Arrays and bytes smaller than this are not shared (default 1MB)")
+    parser.add_argument("--result-cache", type=str, nargs="?", const="1", default=None,
+                        help="Reuse the results of identical trials from the result"\
+                        " cache, in this directory or the default one (see sciex.result_cache)")
     args = parser.parse_args()
 
+    if args.result_cache is not None:
+        enable_result_cache(args.result_cache)
+
     if not os.path.exists(args.file_path):
         print("{} not found".format(args.file_path))
         return
@@ -59,12 +92,11 @@ def main():
     trials_to_run = []
     for trial_path in trial_paths:
         # Load the trial
-        with open(os.path.join(args.exp_path, trial_path), "rb") as f:
-            trial = pickle.load(f)
-            if os.path.exists(os.path.join(args.exp_path, trial.name, "config.yaml")):
-                print("Skipping {} because it seems to be done".format(trial.name))
-            else:
-                trials_to_run.append(trial)
+        trial = load_trial_file(os.path.join(args.exp_path, trial_path))
+        if os.path.exists(os.path.join(args.exp_path, trial.name, "config.yaml")):
+            print("Skipping {} because it seems to be done".format(trial.name))
+        else:
+            trials_to_run.append(trial)
 
     if len(trials_to_run) == 0:
         print("Nothing to run.")
@@ -80,12 +112,26 @@ def main():
     # No resource is provided. We can still keep going.
     if resource is None:
         print("No resource provided.")
-    func_args = [(trial, resource, args.logging)
+    func_args = [(trial, args.exp_path, args.logging, args.profile)
                  for trial in trials_to_run]
     if args.spawn:
         multiprocessing.set_start_method('spawn')
-    with multiprocessing.Pool(processes=args.num_proc) as pool:
-        pool.starmap(run_trial, func_args)
+
+    shared = None
+    if resource is not None and (args.shm or args.mmap_dir is not None):
+        from sciex.shared_resource import SharedResource
+        shared = SharedResource(resource, min_bytes=args.shm_min_bytes,
+                                mmap_dir=args.mmap_dir)
+        print("Shared {} bytes of the resource".format(shared.nbytes))
+        resource = shared.handles
+    try:
+        with multiprocessing.Pool(processes=args.num_proc,
+                                  initializer=init_worker,
+                                  initargs=(resource, shared is not None)) as pool:
+            pool.starmap(run_trial, func_args)
+    finally:
+        if shared is not None:
+            shared.close()
 
 if __name__ == "__main__":
     main()
@@ -23,12 +23,21 @@ The criteria for completion is simple - whether 'config.yaml'
 exists in the trial's folder. Because every trial must have
 config and the config is only saved when the trial finishes
 and the results are reported.
+
+If the experiment has a manifest (see sciex.manifest), the
+status is read from it instead of from the trial folders,
+which is much faster for large experiments. Use --scan to
+check the trial folders, or --rebuild to rebuild the manifest.
+
+With --metrics, the resource usage of the finished trials (see
+sciex.telemetry) is summarized as well. With --watch, the status is
+shown live, with throughput, ETA and stalled trials (see sciex.monitor).
 """
 import argparse
-import pickle
 import os
-import yaml
 from datetime import datetime as dt
+from sciex.manifest import load_index, manifest_path, rebuild_manifest
+from sciex.trial_store import trial_names
 
 EXPERIMENT_PATH = os.path.dirname(os.path.abspath(__file__))
 
@@ -41,6 +50,18 @@ def trial_completed(trial_path):
     return False
 
 
+def trial_name_in_command(line):
+    """Returns the name of the trial run by a line of a run script,
+    or None if the line does not run a trial."""
+    if "python trial_runner.py" not in line:
+        return None
+    line = line[line.index("python trial_runner.py"):]
+    trial_path = line.split()[2]
+    if trial_path.startswith("\""):
+        trial_path = trial_path[1:-1]
+    return os.path.basename(os.path.dirname(trial_path))
+
+
 def load_trial_names_in_run_script(runscript_path):
     results = []
     with open(runscript_path) as f:
@@ -48,11 +69,7 @@ def load_trial_names_in_run_script(runscript_path):
     for line in lines:
         line = line.strip()
         if "python trial_runner.py" in line:
-            line = line[line.index("python trial_runner.py"):]
-            trial_path = line.split()[2]
-            if trial_path.startswith("\""):
-                trial_path = trial_path[1:-1]
-            results.append(os.path.basename(os.path.dirname(trial_path)))
+            results.append(trial_name_in_command(line))
         elif line.startswith("source"):
             inner_runscript_path = line.split()[1]
             results.extend(load_trial_names_in_run_script(inner_runscript_path))
@@ -60,44 +77,65 @@ def load_trial_names_in_run_script(runscript_path):
     return results
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Check experiment status")
-    parser.add_argument("-P", "--run-script-path", type=str, default="",
-                        help="Path to a shell script that"
-                        "contains clues for figuring out which"
-                        "trials the shell script covers")
-    parser.add_argument("--prefix", type=str, default="",
-                        help="Prefix to run script files. This will override the -P option")
-    args = parser.parse_args()
-
+def _trial_names_to_check(args):
+    """Returns the names of trials in the run scripts selected
+    by --prefix or -P; None if neither is given."""
+    if len(args.prefix) == 0 and len(args.run_script_path) == 0:
+        return None
     trials_to_check = []
-    if args.prefix is not None:
+    if len(args.prefix) > 0:
         for fname in os.listdir(EXPERIMENT_PATH):
             if not os.path.isdir(os.path.join(EXPERIMENT_PATH, fname)):
                 if fname.startswith(args.prefix) and fname.endswith("sh"):
                     filepath = os.path.join(EXPERIMENT_PATH, fname)
                     trials_to_check.extend(load_trial_names_in_run_script(filepath))
     else:
-        if len(args.run_script_path) > 0:
-            filepath = os.path.join(EXPERIMENT_PATH, args.run_script_path)
-            trials_to_check.extend(load_trial_names_in_run_script(filepath))
+        filepath = os.path.join(EXPERIMENT_PATH, args.run_script_path)
+        trials_to_check.extend(load_trial_names_in_run_script(filepath))
+    return set(trials_to_check)
 
 
+def status_from_manifest(args):
+    index = load_index(EXPERIMENT_PATH)
+    trials_to_check = None
+    if len(args.prefix) > 0:
+        # The manifest knows which run script each trial is in
+        trials_to_check = set(trial_name for trial_name in index
+                              if any(script.startswith(args.prefix)
+                                     for script in index[trial_name]["scripts"]))
+    if not trials_to_check:
+        # scripts the manifest does not know of (e.g. written by
+        # sciex.divide or by hand) are read to find their trials
+        trials_to_check = _trial_names_to_check(args)
+    if trials_to_check is None:
+        trials_to_check = index
+
     status = {
         "finished": 0,
         "total": 0
     }
+    for trial_name in trials_to_check:
+        if trial_name in index:
+            completed = index[trial_name]["completed"]
+        else:
+            completed = trial_completed(os.path.join(EXPERIMENT_PATH, trial_name))
+        if completed:
+            status["finished"] += 1
+        status["total"] += 1
+    return status
 
-    for fname in os.listdir(EXPERIMENT_PATH):
-        if not os.path.join(EXPERIMENT_PATH, fname, "trial.pkl"):
-            continue
-        if not os.path.isdir(os.path.join(EXPERIMENT_PATH, fname)):
-            continue
 
-        trial_name = fname
-        if (len(args.run_script_path) > 0\
-            or len(args.prefix) > 0)\
-            and trial_name not in trials_to_check:
+def status_from_scan(args):
+    trials_to_check = _trial_names_to_check(args)
+
+    status = {
+        "finished": 0,
+        "total": 0
+    }
+
+    for trial_name in trial_names(EXPERIMENT_PATH):
+        if trials_to_check is not None\
+           and trial_name not in trials_to_check:
             continue
 
         if len(trial_name.split("_")) == 2:
@@ -112,6 +150,47 @@ def main():
         if trial_completed(os.path.join(EXPERIMENT_PATH, trial_name)):
             status["finished"] += 1
         status["total"] += 1
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check experiment status")
+    parser.add_argument("-P", "--run-script-path", type=str, default="",
+                        help="Path to a shell script that"
+                        "contains clues for figuring out which"
+                        "trials the shell script covers")
+    parser.add_argument("--prefix", type=str, default="",
+                        help="Prefix to run script files. This will override the -P option")
+    parser.add_argument("--scan", action="store_true",
+                        help="Check every trial directory instead of reading the manifest")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Rebuild the manifest from the trial directories first")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Summarize the resource usage of finished trials")
+    parser.add_argument("--top", type=int, default=10,
+                        help="Number of slowest trials listed with --metrics")
+    parser.add_argument("--watch", type=float, nargs="?", const=5.0, default=None,
+                        help="Show the status live, updated every this many seconds (default 5)")
+    parser.add_argument("--window", type=float, default=10,
+                        help="Minutes over which the throughput is measured with --watch")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild_manifest(EXPERIMENT_PATH)
+
+    if args.watch is not None:
+        if not os.path.exists(manifest_path(EXPERIMENT_PATH)):
+            print("--watch needs the manifest; create it with --rebuild")
+            return
+        from sciex.monitor import Monitor
+        Monitor(EXPERIMENT_PATH, window=int(args.window * 60)).watch(interval=args.watch)
+        return
+
+    use_manifest = not args.scan and os.path.exists(manifest_path(EXPERIMENT_PATH))
+    if use_manifest:
+        status = status_from_manifest(args)
+    else:
+        status = status_from_scan(args)
 
     time_str = dt.now().strftime("%m/%d/%Y %H:%M:%S")
     print("Experiment Status (%s):" % time_str)
@@ -123,5 +202,20 @@ def main():
     print("  Finished: {} ({:.1%})".format(status["finished"],
                                            status["finished"]/max(1,status["total"])))
 
+    if args.metrics:
+        from sciex import telemetry
+        if use_manifest:
+            index = load_index(EXPERIMENT_PATH)
+            metrics = {trial_name: index[trial_name].get("metrics") for trial_name in index
+                       if index[trial_name]["completed"]}
+        else:
+            metrics = telemetry.load_metrics(EXPERIMENT_PATH)
+        trials_to_check = _trial_names_to_check(args)
+        if trials_to_check is not None:
+            metrics = {trial_name: metrics[trial_name] for trial_name in metrics
+                       if trial_name in trials_to_check}
+        print()
+        telemetry.summarize(metrics, top=args.top)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,48 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Checkpoints of running trials, so that a trial that is killed
+(by a timeout, preemption or a reboot) resumes where it left off
+when it is run again, instead of starting over.
+
+A trial opts in by implementing `Trial.save_checkpoint` (return the
+state to save) and `Trial.load_checkpoint` (restore it), and calling
+`self.checkpoint()` regularly in `run`, e.g. once per iteration; a
+checkpoint is actually written at most every `CHECKPOINT_INTERVAL`
+seconds. The runners resume the trial from checkpoint.pkl in the trial
+directory if there is one, and delete it once the results are saved.
+
+Checkpoints are written to a temporary file that is then renamed, so
+a checkpoint that is being written when the trial is killed is never
+loaded.
+"""
+import os
+import pickle
+
+CHECKPOINT_FILENAME = "checkpoint.pkl"
+
+def write_checkpoint(path, state):
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        pickle.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_checkpoint(path):
+    """Returns the state saved in the checkpoint at `path`,
+    or None if there is no (readable) checkpoint."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception as ex:
+        print("Could not load checkpoint %s (%s); starting over" % (path, ex))
+        return None
+
+def remove_checkpoint(path):
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,99 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+On-disk cache of collected results, used by gather_results.py
+so that gathering again only calls `Result.collect` for trials
+whose result files are new or have changed.
+
+The cache lives in .sciex_cache/collected/ under the experiment
+root, one file per trial. An entry for a result type is reused
+only if the size and modification time of all of its result
+files are unchanged, and the result type has not changed: either
+its `COLLECT_VERSION` was bumped, the code of its `collect`
+method was edited, or one of its `COLLECT_ATTRS` was set to
+another value.
+"""
+import hashlib
+import marshal
+import os
+import pickle
+import shutil
+
+CACHE_DIRNAME = ".sciex_cache"
+
+def file_signature(paths):
+    """Returns a tuple of (size, mtime) of the files in `paths`,
+    or None if any of them does not exist."""
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        signature.append((st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+def result_type_version(result_type):
+    """Identifies the version of a Result class, so that cached
+    results are invalidated when the class changes."""
+    try:
+        code = marshal.dumps(result_type.collect.__func__.__code__)
+        code_hash = hashlib.sha1(code).hexdigest()
+    except (AttributeError, ValueError):
+        code_hash = None
+    # class attributes that collect reads, e.g. the format of CSV files
+    attrs = tuple((name, getattr(result_type, name, None))
+                  for name in getattr(result_type, "COLLECT_ATTRS", ()))
+    attrs_hash = hashlib.sha1(repr(attrs).encode()).hexdigest() if len(attrs) > 0 else None
+    return (result_type.__module__, result_type.__qualname__,
+            getattr(result_type, "COLLECT_VERSION", 0), code_hash, attrs_hash)
+
+
+class CollectionCache:
+    def __init__(self, exp_path):
+        self.path = os.path.join(exp_path, CACHE_DIRNAME, "collected")
+
+    def _entry_path(self, trial_name):
+        return os.path.join(self.path, trial_name + ".pkl")
+
+    def load(self, trial_name):
+        """Returns the cache entry of the trial; This is a dictionary
+        that maps from "trial" to (signature of trial.pkl, trial class)
+        and from each result type's version to (signature of its result
+        files, collected result)."""
+        try:
+            with open(self._entry_path(trial_name), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception:
+            # A corrupted entry (e.g. from an interrupted write, or
+            # from a result class that no longer exists) is ignored
+            return {}
+
+    def store(self, trial_name, entry):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (self._entry_path(trial_name), os.getpid())
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entry, f)
+        os.replace(tmp_path, self._entry_path(trial_name))
+
+    def evict(self, trial_names):
+        """Removes the entries of trials not in `trial_names`.
+        Returns the number of entries removed."""
+        if not os.path.exists(self.path):
+            return 0
+        keep = set(trial_names)
+        count = 0
+        for fname in os.listdir(self.path):
+            if fname.endswith(".pkl") and fname[:-len(".pkl")] in keep:
+                continue
+            os.remove(os.path.join(self.path, fname))
+            count += 1
+        return count
+
+    def clear(self):
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
@@ -3,15 +3,27 @@
 # Usage of this file is licensed under the MIT License.
 
 from datetime import datetime as dt
-import concurrent.futures
 import traceback
 import os
 import shutil
-import yaml
 import pickle
 import math
+import numbers
+import collections
+import time
 from pprint import pprint
-import sciex.util as util
+from sciex.trial_queue import TrialQueue
+from sciex.scheduling import load_runtimes, estimate_costs, lpt_partition
+from sciex.manifest import append_records, generated_record, start_manifest, load_index
+from sciex.trial_store import TrialStore
+from sciex.checkpoint import read_checkpoint, write_checkpoint
+from sciex.event_log import EventLogWriter
+from sciex.serialization import (dedup_config_values, serialize_trials,
+                                 resolve_blobs, BLOBS_DIRNAME)
+
+__all__ = ["Event", "Experiment", "Trial", "Result", "ABS_PATH",
+           # modules that `from sciex import *` has always provided
+           "dt", "traceback", "os", "shutil", "pickle", "math", "pprint"]
 
 ABS_PATH = os.path.dirname(os.path.abspath(__file__))
 
@@ -21,17 +33,83 @@ class Event:
     ERROR = "Error"
     SUCCESS = "Success"
 
-    def __init__(self, description, kind="Normal"):
+    # Trials may log many events; slots and a float timestamp keep them small
+    __slots__ = ("_description", "_kind", "_time")
+
+    def __init__(self, description, kind="Normal", timestamp=None):
         self._description = description
         self._kind = kind
-        self._time = dt.now()
+        self._time = time.time() if timestamp is None else timestamp
+
+    @property
+    def description(self):
+        return self._description
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def time(self):
+        """Unix timestamp of the event"""
+        return self._time
 
     def __str__(self):
-        return "%s Event (%s): %s" % (str(self._time), self._kind, self._description)
+        return "%s Event (%s): %s" % (str(dt.fromtimestamp(self._time)), self._kind, self._description)
 
     def __repr__(self):
         return str(self)
 
+    def to_dict(self):
+        return {"time": self._time, "kind": self._kind, "description": str(self._description)}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["description"], kind=d["kind"], timestamp=d["time"])
+
+    def __getstate__(self):
+        return {"_description": self._description, "_kind": self._kind, "_time": self._time}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            # (dict state, slots state)
+            state = dict(state[0] or {}, **(state[1] or {}))
+        self._description = state["_description"]
+        self._kind = state["_kind"]
+        self._time = state["_time"]
+        if isinstance(self._time, dt):
+            # pickled before events had float timestamps
+            self._time = self._time.timestamp()
+
+
+# Number of trials pickled at a time when generating an experiment
+GENERATE_CHUNK_SIZE = 1000
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+class _LazyTrials:
+    """Trials of a lazy sequence, with `verbose` set as they are made"""
+    def __init__(self, trials, verbose):
+        self._trials = trials
+        self._verbose = verbose
+
+    def __iter__(self):
+        for trial in self._trials:
+            trial.verbose = self._verbose
+            yield trial
+
+    def __len__(self):
+        return len(self._trials)
+
 
 class Experiment:
     """One experiment simply groups a set of trials together.
@@ -39,6 +117,7 @@ class Experiment:
     def __init__(self, name, trials, outdir, groups=None,
                  logging=True, verbose=False, add_timestamp=True):
         """
+        trials: a list of trials, or a lazy sequence of trials (see sciex.sweep)
         outdir: The root directory to organize all experiment results.
         groups: maps from group_name to a list of trial names in that group
         """
@@ -48,16 +127,22 @@ class Experiment:
             self.name = "%s_%s" % (name, start_time_str)
         else:
             self.name = name
-        self.trials = trials
-        self._name_to_trial = {trial.name : trial for trial in self.trials}
+        if isinstance(trials, (list, tuple)):
+            self.trials = trials
+            self._name_to_trial = {trial.name : trial for trial in self.trials}
+            for t in trials:
+                t.verbose = verbose
+        else:
+            # A lazy sequence of trials (e.g. from sciex.sweep), made
+            # only while the run scripts are generated.
+            self.trials = _LazyTrials(trials, verbose)
+            self._name_to_trial = None
         self._groups = {}
         if groups is not None:
             self._groups = groups
         self._outdir = outdir
         self._logging = logging
         self._trial_paths = {}  # map from trial path to set{(result_type, result_filename)...}
-        for t in trials:
-            t.verbose = verbose
 
     def add_group(self, group_name, trial_names, extend=True):
         if group_name not in self._groups:
@@ -68,7 +153,9 @@ class Experiment:
             else:
                 raise ValueError("group {} already exists.".format(group_name))
 
-    def generate_trial_scripts_by_groups(self, prefix="run", exist_ok=False, split=1, evenly=True, timeout=None):
+    def generate_trial_scripts_by_groups(self, prefix="run", exist_ok=False, split=1, evenly=True, timeout=None,
+                                         queue=False, balance=False, history=None, packed=False,
+                                         num_workers=1, dedup_threshold=None):
         # For each group, generate run scripts for trials in that group.
         # The split is within-group split.
         exp_path = os.path.join(self._outdir, self.name)
@@ -76,57 +163,166 @@ class Experiment:
             raise ValueError("Experiment already exists at", exp_path)
         for group_name in self._groups:
             names = self._groups[group_name]
-            trials_in_group = [self._name_to_trial[name]
-                               for name in names]
+            if self._name_to_trial is not None:
+                trials_in_group = [self._name_to_trial[name]
+                                   for name in names]
+            else:
+                # goes through all trials once per group
+                names = set(names)
+                trials_in_group = (trial for trial in self.trials
+                                   if trial.name in names)
             Experiment.GENERATE_TRIAL_SCRIPTS(exp_path,
                                               trials_in_group, prefix="{}_{}".format(prefix, group_name),
-                                              exist_ok=True, split=split, evenly=evenly, timeout=timeout)
-
-    def generate_trial_scripts(self, prefix="run", split=4, exist_ok=False, evenly=True, timeout=None):
+                                              exist_ok=True, split=split, evenly=evenly, timeout=timeout,
+                                              queue=queue, balance=balance, history=history,
+                                              packed=packed, num_workers=num_workers,
+                                              dedup_threshold=dedup_threshold)
+
+    def generate_trial_scripts(self, prefix="run", split=4, exist_ok=False, evenly=True, timeout=None,
+                               queue=False, balance=False, history=None, packed=False,
+                               num_workers=1, dedup_threshold=None):
         Experiment.GENERATE_TRIAL_SCRIPTS(os.path.join(self._outdir, self.name),
                                           self.trials, prefix=prefix, split=split,
-                                          exist_ok=exist_ok, evenly=evenly, timeout=timeout)
+                                          exist_ok=exist_ok, evenly=evenly, timeout=timeout,
+                                          queue=queue, balance=balance, history=history,
+                                          packed=packed, num_workers=num_workers,
+                                          dedup_threshold=dedup_threshold)
 
     @classmethod
     def GENERATE_TRIAL_SCRIPTS(cls, exp_path,
-                               trials, prefix="run", split=4, exist_ok=False, evenly=True, timeout=None):
-        """Generate shell scripts to run trials."""
+                               trials, prefix="run", split=4, exist_ok=False, evenly=True, timeout=None,
+                               queue=False, balance=False, history=None, packed=False,
+                               num_workers=1, dedup_threshold=None):
+        """Generate shell scripts to run trials.
+
+        `trials` can be a list, or any iterable of trials, such as a
+        lazy sequence from sciex.sweep; the trials are pickled a chunk
+        at a time, and not kept.
+
+        If `queue` is True, the trials are also added to the experiment's
+        trial queue, so that they can be run by `python -m sciex.worker`
+        instead of (or alongside) the run scripts.
+
+        If `balance` is True, trials are split by expected runtime instead
+        of by count (see sciex.scheduling). The expected runtime of a trial
+        is its `cost_hint`, or estimated from the measured runtimes of
+        similar trials in `exp_path` and in the experiment directories
+        listed in `history`.
+
+        If `packed` is True, the trials are pickled into a single packed
+        store (see sciex.trial_store) instead of one trial.pkl per trial
+        directory; trial directories are then created when trials start.
+
+        If `num_workers` > 1, trials are pickled by that many processes.
+
+        If `dedup_threshold` is given, top-level config values whose pickled
+        size is at least that many bytes are stored once in a blob store
+        (see sciex.serialization) and referenced by the trials, instead of
+        being pickled into every trial."""
         os.makedirs(exp_path, exist_ok=exist_ok)
-        # Dump the pickle files
-        for trial in trials:
-            trial_path = os.path.join(exp_path, trial.name)
-            trial.trial_path = trial_path
-            if not exist_ok and os.path.exists(os.path.join(trial_path, "trial.pkl")):
-                print("sciex: trial.pkl for %s already exists" % (trial.name))
-                continue
-            if not os.path.exists(trial_path):
-                os.makedirs(trial_path)
-            with open(os.path.join(trial_path, "trial.pkl"), "wb") as f:
-                pickle.dump(trial, f)
+        try:
+            print("Generating %d trials" % len(trials))
+        except TypeError:
+            # a generator
+            pass
+        # Dump the pickle files, a chunk of trials at a time, so that
+        # lazily made trials (see sciex.sweep) are not all in memory;
+        # only their names (and cost hints) are kept for the scripts.
+        store = TrialStore(exp_path) if packed else None
+        trial_names = []
+        hints = []
+        blob_digests = set()
+        for chunk in _chunks(trials, GENERATE_CHUNK_SIZE):
+            trials_to_dump = []
+            for trial in chunk:
+                trial_names.append(trial.name)
+                if balance:
+                    hints.append(getattr(trial, "cost_hint", None))
+                trial_path = os.path.join(exp_path, trial.name)
+                trial.trial_path = trial_path
+                if packed:
+                    if not exist_ok and trial.name in store:
+                        print("sciex: %s already exists in the trial store" % (trial.name))
+                        continue
+                else:
+                    if not exist_ok and os.path.exists(os.path.join(trial_path, "trial.pkl")):
+                        print("sciex: trial.pkl for %s already exists" % (trial.name))
+                        continue
+                    if not os.path.exists(trial_path):
+                        os.makedirs(trial_path)
+                trials_to_dump.append(trial)
+
+            blob_refs = None
+            if dedup_threshold is not None:
+                blob_refs = dedup_config_values(trials_to_dump, exp_path, dedup_threshold)
+                blob_digests.update(ref.digest for ref in blob_refs.values())
+            if packed:
+                data = serialize_trials(trials_to_dump, blob_refs, num_workers=num_workers)
+                store.append([(trial.name, data[i]) for i, trial in enumerate(trials_to_dump)])
+            else:
+                serialize_trials(trials_to_dump, blob_refs,
+                                 paths=[os.path.join(exp_path, trial.name, "trial.pkl")
+                                        for trial in trials_to_dump],
+                                 num_workers=num_workers)
+        if dedup_threshold is not None:
+            print("Stored %d large config values in %s" % (len(blob_digests), BLOBS_DIRNAME))
+
+        Experiment.GENERATE_RUN_SCRIPTS(exp_path, trial_names, prefix=prefix, split=split,
+                                        evenly=evenly, timeout=timeout, queue=queue,
+                                        balance=balance, history=history,
+                                        hints=hints)
+
+    @classmethod
+    def GENERATE_RUN_SCRIPTS(cls, exp_path, trial_names, prefix="run", split=4, evenly=True,
+                             timeout=None, queue=False, balance=False, history=None, hints=None):
+        """Generate shell scripts to run the trials named `trial_names`,
+        which are already saved in `exp_path`, and copy the runner, status
+        and gather scripts there (see GENERATE_TRIAL_SCRIPTS). `hints` are
+        the cost hints of the trials, used if `balance` is True."""
+        # trials generated before the manifest existed are recorded too
+        if start_manifest(exp_path, trial_names):
+            print("Built the manifest from the existing trials")
 
         # copy runner script
         shutil.copyfile(os.path.join(ABS_PATH, "trial_runner.py"),
                         os.path.join(exp_path, "trial_runner.py"))
 
         # Generate shell scripts
-        if evenly:
-            print("Will split trials EVENLY with probably fewer total splits.")
-            batchsize = int(math.ceil((len(trials) / split)))
+        splits = []
+        if balance:
+            print("Will split trials by EXPECTED RUNTIME, longest trials first.")
+            runtimes = load_runtimes([exp_path] + list(history or []))
+            costs = estimate_costs(trial_names, runtimes, hints=hints)
+            for i, indices in enumerate(lpt_partition(costs, split)):
+                if len(indices) == 0:
+                    break
+                print("Generating script for %d trials with expected cost %.2f (split=%d)"
+                      % (len(indices), sum(costs[j] for j in indices), i))
+                splits.append([trial_names[j] for j in indices])
         else:
-            print("Will split trials EXACTLY with given total splits"\
-                  "but the last split may contain more trials.")
-            batchsize = len(trials) // split
-
-        for i in range(split):
-            begin = i*batchsize
-            if begin >= len(trials):
-                break
-            end = min((i+1)*batchsize, len(trials))
-
-            print("Generating script for trials [%d-%d] (split=%d)" % (begin+1, end, i))
+            if evenly:
+                print("Will split trials EVENLY with probably fewer total splits.")
+                batchsize = int(math.ceil((len(trial_names) / split)))
+            else:
+                print("Will split trials EXACTLY with given total splits"\
+                      "but the last split may contain more trials.")
+                batchsize = len(trial_names) // split
+
+            for i in range(split):
+                begin = i*batchsize
+                if begin >= len(trial_names):
+                    break
+                end = min((i+1)*batchsize, len(trial_names))
+                print("Generating script for trials [%d-%d] (split=%d)" % (begin+1, end, i))
+                splits.append(trial_names[begin:end])
+
+        manifest_records = []
+        for i, names_in_split in enumerate(splits):
             shellscript_path = os.path.join(exp_path, "%s_%d.sh" % (prefix, i))
-            with open(os.open(shellscript_path, os.O_CREAT | os.O_WRONLY, 0o777), "w") as f:
-                for trial in trials[begin:end]:
+            manifest_records.extend(generated_record(trial_name, os.path.basename(shellscript_path))
+                                    for trial_name in names_in_split)
+            with open(os.open(shellscript_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o777), "w") as f:
+                for trial_name in names_in_split:
                     if os.path.isabs(exp_path):
                         dirpath = exp_path
                     else:
@@ -136,9 +332,19 @@ class Experiment:
                         cmd_prefix += "timeout %s " % timeout
                     f.write("%spython trial_runner.py \"%s\" \"%s\" --logging\n"
                             % (cmd_prefix,
-                               os.path.join(dirpath, trial.name, "trial.pkl"),
+                               os.path.join(dirpath, trial_name, "trial.pkl"),
                                os.path.join(dirpath)))
 
+        # trials generated again into the same script are recorded once
+        index = load_index(exp_path)
+        append_records(exp_path, [record for record in manifest_records
+                                  if record["trial"] not in index
+                                  or record["script"] not in index[record["trial"]]["scripts"]])
+
+        if queue:
+            num_added = TrialQueue(exp_path).add(trial_names)
+            print("Added %d trials to the trial queue" % num_added)
+
         # Copy gather results script
         shutil.copyfile(os.path.join(ABS_PATH, "gather_results.py"),
                         os.path.join(exp_path, "gather_results.py"))
@@ -154,19 +360,36 @@ class Trial:
     # used in verifying config.
     REQUIRED_CONFIGS = []
 
+    # Minimum number of seconds between two checkpoints written by
+    # `checkpoint()` (see sciex.checkpoint).
+    CHECKPOINT_INTERVAL = 300
+
+    # Whether results of this trial may be reused for identical trials (same
+    # class, config and seed) through the result cache (see sciex.result_cache);
+    # bump CACHE_VERSION to invalidate the cached results of this class.
+    CACHEABLE = True
+    CACHE_VERSION = 0
+
+    # Number of events kept in memory while a runner streams the
+    # events of this trial to log.jsonl (see sciex.event_log)
+    LOG_MAXLEN = 10000
+
     @staticmethod
     def verify_name(name):
         if len(name.split("_")) != 2 and len(name.split("_")) != 3:
             return False
         return True
 
-    def __init__(self, name, config, verbose=False):
+    def __init__(self, name, config, verbose=False, cost_hint=None):
         """
         Trial name convention: "{trial-global-name}_{seed}_{specific-setting-name}"
 
         Example: gridworld4x4_153_value-iteration-200.
 
         The ``seed'' is optional. If not provided, then there should be only one underscore.
+
+        cost_hint: Expected runtime (in any consistent unit) of this trial;
+            used to balance run scripts when generating them with balance=True.
         """
         # Verify name format
         if not Trial.verify_name(name):
@@ -200,20 +423,110 @@ class Trial:
         self.trial_path = None
         # Shared resource for running in batch
         self._resource = None
+        self.cost_hint = cost_hint
 
     @property
     def config(self):
+        if isinstance(self._config, dict):
+            # Large config values may be stored separately (see sciex.serialization)
+            resolve_blobs(self._config)
         return self._config
 
     def run(self, logging=False):
         """Returns a list of Result objects"""
         raise NotImplemented
 
+    def save_checkpoint(self):
+        """Returns the state of a running trial to checkpoint (any picklable
+        object), so that `run` can continue from it after `load_checkpoint`.
+        Returns None if the trial does not support checkpoints (default)."""
+        return None
+
+    def load_checkpoint(self, state):
+        """Restores the state returned by `save_checkpoint`. Called by
+        the runners before `run` when resuming from a checkpoint."""
+        raise NotImplementedError
+
+    def checkpoint(self, force=False):
+        """May be called during trial.run(), e.g. once per iteration. Writes
+        a checkpoint if CHECKPOINT_INTERVAL seconds have passed since the last
+        one (or if `force`), and the trial is run by a runner. Returns True
+        if a checkpoint was written."""
+        path = getattr(self, "_checkpoint_path", None)
+        if path is None:
+            return False
+        now = time.time()
+        if not force and now - self._last_checkpoint_time < self.CHECKPOINT_INTERVAL:
+            return False
+        state = self.save_checkpoint()
+        self._last_checkpoint_time = now
+        if state is None:
+            return False
+        # the events logged so far are written to the log stream, and
+        # the stream is cut back to this point when resuming
+        log_offset = None
+        writer = getattr(self, "_log_writer", None)
+        if writer is not None:
+            log_offset = writer.flush()
+        write_checkpoint(path, {"state": state, "log": self._log, "log_offset": log_offset})
+        return True
+
+    def resume(self, checkpoint_path):
+        """Sets where `checkpoint()` writes checkpoints, and restores the
+        trial from the checkpoint there, if any. Returns True if resumed.
+
+        If the log is streamed (see `start_log_stream`), the events that
+        an earlier, interrupted run logged after its last checkpoint (or
+        all of them, if there is no checkpoint) are removed from it."""
+        self._checkpoint_path = checkpoint_path
+        self._last_checkpoint_time = time.time()
+        saved = read_checkpoint(checkpoint_path)
+        writer = getattr(self, "_log_writer", None)
+        if saved is None:
+            if writer is not None:
+                writer.truncate(0)
+            return False
+        self.load_checkpoint(saved["state"])
+        # replace the contents, not the container (see start_log_stream)
+        self._log.clear()
+        self._log.extend(saved["log"])
+        if writer is not None:
+            log_offset = saved.get("log_offset")
+            if log_offset is None or not writer.truncate(log_offset):
+                # the stream does not match the checkpoint; write it
+                # again from the events in the checkpoint
+                writer.truncate(0)
+                for event in saved["log"]:
+                    writer.write(event)
+        self.log_event(Event("Resumed from checkpoint %s" % checkpoint_path))
+        return True
+
+    def start_log_stream(self, path):
+        """Streams the events logged from now on to the JSONL file `path`,
+        keeping only the last LOG_MAXLEN events in memory."""
+        self._log_writer = EventLogWriter(path)
+        self._log = collections.deque(self._log, maxlen=self.LOG_MAXLEN)
+
+    def stop_log_stream(self):
+        writer = getattr(self, "_log_writer", None)
+        if writer is not None:
+            writer.close()
+            self._log_writer = None
+
     def log_event(self, event):
         """May be called during trial.run()"""
         if self.verbose:
             print(str(event))
         self._log.append(event)
+        writer = getattr(self, "_log_writer", None)
+        if writer is not None:
+            writer.write(event)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the log writer holds a thread and an open file
+        state.pop("_log_writer", None)
+        return state
 
     @property
     def log(self):
@@ -251,12 +564,18 @@ class Trial:
     def gather_results(cls, results):
         """Given a dictionary produced by `gather_results.py`
         of the format result_type -> {global_name -> {specific_name -> {seed -> actual_result}}},
-        return a gathered result of each result type"""
+        return a gathered result of each result type.
+
+        For streaming result types (see Result.STREAMING), {seed -> actual_result}
+        is replaced by the accumulator of the results."""
         gathered_results = {}
         for result_type in results:
             gathered_results[result_type] = {}
             for global_name in results[result_type]:
-                gr = result_type.gather(results[result_type][global_name])
+                if getattr(result_type, "STREAMING", False):
+                    gr = result_type.finalize(results[result_type][global_name])
+                else:
+                    gr = result_type.gather(results[result_type][global_name])
                 if gr is None:
                     continue
                 gathered_results[result_type][global_name] = gr
@@ -285,6 +604,23 @@ class Trial:
         return errors
 
 class Result:
+
+    # Bump this to invalidate results of this type cached by gather_results.py,
+    # e.g. when `collect` depends on code other than the method itself.
+    COLLECT_VERSION = 0
+
+    # Names of class attributes that change what `collect` returns (e.g.
+    # the format of the file); cached results of this type are invalidated
+    # when their values change.
+    COLLECT_ATTRS = ()
+
+    # Set this to True to gather results of this type in a streaming fashion:
+    # gather_results.py then folds each collected result into an accumulator
+    # (see `init_accumulator`, `accumulate`) and discards it, instead of
+    # keeping all results in memory for `gather`. `finalize` is called in
+    # place of `gather`.
+    STREAMING = False
+
     @classmethod
     def collect(cls, path):
         """path can be a str of a list of paths"""
@@ -315,6 +651,47 @@ class Result:
         Returns a more understandable interpretation of these results"""
         return None
 
+    @classmethod
+    def to_columns(cls, result):
+        """Returns a mapping from column name to a scalar, the metrics of
+        one collected result to put in the results table (see sciex.table).
+        By default, a numeric result becomes one column named after the
+        class, and a dict result contributes its numeric values."""
+        name = cls.__name__
+        if isinstance(result, numbers.Number) and not isinstance(result, bool):
+            return {name: result}
+        elif isinstance(result, dict):
+            return {"%s.%s" % (name, key): value
+                    for key, value in result.items()
+                    if isinstance(value, numbers.Number) and not isinstance(value, bool)}
+        return {}
+
+    @classmethod
+    def init_accumulator(cls):
+        """Returns an empty accumulator (see sciex.accumulators) for
+        results of one specific_name. Used if STREAMING is True."""
+        raise NotImplementedError
+
+    @classmethod
+    def accumulate(cls, accumulator, seed, result):
+        """Folds the result of one trial into the accumulator and
+        returns the accumulator. Used if STREAMING is True."""
+        accumulator.update(result)
+        return accumulator
+
+    @classmethod
+    def merge_accumulators(cls, accumulator, other):
+        """Merges two accumulators of partial results and returns the
+        merged accumulator. Used if STREAMING is True."""
+        return accumulator.merge(other)
+
+    @classmethod
+    def finalize(cls, accumulators):
+        """`accumulators` is a mapping from specific_name to an accumulator.
+        Returns what `gather` would return. Used if STREAMING is True."""
+        return {specific_name: accumulators[specific_name].finalize()
+                for specific_name in accumulators}
+
     @classmethod
     def save_gathered_results(cls, results, path):
         """results is a mapping from global_name to the object returned by `gather()`.
@@ -0,0 +1,248 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+coordinator: Hands out the trials of an experiment to workers on any
+number of computers over HTTP, so that the work is shared by whoever
+is free instead of by a ratio fixed in advance (as with divide.py).
+The coordinator owns the trial queue (see sciex.trial_queue); the
+workers only need to see the experiment directory, to load trials and
+save results, and to reach the coordinator. For example:
+
+$ python -m sciex.coordinator path/to/experiment --init --port 8765
+$ python -m sciex.worker path/to/experiment --coordinator http://HOST:8765   # on every node
+
+Workers send a heartbeat every few seconds while they run a trial. If
+a worker is not heard from for --heartbeat-timeout seconds, it is
+considered dead and its trials are handed out again. The coordinator
+prints, and serves at /status, the progress and the throughput of
+each node.
+
+Endpoints (JSON in and out):
+    POST /claim      {"worker"}                -> {"trial": name or null}
+    POST /heartbeat  {"worker", "trials"}      -> {"ok": true}
+    POST /done       {"worker", "trial", "ok"} -> {"ok": false if the trial was
+                                                  handed out to another worker}
+    GET  /status                               -> counts, workers and nodes
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sciex.trial_queue import TrialQueue
+
+DEFAULT_PORT = 8765
+
+
+class WorkerInfo:
+    def __init__(self, worker, host):
+        self.worker = worker
+        self.host = host
+        self.last_seen = time.time()
+        self.trials = set()
+        self.done = 0
+        self.failed = 0
+
+
+class Coordinator:
+    def __init__(self, exp_path, heartbeat_timeout=60, window=600):
+        """
+        heartbeat_timeout: seconds after which a silent worker is considered dead
+        window: node throughput is measured over the last `window` seconds
+        """
+        self.queue = TrialQueue(exp_path)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.window = window
+        self.workers = {}
+        self.completions = {}    # host -> completion times in the window
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+
+    def _worker(self, worker, host=None):
+        if worker not in self.workers:
+            self.workers[worker] = WorkerInfo(worker, host or worker.split(":")[0])
+        info = self.workers[worker]
+        info.last_seen = time.time()
+        return info
+
+    def claim(self, worker, host=None):
+        with self._lock:
+            info = self._worker(worker, host)
+            trial_name = self.queue.claim(worker)
+            if trial_name is not None:
+                info.trials.add(trial_name)
+            return trial_name
+
+    def heartbeat(self, worker, trials=None, host=None):
+        with self._lock:
+            info = self._worker(worker, host)
+            if trials is not None:
+                info.trials = set(trials)
+
+    def done(self, worker, trial_name, ok=True):
+        """Records that `worker` finished the trial. Returns False if the
+        trial is no longer claimed by the worker (e.g. it was considered
+        dead, and the trial was handed out to another worker)."""
+        with self._lock:
+            info = self._worker(worker)
+            info.trials.discard(trial_name)
+            if ok:
+                if not self.queue.mark_done(trial_name, worker):
+                    return False
+                info.done += 1
+                self.completions.setdefault(info.host, []).append(time.time())
+            else:
+                if not self.queue.mark_failed(trial_name, worker):
+                    return False
+                info.failed += 1
+            return True
+
+    def reassign_dead(self):
+        """Puts the trials of workers that have not been heard from
+        within the heartbeat timeout back to pending. Returns the
+        names of the trials put back."""
+        now = time.time()
+        with self._lock:
+            released = []
+            for trial_name, worker, _ in self.queue.running():
+                info = self.workers.get(worker)
+                # Workers from before the coordinator (re)started get
+                # a heartbeat timeout to show up.
+                last_seen = info.last_seen if info is not None else self.start_time
+                if now - last_seen > self.heartbeat_timeout:
+                    released.append(trial_name)
+                    if info is not None:
+                        info.trials.discard(trial_name)
+            if len(released) > 0:
+                self.queue.release(released)
+            return released
+
+    def status(self):
+        now = time.time()
+        with self._lock:
+            nodes = {}
+            for host, times in self.completions.items():
+                self.completions[host] = [t for t in times if t >= now - self.window]
+            for info in self.workers.values():
+                node = nodes.setdefault(info.host, {"workers": 0, "alive": 0, "running": 0,
+                                                    "done": 0, "failed": 0})
+                node["workers"] += 1
+                if now - info.last_seen <= self.heartbeat_timeout:
+                    node["alive"] += 1
+                node["running"] += len(info.trials)
+                node["done"] += info.done
+                node["failed"] += info.failed
+            span = max(60.0, min(self.window, now - self.start_time))
+            for host, node in nodes.items():
+                node["trials_per_min"] = len(self.completions.get(host, [])) / span * 60
+            return {"counts": self.queue.counts(), "nodes": nodes}
+
+
+def format_status(status):
+    counts = status["counts"]
+    total = sum(counts.values())
+    lines = ["%s  done %d/%d, running %d, pending %d, failed %d"
+             % (time.strftime("%H:%M:%S"), counts["done"], total, counts["running"],
+                counts["pending"], counts["failed"])]
+    for host in sorted(status["nodes"]):
+        node = status["nodes"][host]
+        lines.append("  %-24s workers %d/%d alive  running %d  done %d  failed %d  %.2f trials/min"
+                     % (host, node["alive"], node["workers"], node["running"],
+                        node["done"], node["failed"], node["trials_per_min"]))
+    return "\n".join(lines)
+
+
+def make_handler(coordinator):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, obj, code=200):
+            data = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/status":
+                self._reply(coordinator.status())
+            else:
+                self._reply({"error": "not found"}, 404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+                worker = body["worker"]
+                if self.path == "/done":
+                    trial_name = body["trial"]
+            except (ValueError, KeyError, TypeError):
+                self._reply({"error": "bad request"}, 400)
+                return
+            if self.path == "/claim":
+                self._reply({"trial": coordinator.claim(worker, body.get("host"))})
+            elif self.path == "/heartbeat":
+                coordinator.heartbeat(worker, body.get("trials"), body.get("host"))
+                self._reply({"ok": True})
+            elif self.path == "/done":
+                self._reply({"ok": coordinator.done(worker, trial_name, body.get("ok", True))})
+            else:
+                self._reply({"error": "not found"}, 404)
+
+        def log_message(self, format, *args):
+            # requests are too frequent to log
+            pass
+    return Handler
+
+
+def serve(coordinator, host="0.0.0.0", port=DEFAULT_PORT, report_interval=30):
+    server = ThreadingHTTPServer((host, port), make_handler(coordinator))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print("Coordinator listening on %s:%d" % (host, server.server_address[1]))
+    last_report = 0
+    try:
+        while True:
+            time.sleep(min(5, coordinator.heartbeat_timeout / 2))
+            released = coordinator.reassign_dead()
+            if len(released) > 0:
+                print("Reassigning %d trials of dead workers: %s"
+                      % (len(released), ", ".join(released)))
+            if time.time() - last_report >= report_interval:
+                print(format_status(coordinator.status()), flush=True)
+                last_report = time.time()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the trials of an experiment to workers over HTTP.")
+    parser.add_argument("exp_path", type=str,
+                        help="Path to experiment root")
+    parser.add_argument("--host", type=str, default="0.0.0.0",
+                        help="Address to listen on (default: all interfaces)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--init", action="store_true",
+                        help="Enqueue the trials in the run scripts first")
+    parser.add_argument("--prefix", type=str, default="run",
+                        help="Prefix of the run scripts to enqueue with --init")
+    parser.add_argument("--heartbeat-timeout", type=float, default=60,
+                        help="Seconds without a heartbeat after which a worker's trials are reassigned")
+    parser.add_argument("--report-interval", type=float, default=30,
+                        help="Seconds between status reports")
+    args = parser.parse_args()
+
+    exp_path = os.path.abspath(args.exp_path)
+    if args.init:
+        from sciex.worker import enqueue_run_scripts
+        print("Enqueued %d trials" % enqueue_run_scripts(exp_path, prefix=args.prefix))
+    coordinator = Coordinator(exp_path, heartbeat_timeout=args.heartbeat_timeout)
+    serve(coordinator, host=args.host, port=args.port, report_interval=args.report_interval)
+
+if __name__ == "__main__":
+    main()
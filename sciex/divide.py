@@ -7,10 +7,117 @@ Divide running scripts by computers. This is useful
 for the case where you have generated a lot of running
 scripts (each runs multiple trials) and you want to
 add another level of grouping.
+
+With --by-trial, the unfinished trials of the run scripts (rather
+than whole scripts) are divided so that all computers finish at
+about the same time, given the expected runtime of each trial and
+the measured speed of each computer. The speeds come from
+calibration runs, made by running on each computer
+
+$ python -m sciex.divide path_to_experiment --calibrate [trial_name]
+
+which times one sample trial and saves the result under calibration/
+in the experiment, or else from the runtimes of trials that have
+finished on the computers before (the host in their metrics.json,
+in this experiment or those given by --history).
 """
 import math
 import argparse
+import json
 import os
+import socket
+import time
+from sciex.check_status import (load_trial_names_in_run_script, trial_name_in_command,
+                                trial_completed)
+from sciex.manifest import load_index, manifest_path
+from sciex.scheduling import (load_runtimes, estimate_costs, lpt_partition,
+                              load_host_runtimes, host_speeds, CALIBRATION_DIRNAME)
+
+def calibrate(exp_path, trial_name=None):
+    """Runs a sample trial (the first one of the experiment by default)
+    on this computer, without saving its results, and records how long
+    it took in calibration/{host}.json. Returns the time in seconds."""
+    from sciex.trial_store import trial_names, load_trial
+    if trial_name is None:
+        trial_name = trial_names(exp_path)[0]
+    trial = load_trial(exp_path, trial_name)
+    print("Calibrating with trial {}...".format(trial_name))
+    start_time = time.time()
+    trial.run(logging=False)
+    seconds = time.time() - start_time
+    host = socket.gethostname()
+    os.makedirs(os.path.join(exp_path, CALIBRATION_DIRNAME), exist_ok=True)
+    with open(os.path.join(exp_path, CALIBRATION_DIRNAME, host + ".json"), "w") as f:
+        json.dump({"host": host, "trial": trial_name, "seconds": seconds}, f)
+    print("{} took {:.2f}s on {}".format(trial_name, seconds, host))
+    return seconds
+
+def measured_speeds(exp_path, history=[]):
+    """Returns (mapping from host to relative speed, source of the
+    measurements), from calibration runs if there are any, or else
+    from the runtimes of finished trials."""
+    calibration_path = os.path.join(exp_path, CALIBRATION_DIRNAME)
+    records = []
+    if os.path.isdir(calibration_path):
+        for fname in sorted(os.listdir(calibration_path)):
+            if fname.endswith(".json"):
+                with open(os.path.join(calibration_path, fname)) as f:
+                    calibration = json.load(f)
+                records.append((calibration["trial"], calibration["host"], calibration["seconds"]))
+    if len(records) > 0:
+        return host_speeds(records), "calibration"
+    return host_speeds(load_host_runtimes([exp_path] + list(history))), "finished trials"
+
+def divide_by_trial(exp_path, run_scripts, computers, num_terminals, ratios, history=[]):
+    """Divides the unfinished trials in `run_scripts` among the
+    computers in proportion to their speed times their number of
+    terminals, and among the terminals of each computer, so that all
+    terminals are expected to finish at about the same time. Writes
+    group_{computer}_{j}.sh with the trial commands."""
+    # The manifest knows which trials have completed without
+    # visiting their directories
+    index = load_index(exp_path) if os.path.exists(manifest_path(exp_path)) else None
+    lines, names, seen = [], [], set()
+    for script in sorted(run_scripts):
+        with open(os.path.join(exp_path, script)) as f:
+            for line in f:
+                trial_name = trial_name_in_command(line)
+                if trial_name is None or trial_name in seen:
+                    continue
+                seen.add(trial_name)
+                if index is not None and trial_name in index:
+                    if index[trial_name]["completed"]:
+                        continue
+                elif trial_completed(os.path.join(exp_path, trial_name)):
+                    # not in the manifest; checked in its directory
+                    continue
+                lines.append(line.rstrip("\n"))
+                names.append(trial_name)
+    costs = estimate_costs(names, load_runtimes([exp_path] + list(history)))
+
+    speeds, source = measured_speeds(exp_path, history)
+    capacities = []
+    for i, computer in enumerate(computers):
+        if computer in speeds:
+            speed = speeds[computer]
+            print("{}: speed {:.2f} (from {}) x {} terminals".format(computer, speed, source, num_terminals[i]))
+        else:
+            speed = ratios[i] * len(ratios) / sum(ratios)
+            print("{}: no measurements; using ratio {:.2f} x {} terminals".format(computer, speed, num_terminals[i]))
+        capacities.append(speed * num_terminals[i])
+
+    partition = lpt_partition(costs, len(computers), capacities=capacities)
+    for i, computer in enumerate(computers):
+        indices = partition[i]
+        print("{} will take {} trials; expected time {:.2f}"
+              .format(computer, len(indices), sum(costs[j] for j in indices) / capacities[i]))
+        for j, terminal_indices in enumerate(lpt_partition([costs[k] for k in indices], num_terminals[i])):
+            if len(terminal_indices) == 0:
+                continue
+            shellscript_path = os.path.join(exp_path, "group_{}_{}.sh".format(computer, j))
+            with open(os.open(shellscript_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o777), "w") as f:
+                for k in terminal_indices:
+                    f.write(lines[indices[k]] + "\n")
 
 def main():
     parser = argparse.ArgumentParser(description="Divide run scripts by computers")
@@ -19,14 +126,35 @@ def main():
                         type=str, nargs="+", help="computers to run",
                         default=[os.uname()[1]])
     parser.add_argument("-n", "--num-terminals", type=int, nargs="+",
-                        help="Number of parallel terminals for running experiments on each computer",
-                        default=[1])
+                        help="Number of parallel terminals for running experiments on each computer."
+                        " The default is 1 for each",
+                        default=None)
     parser.add_argument("-r", "--ratios", type=float, nargs="+",
                         help="ratio all run scripts to run on each computer; e.g. -r 0.1 0.5 0.3 0.1. The default is even",
-                        default=[1.0])
+                        default=None)
     parser.add_argument("--prefix", type=str, help="prefix to run scripts", default="run")
+    parser.add_argument("--balance", action="store_true",
+                        help="Divide run scripts by their expected runtime (estimated from measured"
+                        " runtimes of finished trials) instead of by count. The ratios are then"
+                        " treated as relative speeds of the computers.")
+    parser.add_argument("--history", type=str, nargs="*", default=[],
+                        help="Other experiment directories whose finished trials are used"
+                        " to estimate runtimes for --balance")
+    parser.add_argument("--by-trial", action="store_true",
+                        help="Divide the unfinished trials, instead of the run scripts, by the"
+                        " measured speed of the computers (see --calibrate)")
+    parser.add_argument("--calibrate", type=str, nargs="?", const="", default=None,
+                        help="Time a sample trial (given, or the first) on this computer for --by-trial, and exit")
     args = parser.parse_args()
 
+    if args.calibrate is not None:
+        calibrate(args.exp_path, trial_name=args.calibrate or None)
+        return
+    if args.num_terminals is None:
+        args.num_terminals = [1] * len(args.computers)
+    if args.ratios is None:
+        args.ratios = [1.0] * len(args.computers)
+
     run_scripts = []
     for fname in os.listdir(args.exp_path):
         fullpath = os.path.join(args.exp_path, fname)
@@ -40,21 +168,39 @@ def main():
     assert len(args.computers) == len(args.num_terminals) == len(args.ratios),\
         "arguments to --computers, --num-terminals, --ratios must have the same length"
 
+    if args.by_trial:
+        divide_by_trial(args.exp_path, run_scripts, args.computers,
+                        args.num_terminals, args.ratios, history=args.history)
+        return
+
     # First, divide the run scripts by computers according to ratio
     ratio_sum = sum(args.ratios)
     ratios = [args.ratios[i] / ratio_sum for i in range(len(args.ratios))]
     _by_computers = {}
-    begin = 0
-    end = 0
-    for i in range(len(args.computers)):
-        computer = args.computers[i]
-        ratio = ratios[i]
-        if end <= begin:
-            end += int(math.ceil(ratio*len(run_scripts)))
-            end = min(len(run_scripts), end)
-        print("{} will take {}:{}".format(computer, begin, end))
-        _by_computers[computer] = run_scripts[begin:end]
-        begin = end
+    if args.balance:
+        runtimes = load_runtimes([args.exp_path] + args.history)
+        script_costs = {}
+        for script in run_scripts:
+            trial_names = load_trial_names_in_run_script(os.path.join(args.exp_path, script))
+            script_costs[script] = sum(estimate_costs(trial_names, runtimes))
+        costs = [script_costs[script] for script in run_scripts]
+        partition = lpt_partition(costs, len(args.computers), capacities=ratios)
+        for i, computer in enumerate(args.computers):
+            _by_computers[computer] = [run_scripts[j] for j in partition[i]]
+            print("{} will take {} scripts with expected cost {:.2f}"\
+                  .format(computer, len(partition[i]), sum(costs[j] for j in partition[i])))
+    else:
+        begin = 0
+        end = 0
+        for i in range(len(args.computers)):
+            computer = args.computers[i]
+            ratio = ratios[i]
+            if end <= begin:
+                end += int(math.ceil(ratio*len(run_scripts)))
+                end = min(len(run_scripts), end)
+            print("{} will take {}:{}".format(computer, begin, end))
+            _by_computers[computer] = run_scripts[begin:end]
+            begin = end
 
     # Then, divide the computer run scripts by num_parallel, evenly
     _by_terminals = {computer: []
@@ -62,18 +208,27 @@ def main():
     for i, computer in enumerate(_by_computers):
         scripts = _by_computers[computer]
         num_terminals = args.num_terminals[i]
-        for j in range(num_terminals):
-            batchsize = int(math.ceil(len(scripts) / num_terminals))
-            begin = j*batchsize
-            if begin >= len(scripts):
-                break
-            end = min((j+1)*batchsize, len(scripts))
-
-            print("Generating script for trials [%d-%d] (computer=%s, split=%d)" % (begin+1, end, computer, j))
+        if args.balance:
+            terminal_splits = [[scripts[j] for j in indices] for indices in
+                               lpt_partition([script_costs[script] for script in scripts], num_terminals)]
+        else:
+            terminal_splits = []
+            for j in range(num_terminals):
+                batchsize = int(math.ceil(len(scripts) / num_terminals))
+                begin = j*batchsize
+                if begin >= len(scripts):
+                    break
+                end = min((j+1)*batchsize, len(scripts))
+                print("Generating script for trials [%d-%d] (computer=%s, split=%d)" % (begin+1, end, computer, j))
+                terminal_splits.append(scripts[begin:end])
+
+        for j, scripts_in_split in enumerate(terminal_splits):
+            if len(scripts_in_split) == 0:
+                continue
             shellscript_path = os.path.join(args.exp_path,
                                             "group_{}_{}.sh".format(computer, j))
             with open(os.open(shellscript_path, os.O_CREAT | os.O_WRONLY, 0o777), "w") as f:
-                for script in scripts[begin:end]:
+                for script in scripts_in_split:
                     f.write("source {}\n".format(script))
 
 if __name__ == "__main__":
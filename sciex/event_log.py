@@ -0,0 +1,114 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Streaming event log of a running trial. While a runner runs a trial,
+the events passed to `Trial.log_event` are written to log.jsonl in the
+trial directory (one JSON object per line, with "time", "kind" and
+"description") by a background thread, so that the log survives a
+crash, and the trial only keeps the last `Trial.LOG_MAXLEN` events in
+memory. log.txt is still written, from log.jsonl, when the trial
+finishes.
+"""
+import json
+import os
+import threading
+
+LOG_JSONL_FILENAME = "log.jsonl"
+
+class EventLogWriter:
+    """Appends events to a JSONL file from a background thread.
+    Events are buffered and written every `flush_interval` seconds,
+    or as soon as `buffer_size` events are waiting. If events are
+    logged faster than they can be written, `write` blocks while
+    4 * `buffer_size` events are waiting, to bound memory use."""
+    def __init__(self, path, flush_interval=1.0, buffer_size=1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._closed = False
+        self._cond = threading.Condition()
+        # held while events are taken from the buffer and written, so
+        # that events are written in order by the thread and by `flush`
+        self._file_lock = threading.Lock()
+        # binary, so that offsets in the file are byte offsets
+        self._file = open(path, "ab")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, event):
+        with self._cond:
+            while len(self._buffer) >= 4 * self.buffer_size and not self._closed:
+                self._cond.wait()
+            self._buffer.append(event)
+            if len(self._buffer) >= self.buffer_size:
+                self._cond.notify_all()
+
+    def _write_waiting(self):
+        # called with self._file_lock held
+        with self._cond:
+            events, self._buffer = self._buffer, []
+            closed = self._closed
+            # wake up writers waiting for the buffer to drain
+            self._cond.notify_all()
+        if len(events) > 0:
+            self._file.write("".join(json.dumps(event.to_dict()) + "\n"
+                                     for event in events).encode())
+            self._file.flush()
+        return closed
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._buffer) < self.buffer_size:
+                    self._cond.wait(self.flush_interval)
+            with self._file_lock:
+                closed = self._write_waiting()
+            if closed:
+                break
+
+    def flush(self):
+        """Writes the waiting events now. Returns the size of the file,
+        which includes all events written so far."""
+        with self._file_lock:
+            self._write_waiting()
+            return self._file.tell()
+
+    def truncate(self, offset=0):
+        """Discards the events after byte `offset` of the file, and those
+        waiting to be written. Returns False (and discards nothing) if
+        the file is shorter than `offset`."""
+        with self._file_lock:
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell() < offset:
+                return False
+            with self._cond:
+                self._buffer = []
+                self._cond.notify_all()
+            self._file.truncate(offset)
+            return True
+
+    def close(self):
+        """Writes the remaining events and closes the file"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._file.close()
+
+
+def read_event_log(path):
+    """Yields the events in the JSONL event log at `path`"""
+    from sciex.components import Event
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        for line in f:
+            if not line.endswith("\n"):
+                # partially written when the trial was killed
+                break
+            yield Event.from_dict(json.loads(line))
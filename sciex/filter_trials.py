@@ -5,30 +5,25 @@
 """
 Filter trials.
 """
-import pickle
 import argparse
 import os
 import sys
 from sciex.components import Trial, Experiment
 from sciex.check_status import trial_completed
+from sciex.trial_store import trial_names, load_trial
 
 ABS_PATH = os.path.dirname(os.path.abspath(__file__))
 
 def filter_empty(args):
     os.makedirs(args.output_path, exist_ok=True)
     trials_to_copy = []
-    for fname in os.listdir(args.exp_path):
-        fullpath = os.path.join(args.exp_path, fname)
-        if not os.path.isdir(fullpath):
-            continue
-
-        trial_name = os.path.basename(fname)
+    for trial_name in trial_names(args.exp_path):
+        fullpath = os.path.join(args.exp_path, trial_name)
         if Trial.verify_name(trial_name):
             if trial_completed(fullpath):
                 continue
             else:
-                with open(os.path.join(fullpath, "trial.pkl"), "rb") as f:
-                    trial = pickle.load(f)
+                trial = load_trial(args.exp_path, trial_name)
                 trials_to_copy.append(trial)
                 sys.stdout.write("{} is not completed. Will include.\n".format(trial.name))
                 sys.stdout.flush()
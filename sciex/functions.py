@@ -2,80 +2,221 @@
 # 
 # Usage of this file is licensed under the MIT License.
 
+import json
+import multiprocessing
 import os
 import pickle
 from sciex import Experiment
+from sciex.serialization import dumps_trial, dedup_config_values, BlobRef
+from sciex.trial_store import trial_names, load_trial, get_store, TrialStore
+from sciex.manifest import read_records, manifest_path, start_manifest, GENERATED
+from sciex.scheduling import parse_trial_name
 
-def add_baseline(baseline_name,
-                 path_to_experiment,
-                 trial_func,
-                 save_trials=False,
-                 split=4):
+__all__ = ["add_baseline", "add_baselines", "baseline_index",
+           "Experiment", "os", "pickle"]
+
+BASELINE_INDEX_FILENAME = "baseline_index.json"
+
+def baseline_index(path_to_experiment):
     """
-    Given an experiment folder that possibly already contain,
-    add a baseline to run on some of the same configurations.
-    
-    Args:
-        trial_func (function): A function that maps from
-            (global_name, seed, config (dict)) to a Trial object.
-        save_trials (bool): True if you want to save the baseline trials.
-        split (int): If save_trials is True, this will be the number of splits
-            the saved trials will be divided into, and shell scripts will be generated
-            to run each split.
-        baseline_name (str): Name of the baseline
+    Returns a mapping from (global_name, seed) to the name of a trial
+    in the experiment with that global name and seed, whose config is
+    given to the baseline trial functions.
+
+    The index is saved in the experiment root and read together with
+    the manifest records appended since it was saved, so that it is
+    built only once. An experiment without a manifest gets one, built
+    from its trial directories, so that the index covers all trials.
     """
-    if not os.path.isabs(path_to_experiment):
-        raise ValueError("Path to experiment must be absolute path.")
+    index_path = os.path.join(path_to_experiment, BASELINE_INDEX_FILENAME)
+    start_manifest(path_to_experiment)
+    if not os.path.exists(manifest_path(path_to_experiment)):
+        # no trials
+        return {}
 
-    combinations = set({})
-    new_trials = []
-    
-    for root, dirs, files in os.walk(path_to_experiment):
-        # root: top-level directory (recursive)
-        # dirs: direct subdirectories of root
-        # files: files directly under root.
-        if root == path_to_experiment:
-            continue
+    index, offset = {}, 0
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            saved = json.load(f)
+        if saved["manifest_offset"] <= os.path.getsize(manifest_path(path_to_experiment)):
+            index = {(global_name, seed): trial_name
+                     for global_name, seed, trial_name in saved["index"]}
+            offset = saved["manifest_offset"]
+        # otherwise, the manifest was rebuilt
+    records, new_offset = read_records(path_to_experiment, offset)
+    for record in records:
+        if record["event"] == GENERATED:
+            _add_to_index(index, record["trial"])
+    if new_offset != offset:
+        tmp_path = "%s.%d.tmp" % (index_path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump({"manifest_offset": new_offset,
+                       "index": [[global_name, seed, trial_name]
+                                 for (global_name, seed), trial_name in index.items()]}, f)
+        os.replace(tmp_path, index_path)
+    return index
 
-        trial_name = os.path.basename(root)
-        if len(trial_name.split("_")) == 2:
-            global_name, specific_name = trial_name.split("_")
-            seed = "no_seed"
-        elif len(trial_name.split("_")) == 3:
-            global_name, seed, specific_name = trial_name.split("_")        
-        else:
-            print("Skipping trial %s due to invalid trial name format" % (trial_name))
-            continue
+def _add_to_index(index, trial_name):
+    parsed = parse_trial_name(trial_name)
+    if parsed is None:
+        print("Skipping trial %s due to invalid trial name format" % (trial_name))
+        return
+    global_name, seed, _ = parsed
+    index.setdefault((global_name, seed), trial_name)
 
-        if (global_name, seed) in combinations:
-            continue
 
-        # Read the trial object and obtain the configuration
-        if not os.path.exists(os.path.join(root, "trial.pkl")):
-            print("Warning: trial.pkl not found in %s" % os.path.join(root))
-            continue  # just skip this directory
-        with open(os.path.join(root, "trial.pkl"), "rb") as f:
-            trial = pickle.load(f)
+# Set before forking the workers of `add_baselines`
+_pending = None
 
+def _make_baseline_trials(i):
+    """Makes the baseline trials for combination i. Returns None if the
+    trial to take the config from is gone, or else a mapping from
+    baseline name to (trial, pickled trial). Saved trials are pickled
+    once, into their trial.pkl, or returned to be appended to the packed
+    store; in a worker process, only the pickled bytes are returned (the
+    trial is None), and otherwise, the bytes are None unless packed."""
+    (path_to_experiment, combinations, trial_funcs, save_trials,
+     packed, dedup_threshold, in_worker) = _pending
+    global_name, seed, trial_name = combinations[i]
+    # Read the trial object and obtain the configuration
+    try:
+        trial = load_trial(path_to_experiment, trial_name)
+    except FileNotFoundError:
+        print("Skipping %s_%s: trial %s not found" % (global_name, str(seed), trial_name))
+        return None
+    # Config values the trial refers to in the blob store are referred
+    # to in the same way by baseline trials that keep them
+    blob_refs = {}
+    saved_config = getattr(trial, "_config", None)
+    if isinstance(saved_config, dict):
+        refs = {key: value for key, value in saved_config.items() if isinstance(value, BlobRef)}
+        blob_refs = {id(trial.config[key]): ref for key, ref in refs.items()}
+    baseline_trials = {}
+    for baseline_name, trial_func in trial_funcs.items():
         baseline_trial = trial_func(global_name, seed, trial.config)
         assert baseline_trial.global_name == global_name, "Global name of baseline trial not matching."
         assert baseline_trial.seed == seed, "Seed of baseline trial not matching."
-
+        data = None
         if save_trials:
-            # Save the trial
             trial_path = os.path.join(path_to_experiment, baseline_trial.name)
-            if not os.path.exists(trial_path):
-                os.makedirs(trial_path)
-            with open(os.path.join(trial_path, "trial.pkl"), "wb") as f:
-                pickle.dump(baseline_trial, f)
-                
-        new_trials.append(baseline_trial)
+            baseline_trial.trial_path = trial_path
+            if dedup_threshold is not None:
+                blob_refs.update(dedup_config_values([baseline_trial], path_to_experiment,
+                                                     dedup_threshold, refs=blob_refs))
+            data = dumps_trial(baseline_trial, blob_refs)
+            if not packed:
+                os.makedirs(trial_path, exist_ok=True)
+                with open(os.path.join(trial_path, "trial.pkl"), "wb") as f:
+                    f.write(data)
+                if not in_worker:
+                    data = None
+            if in_worker:
+                baseline_trial = None
+        baseline_trials[baseline_name] = (baseline_trial, data)
+    return baseline_trials
+
+def add_baselines(path_to_experiment,
+                  trial_funcs,
+                  save_trials=False,
+                  split=4,
+                  num_workers=1,
+                  packed=None,
+                  dedup_threshold=None):
+    """
+    Like `add_baseline`, for several baselines at once: the config of
+    each (global_name, seed) is loaded once for all of them.
+
+    Args:
+        trial_funcs (dict): Maps from baseline name to a function that
+            maps from (global_name, seed, config (dict)) to a Trial object.
+        num_workers (int): If > 1, trials are loaded, and baseline trials
+            are made and saved, by that many forked processes. Saved trials
+            are sent back to this process in the bytes they were saved as,
+            so they are pickled only once.
+        packed (bool): If True, saved trials are appended to the packed
+            trial store (see sciex.trial_store); by default, they are if
+            the experiment has a store.
+        dedup_threshold (int): If given, large config values of saved trials
+            are stored in the blob store (see sciex.serialization). Values
+            kept from trials that refer to the blob store are referred to
+            in the same way regardless.
+    Returns:
+        a dict from baseline name to the list of its trials.
+    """
+    global _pending
+    if not os.path.isabs(path_to_experiment):
+        raise ValueError("Path to experiment must be absolute path.")
+    if packed is None:
+        packed = get_store(path_to_experiment) is not None
+
+    index = baseline_index(path_to_experiment)
+    combinations = [(global_name, seed, trial_name)
+                    for (global_name, seed), trial_name in sorted(index.items())]
+    parallel = num_workers > 1 and "fork" in multiprocessing.get_all_start_methods()
+    _pending = (path_to_experiment, combinations, trial_funcs, save_trials,
+                packed, dedup_threshold, parallel)
+    try:
+        if parallel:
+            chunksize = max(1, len(combinations) // (num_workers * 4))
+            with multiprocessing.get_context("fork").Pool(num_workers) as pool:
+                outputs = pool.map(_make_baseline_trials, range(len(combinations)),
+                                   chunksize=chunksize)
+        else:
+            outputs = [_make_baseline_trials(i) for i in range(len(combinations))]
+    finally:
+        _pending = None
+
+    new_trials = {baseline_name: [] for baseline_name in trial_funcs}
+    store_items = []
+    for (global_name, seed, _), baseline_trials in zip(combinations, outputs):
+        if baseline_trials is None:
+            continue
+        for baseline_name, (baseline_trial, data) in baseline_trials.items():
+            if baseline_trial is None:
+                baseline_trial = pickle.loads(data)
+            if save_trials and packed:
+                store_items.append((baseline_trial.name, data))
+            new_trials[baseline_name].append(baseline_trial)
         print("Added baseline trial for %s_%s" % (global_name, str(seed)))
-        combinations.add((global_name, seed))
 
     if save_trials:
-        Experiment.GENERATE_TRIAL_SCRIPTS(path_to_experiment,
-                                          new_trials,
-                                          prefix="run_%s" % baseline_name,
-                                          split=split)
+        # the trials are saved already
+        if packed:
+            store = get_store(path_to_experiment) or TrialStore(path_to_experiment)
+            store.append(store_items)
+        for baseline_name in trial_funcs:
+            trials = new_trials[baseline_name]
+            Experiment.GENERATE_RUN_SCRIPTS(path_to_experiment,
+                                            [trial.name for trial in trials],
+                                            prefix="run_%s" % baseline_name,
+                                            split=split)
     return new_trials
+
+def add_baseline(baseline_name,
+                 path_to_experiment,
+                 trial_func,
+                 save_trials=False,
+                 split=4,
+                 num_workers=1,
+                 packed=None,
+                 dedup_threshold=None):
+    """
+    Given an experiment folder that possibly already contain,
+    add a baseline to run on some of the same configurations.
+
+    Args:
+        trial_func (function): A function that maps from
+            (global_name, seed, config (dict)) to a Trial object.
+        save_trials (bool): True if you want to save the baseline trials.
+        split (int): If save_trials is True, this will be the number of splits
+            the saved trials will be divided into, and shell scripts will be generated
+            to run each split.
+        baseline_name (str): Name of the baseline
+        num_workers (int): If > 1, trials are loaded, and baseline trials
+            are made and saved, by that many forked processes.
+        packed, dedup_threshold: How saved trials are stored (see `add_baselines`).
+    """
+    return add_baselines(path_to_experiment, {baseline_name: trial_func},
+                         save_trials=save_trials, split=split,
+                         num_workers=num_workers, packed=packed,
+                         dedup_threshold=dedup_threshold)[baseline_name]
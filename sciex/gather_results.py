@@ -2,70 +2,241 @@
 # 
 # Usage of this file is licensed under the MIT License.
 
-# Go through every trial directory, unpickle the trial.pkl,
+# Go through every trial directory, unpickle the trial.pkl
+# (or load the trial from the packed trial store),
 # then based on RESULT TYPES, collect the results for each
 # trial. Organize them by trial name.
+#
+# Use -w to collect the results of trials in parallel
+# with a pool of processes, e.g.
+#
+# $ python gather_results.py -w 8
+#
+# Collected results are cached (in .sciex_cache/), so gathering
+# again only collects results of trials that are new or changed.
+# Use --no-cache or --clear-cache to bypass or reset the cache.
 
+import argparse
+import concurrent.futures
+import functools
 import os
-import pickle
 from sciex.components import Trial
+from sciex.trial_store import get_store, load_trial
+from sciex.collection_cache import CollectionCache, file_signature, result_type_version
+from sciex.serialization import BLOBS_DIRNAME
+from sciex.scheduling import CALIBRATION_DIRNAME
 
 EXPERIMENT_PATH = os.path.dirname(os.path.abspath(__file__))
 
-def main():
-    results = {}  # result_type -> {global_name -> {specific_name -> {seed -> actual_result}}}
+def collect_trial(root, cache=None):
+    """Collects the results of the trial whose directory is `root`.
+    Returns (global_name, specific_name, seed, result_types, collected)
+    where `collected` maps from result type to the collected result,
+    for result types whose files are all present; returns None if
+    `root` is not a trial directory.
+
+    If `cache` (a CollectionCache) is given, results whose files have
+    not changed since they were cached are not collected again."""
+    trial_name = os.path.basename(root)
+    if len(trial_name.split("_")) == 2:
+        global_name, specific_name = trial_name.split("_")
+        seed = "no_seed"
+    elif len(trial_name.split("_")) == 3:
+        global_name, seed, specific_name = trial_name.split("_")
+    else:
+        print("Skipping trial %s due to invalid trial name format" % (trial_name))
+        return None
+
+    # We expect one root (trial directory) contains one trial.pkl,
+    # or the trial is in the packed trial store of the experiment.
+    trial_signature = file_signature([os.path.join(root, "trial.pkl")])
+    if trial_signature is None:
+        store = get_store(os.path.dirname(root))
+        if store is not None and trial_name in store:
+            trial_signature = store.index[trial_name]
+        else:
+            print("Warning: trial.pkl not found in %s" % os.path.join(root))
+            return None  # just skip this directory
+
+    cache_entry = {} if cache is None else cache.load(trial_name)
+    new_entry = {}
+    # The class of the trial is cached, not its result types, which
+    # are read from the class as it is now
+    cached_trial = cache_entry.get("trial", (None, None))
+    if cached_trial[0] == trial_signature and isinstance(cached_trial[1], type):
+        trial_class = cached_trial[1]
+    else:
+        trial_class = type(load_trial(os.path.dirname(root), trial_name))
+    result_types = trial_class.RESULT_TYPES
+    new_entry["trial"] = (trial_signature, trial_class)
+
+    collected = {}
+    num_cached = 0
+    for result_type in result_types:
+        # result may depend on multiple files
+        result_files = result_type.FILENAMES()
+        # get the file of this result time
+        all_present = True
+        for rf in result_files:
+            if not os.path.exists(os.path.join(root, rf)):
+                print("Warning: %s result file %s not found in %s" % (str(result_type), rf, os.path.join(root)))
+                all_present = False; break
+        # All result files are present
+        if all_present:
+            version = result_type_version(result_type)
+            signature = file_signature([os.path.join(root, rf) for rf in result_files])
+            if version in cache_entry and cache_entry[version][0] == signature:
+                result = cache_entry[version][1]
+                num_cached += 1
+            elif len(result_files) == 1:
+                result = result_type.collect(os.path.join(root, result_files[0]))
+            else:
+                result = result_type.collect([os.path.join(root, rf) for rf in result_files])
+            collected[result_type] = result
+            new_entry[version] = (signature, result)
+
+    if cache is not None and (num_cached < len(collected)
+                              or set(new_entry) != set(cache_entry)
+                              or new_entry["trial"] != cache_entry["trial"]):
+        cache.store(trial_name, new_entry)
+    if num_cached > 0 and num_cached == len(collected):
+        print("Collected results in %s (cached)" % trial_name)
+    else:
+        print("Collected results in %s" % trial_name)
+    return global_name, specific_name, seed, result_types, collected
+
+def add_collected(results, trial_results, rows=None):
+    """Adds the output of `collect_trial` to `results`, which is
+    result_type -> {global_name -> {specific_name -> {seed -> actual_result}}}
+
+    For streaming result types (see Result.STREAMING), {seed -> actual_result}
+    is an accumulator that the result is folded into.
+
+    If `rows` is a list, a row of the results table (see sciex.table)
+    for this trial is appended to it."""
+    global_name, specific_name, seed, result_types, collected = trial_results
+    if rows is not None:
+        row = {"global_name": global_name, "specific_name": specific_name, "seed": str(seed)}
+        for result_type in collected:
+            row.update(result_type.to_columns(collected[result_type]))
+        rows.append(row)
+    for result_type in result_types:
+        streaming = getattr(result_type, "STREAMING", False)
+        if result_type not in results:
+            results[result_type] = {}
+        if global_name not in results[result_type]:
+            results[result_type][global_name] = {}
+        if specific_name not in results[result_type][global_name]:
+            results[result_type][global_name][specific_name] =\
+                result_type.init_accumulator() if streaming else {}
+        if result_type in collected:
+            if streaming:
+                results[result_type][global_name][specific_name] = result_type.accumulate(
+                    results[result_type][global_name][specific_name], seed, collected[result_type])
+            else:
+                results[result_type][global_name][specific_name][seed] = collected[result_type]
 
-    # First iteration, collect trial objects
-    for root, dirs, files in os.walk(EXPERIMENT_PATH):
+def merge_results(results, other):
+    """Merges `other`, partial results of the same format as `results`,
+    into `results`."""
+    for result_type in other:
+        streaming = getattr(result_type, "STREAMING", False)
+        results.setdefault(result_type, {})
+        for global_name in other[result_type]:
+            results[result_type].setdefault(global_name, {})
+            by_specific = results[result_type][global_name]
+            for specific_name, partial in other[result_type][global_name].items():
+                if specific_name not in by_specific:
+                    by_specific[specific_name] = partial
+                elif streaming:
+                    by_specific[specific_name] = result_type.merge_accumulators(
+                        by_specific[specific_name], partial)
+                else:
+                    by_specific[specific_name].update(partial)
+
+def collect_trials(roots, cache=None, rows=None):
+    """Collects the trials in `roots` and returns their results
+    in the same format as `collect_results`."""
+    results = {}
+    for root in roots:
+        trial_results = collect_trial(root, cache=cache)
+        if trial_results is not None:
+            add_collected(results, trial_results, rows=rows)
+    return results
+
+def _collect_chunk(roots, cache=None, table=False):
+    rows = [] if table else None
+    return collect_trials(roots, cache=cache, rows=rows), rows
+
+def trial_dirs(exp_path):
+    """Returns the directories under `exp_path` that may contain a trial"""
+    roots = []
+    for root, dirs, files in os.walk(exp_path):
         # root: top-level directory (recursive)
         # dirs: direct subdirectories of root
         # files: files directly under root.
-        if root == EXPERIMENT_PATH:
-            continue
-        
-        trial_name = os.path.basename(root)
-        if len(trial_name.split("_")) == 2:
-            global_name, specific_name = trial_name.split("_")
-            seed = "no_seed"
-        elif len(trial_name.split("_")) == 3:
-            global_name, seed, specific_name = trial_name.split("_")
-        else:
-            print("Skipping trial %s due to invalid trial name format" % (trial_name))
+        if root == exp_path:
+            # hidden directories, e.g. the collection cache, and the
+            # directories of blobs and calibration runs contain no trials
+            dirs[:] = [d for d in dirs if not d.startswith(".")
+                       and d not in (BLOBS_DIRNAME, CALIBRATION_DIRNAME)]
             continue
+        roots.append(root)
+    return roots
 
-        # We expect one root (trial directory) contains one trial.pkl.
-        if not os.path.exists(os.path.join(root, "trial.pkl")):
-            print("Warning: trial.pkl not found in %s" % os.path.join(root))
-            continue  # just skip this directory
-        with open(os.path.join(root, "trial.pkl"), "rb") as f:
-            trial = pickle.load(f)
-
-        result_types = type(trial).RESULT_TYPES
-        for result_type in result_types:
-            if result_type not in results:
-                results[result_type] = {}
-            if global_name not in results[result_type]:
-                results[result_type][global_name] = {}
-            if specific_name not in results[result_type][global_name]:
-                results[result_type][global_name][specific_name] = {}
-
-            # result may depend on multiple files
-            result_files = result_type.FILENAMES()
-            # get the file of this result time
-            all_present = True
-            for rf in result_files:
-                if not os.path.exists(os.path.join(root, rf)):
-                    print("Warning: %s result file %s not found in %s" % (str(result_type), rf, os.path.join(root)))
-                    all_present = False; break
-            # All result files are present
-            if all_present:
-                if len(result_files) == 1:
-                    result = result_type.collect(os.path.join(root, result_files[0]))
-                else:
-                    result = result_type.collect([os.path.join(root, rf) for rf in result_files])
-                results[result_type][global_name][specific_name][seed] = result
-        print("Collected results in %s" % trial_name)
-        
+def collect_results(exp_path, workers=1, use_cache=True, rows=None):
+    """Returns result_type -> {global_name -> {specific_name -> {seed -> actual_result}}}
+    for trials under `exp_path`. If `workers` > 1, the trials are collected in
+    parallel by a pool of that many processes. If `use_cache` is True, collected
+    results are cached on disk (see sciex.collection_cache) and reused when
+    their files have not changed. If `rows` is a list, one row of the results
+    table per trial is appended to it."""
+    roots = trial_dirs(exp_path)
+    cache = CollectionCache(exp_path) if use_cache else None
+    if workers > 1:
+        # Each worker collects a chunk of trials into partial results
+        # (accumulated, for streaming result types), which are merged here.
+        chunksize = max(1, len(roots) // (workers * 4))
+        chunks = [roots[i:i+chunksize] for i in range(0, len(roots), chunksize)]
+        results = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            for partial, partial_rows in executor.map(
+                    functools.partial(_collect_chunk, cache=cache, table=rows is not None), chunks):
+                merge_results(results, partial)
+                if rows is not None:
+                    rows.extend(partial_rows)
+    else:
+        results = collect_trials(roots, cache=cache, rows=rows)
+    if cache is not None:
+        # Entries of trials that no longer exist are evicted
+        num_evicted = cache.evict(os.path.basename(root) for root in roots)
+        if num_evicted > 0:
+            print("Evicted %d stale entries from the collection cache" % num_evicted)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Gather results of the experiment")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of processes that collect results in parallel. Default 1")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Collect all results again, without reading or writing the collection cache")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="Delete the collection cache before gathering")
+    parser.add_argument("--table", action="store_true",
+                        help="Also save a table with one row per trial and one column per scalar metric"
+                        " (results.parquet, or results.npz without pyarrow); see sciex.table")
+    args = parser.parse_args()
+
+    if args.clear_cache:
+        CollectionCache(EXPERIMENT_PATH).clear()
+    rows = [] if args.table else None
+    results = collect_results(EXPERIMENT_PATH, workers=args.workers,
+                              use_cache=not args.no_cache, rows=rows)
+    if args.table:
+        # imported here because the table needs numpy
+        from sciex.table import ResultTable
+        table_path = ResultTable.from_rows(rows).save(EXPERIMENT_PATH)
+        print("Results table with %d rows saved in %s" % (len(rows), table_path))
 
     gathered_results = Trial.gather_results(results)
     for result_type in gathered_results:
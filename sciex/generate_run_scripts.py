@@ -7,7 +7,7 @@ import argparse
 import sys
 import sciex
 import os
-import pickle
+from sciex.trial_store import trial_names
 
 exp_path = "./"
 
@@ -23,24 +23,13 @@ def main():
                         "Refer to the man page of the `timeout` command for time formatting")
     args = parser.parse_args()
 
-    # load trials
-    trials = []
-    split = int(args.splits)
-    for trial_name in os.listdir(args.exp_path):
-        if not os.path.isdir(os.path.join(exp_path, trial_name)):
-            continue
-        print("Loading {}".format(trial_name))
-        with open(os.path.join(exp_path, trial_name, "trial.pkl"), "rb") as f:
-            trial = pickle.load(f)
-        trials.append(trial)
-
+    # the trials are saved already; only their names are needed
     print("Generating run scripts...")
-    sciex.Experiment.GENERATE_TRIAL_SCRIPTS(exp_path,
-                                            trials,
-                                            prefix="run",
-                                            exist_ok=True,
-                                            split=split,
-                                            timeout=args.timeout)
+    sciex.Experiment.GENERATE_RUN_SCRIPTS(exp_path,
+                                          trial_names(exp_path),
+                                          prefix="run",
+                                          split=int(args.splits),
+                                          timeout=args.timeout)
 
 if __name__ == "__main__":
     main()
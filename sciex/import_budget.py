@@ -0,0 +1,84 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Startup benchmark: measures how long it takes a fresh Python process
+to import the sciex entry points (what every trial_runner.py and
+check_status.py invocation pays), and fails if it is over budget or
+if any of them imports the analysis stack (numpy, scipy, pandas, ...),
+which should only be loaded when first used.
+
+    python -m sciex.import_budget
+    python -m sciex.import_budget --budget 0.2 --repeat 10
+
+Exits with status 1 if a check fails.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Modules imported by the scripts that run for every trial
+ENTRY_POINTS = ["sciex", "sciex.trial_runner", "sciex.check_status", "sciex.worker"]
+# Modules that the entry points must not import
+HEAVY_MODULES = ["numpy", "scipy", "pandas", "matplotlib", "yaml"]
+DEFAULT_BUDGET = 0.25   # seconds
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"time": elapsed,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def measure(module, repeat=5, heavy=HEAVY_MODULES):
+    """Imports `module` in `repeat` fresh processes. Returns the best
+    import time in seconds, and the heavy modules that were imported."""
+    times = []
+    imported = set()
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c", _PROBE.format(module=module, heavy=list(heavy))])
+        probe = json.loads(output.decode().strip().splitlines()[-1])
+        times.append(probe["time"])
+        imported.update(probe["heavy"])
+    return min(times), sorted(imported)
+
+def check(modules=ENTRY_POINTS, budget=DEFAULT_BUDGET, repeat=5, heavy=HEAVY_MODULES):
+    """Measures the import of each of `modules`; prints a report
+    and returns True if all are within budget and light."""
+    ok = True
+    for module in modules:
+        elapsed, imported = measure(module, repeat=repeat, heavy=heavy)
+        problems = []
+        if elapsed > budget:
+            problems.append("over budget")
+        if len(imported) > 0:
+            problems.append("imports %s" % ", ".join(imported))
+        ok = ok and len(problems) == 0
+        print("%-24s %7.1f ms   %s" % (module, elapsed * 1000,
+                                      "; ".join(problems) if problems else "ok"))
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of sciex entry points.")
+    parser.add_argument("modules", type=str, nargs="*", default=ENTRY_POINTS,
+                        help="Modules to import (default: %s)" % " ".join(ENTRY_POINTS))
+    parser.add_argument("-b", "--budget", type=float, default=DEFAULT_BUDGET,
+                        help="Maximum import time, in seconds, of each module")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="Number of fresh processes to import each module in (the best time counts)")
+    parser.add_argument("--allow", type=str, nargs="*", default=[],
+                        help="Heavy modules that may be imported")
+    args = parser.parse_args()
+
+    heavy = [m for m in HEAVY_MODULES if m not in args.allow]
+    print("Import budget: %.0f ms" % (args.budget * 1000))
+    if not check(args.modules, budget=args.budget, repeat=args.repeat, heavy=heavy):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+The manifest is an append-only log (manifest.jsonl) in the
+experiment root, with one JSON record per line. Records are
+written when trials are generated (which run script each trial
+is in), when they start, and when they complete, so that the status of the
+experiment can be answered with one sequential read of this
+file, instead of visiting every trial directory.
+
+The manifest is created when run scripts are first generated; if the
+experiment already has trials then (generated before manifests existed),
+it is built from them first. Runners do not create it.
+
+If the manifest gets out of sync with the trial directories
+(e.g. trials that were run before the manifest existed), rebuild
+it from the directory tree, in the experiment root:
+
+$ python check_status.py --rebuild
+"""
+import json
+import os
+import socket
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MANIFEST_FILENAME = "manifest.jsonl"
+
+GENERATED = "generated"
+COMPLETED = "completed"
+STARTED = "started"
+FAILED = "failed"
+
+def manifest_path(exp_path):
+    return os.path.join(exp_path, MANIFEST_FILENAME)
+
+def append_records(exp_path, records, create=True):
+    """Appends records (dicts with at least "trial" and "event")
+    to the manifest of the experiment at `exp_path`. If `create` is
+    False, nothing is written when the experiment has no manifest,
+    so that a manifest holding only some of the trials is not made
+    (see `start_manifest`)."""
+    data = "".join(json.dumps(record) + "\n" for record in records)
+    if len(data) == 0:
+        return
+    flags = os.O_WRONLY | os.O_APPEND | (os.O_CREAT if create else 0)
+    try:
+        fd = os.open(manifest_path(exp_path), flags, 0o666)
+    except FileNotFoundError:
+        return
+    with open(fd, "a") as f:
+        if fcntl is not None:
+            fcntl.lockf(f, fcntl.LOCK_EX)
+        try:
+            f.write(data)
+            f.flush()
+        finally:
+            if fcntl is not None:
+                fcntl.lockf(f, fcntl.LOCK_UN)
+
+def start_manifest(exp_path, new_trial_names=()):
+    """Called before records of the trials `new_trial_names` are first
+    appended to the manifest. If the experiment has no manifest but has
+    other trials (e.g. generated before manifests existed), the manifest
+    is rebuilt from the trial directories first, so that it covers every
+    trial of the experiment. Returns True if it was rebuilt."""
+    if os.path.exists(manifest_path(exp_path)):
+        return False
+    from sciex.trial_store import trial_names
+    new_trial_names = set(new_trial_names)
+    if all(trial_name in new_trial_names for trial_name in trial_names(exp_path)):
+        return False
+    rebuild_manifest(exp_path)
+    return True
+
+def generated_record(trial_name, script):
+    return {"trial": trial_name, "event": GENERATED, "script": script}
+
+def started_record(trial_name):
+    return {"trial": trial_name, "event": STARTED, "time": time.time(),
+            "host": socket.gethostname(), "pid": os.getpid()}
+
+def failed_record(trial_name, error=None):
+    return {"trial": trial_name, "event": FAILED, "time": time.time(),
+            "host": socket.gethostname(), "error": error}
+
+def completed_record(trial_name, metrics=None):
+    record = {"trial": trial_name, "event": COMPLETED, "time": time.time()}
+    if metrics is not None:
+        record["metrics"] = metrics
+    return record
+
+def read_records(exp_path, offset=0):
+    """Reads the records in the manifest starting at byte `offset`.
+    Returns (records, offset) where the returned offset is where the
+    next read should start; a partially written last line is left
+    for the next read."""
+    records = []
+    path = manifest_path(exp_path)
+    if not os.path.exists(path):
+        return records, offset
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            records.append(json.loads(line))
+    return records, offset
+
+def load_index(exp_path):
+    """Returns a mapping from trial name to a dict with keys
+    "scripts" (run scripts the trial is in), "completed" (bool)
+    and, if recorded, "started" and "completed_time" (timestamps),
+    "host", "metrics" and "failed" (bool; True if the last run of the
+    trial failed, with "failed_time" and "error")."""
+    index = {}
+    records, _ = read_records(exp_path)
+    for record in records:
+        update_index(index, record)
+    return index
+
+def update_index(index, record):
+    entry = index.setdefault(record["trial"], {"scripts": [], "completed": False})
+    if record["event"] == GENERATED:
+        if record.get("script") is not None and record["script"] not in entry["scripts"]:
+            entry["scripts"].append(record["script"])
+    elif record["event"] == STARTED:
+        entry["started"] = record["time"]
+        entry["host"] = record.get("host")
+        entry["failed"] = False
+    elif record["event"] == FAILED:
+        entry["failed"] = True
+        entry["failed_time"] = record.get("time")
+        entry["error"] = record.get("error")
+    elif record["event"] == COMPLETED:
+        entry["completed"] = True
+        entry["failed"] = False
+        entry["completed_time"] = record.get("time")
+        if "metrics" in record:
+            entry["metrics"] = record["metrics"]
+
+def rebuild_manifest(exp_path):
+    """Reconstructs the manifest from the run scripts and trial
+    directories in `exp_path`. Returns the number of trials found."""
+    # avoid a circular import; check_status imports this module
+    from sciex.check_status import trial_completed, trial_name_in_command
+    from sciex.trial_store import trial_names as all_trial_names
+
+    records = []
+    trial_names = set(all_trial_names(exp_path))
+    for fname in sorted(os.listdir(exp_path)):
+        fullpath = os.path.join(exp_path, fname)
+        if fname.endswith(".sh") and not os.path.isdir(fullpath):
+            with open(fullpath) as f:
+                for line in f:
+                    trial_name = trial_name_in_command(line)
+                    if trial_name is not None:
+                        records.append(generated_record(trial_name, fname))
+                        trial_names.add(trial_name)
+    scripted = set(record["trial"] for record in records)
+    for trial_name in sorted(trial_names - scripted):
+        records.append(generated_record(trial_name, None))
+
+    for trial_name in sorted(trial_names):
+        trial_path = os.path.join(exp_path, trial_name)
+        if trial_completed(trial_path):
+            metrics = None
+            metrics_path = os.path.join(trial_path, "metrics.json")
+            if os.path.exists(metrics_path):
+                with open(metrics_path) as f:
+                    metrics = json.load(f)
+            records.append(completed_record(trial_name, metrics))
+
+    tmp_path = manifest_path(exp_path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    os.replace(tmp_path, manifest_path(exp_path))
+    return len(trial_names)
@@ -0,0 +1,201 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Live monitor of a running experiment, shown by
+
+$ python check_status.py --watch
+
+It follows the manifest (see sciex.manifest): on every update, only
+the records appended since the last one are read, so that an update
+costs the same on experiments with tens of thousands of trials as on
+small ones. It shows how many trials finish per minute, overall and
+per run script, an estimate of the remaining time based on the recent
+throughput, the trials whose last run failed, and the running trials
+that have taken much longer than finished trials with the same
+specific_name (stalled trials).
+"""
+import bisect
+import os
+import time
+from sciex.manifest import read_records, update_index, manifest_path, STARTED, COMPLETED, FAILED
+from sciex.scheduling import parse_trial_name
+
+class ScriptStats:
+    def __init__(self):
+        self.total = 0
+        self.finished = 0
+        self.failed = 0
+        # completion times within the throughput window
+        self.completions = []
+
+
+class Monitor:
+    def __init__(self, exp_path, window=600, stall_factor=3.0, stall_min=60):
+        """
+        window: throughput is measured over the last `window` seconds
+        stall_factor, stall_min: a running trial is flagged as stalled if it
+            has run more than `stall_factor` times the median duration of
+            finished trials with the same specific_name, and more than
+            `stall_min` seconds.
+        """
+        self.exp_path = exp_path
+        self.window = window
+        self.stall_factor = stall_factor
+        self.stall_min = stall_min
+        self._reset()
+
+    def _reset(self):
+        self._offset = 0
+        self.index = {}
+        self.scripts = {}
+        self.running = {}          # trial name -> start time
+        self.durations = {}        # specific_name -> sorted durations
+        self.completions = []      # completion times within the window
+        self._trial_script = {}    # trial name -> run script it is counted in
+
+    def update(self):
+        """Reads the records appended to the manifest since the last
+        update. Returns the number of new records."""
+        path = manifest_path(self.exp_path)
+        if os.path.exists(path) and os.path.getsize(path) < self._offset:
+            # the manifest was rebuilt
+            self._reset()
+        records, self._offset = read_records(self.exp_path, self._offset)
+        for record in records:
+            self._apply(record)
+        return len(records)
+
+    def _apply(self, record):
+        trial_name = record["trial"]
+        was_completed = trial_name in self.index and self.index[trial_name]["completed"]
+        was_failed = trial_name in self.index and self.index[trial_name].get("failed", False)
+        update_index(self.index, record)
+        entry = self.index[trial_name]
+        if trial_name not in self._trial_script:
+            # the trial is counted in the first run script it appears in
+            self._trial_script[trial_name] = entry["scripts"][0] if len(entry["scripts"]) > 0 else None
+            self.scripts.setdefault(self._trial_script[trial_name], ScriptStats()).total += 1
+        stats = self.scripts[self._trial_script[trial_name]]
+        if was_failed and not entry.get("failed", False):
+            # run again
+            stats.failed -= 1
+        if record["event"] == STARTED:
+            if not entry["completed"]:
+                self.running[trial_name] = record["time"]
+        elif record["event"] == FAILED:
+            self.running.pop(trial_name, None)
+            if not was_failed and not entry["completed"]:
+                stats.failed += 1
+        elif record["event"] == COMPLETED and not was_completed:
+            stats.finished += 1
+            start_time = self.running.pop(trial_name, None)
+            end_time = record.get("time")
+            if end_time is not None:
+                self.completions.append(end_time)
+                stats.completions.append(end_time)
+            duration = (record.get("metrics") or {}).get("wall_time")
+            if duration is None and start_time is not None and end_time is not None:
+                duration = end_time - start_time
+            parsed = parse_trial_name(trial_name)
+            if duration is not None and parsed is not None:
+                bisect.insort(self.durations.setdefault(parsed[2], []), duration)
+
+    def _prune(self, now):
+        cutoff = now - self.window
+        self.completions = [t for t in self.completions if t >= cutoff]
+        for stats in self.scripts.values():
+            stats.completions = [t for t in stats.completions if t >= cutoff]
+
+    def _window_length(self, now, completions):
+        # Measure the throughput over the window, or since the first
+        # completion if the experiment has not been running that long
+        if len(completions) == 0:
+            return self.window
+        return max(60.0, min(self.window, now - completions[0]))
+
+    def throughput(self, now=None):
+        """Trials finished per minute in the window, overall"""
+        now = time.time() if now is None else now
+        self._prune(now)
+        return len(self.completions) / self._window_length(now, self.completions) * 60
+
+    def stalled(self, now=None):
+        """Returns a list of (trial name, seconds running, median
+        seconds of its peers) of the stalled trials"""
+        now = time.time() if now is None else now
+        stalled = []
+        for trial_name, start_time in self.running.items():
+            parsed = parse_trial_name(trial_name)
+            durations = self.durations.get(parsed[2] if parsed is not None else None)
+            if not durations:
+                continue
+            median = durations[len(durations) // 2]
+            elapsed = now - start_time
+            if elapsed > self.stall_min and elapsed > self.stall_factor * median:
+                stalled.append((trial_name, elapsed, median))
+        return sorted(stalled, key=lambda item: -item[1])
+
+    def report(self, now=None):
+        """Returns the lines of the status report"""
+        now = time.time() if now is None else now
+        total = sum(stats.total for stats in self.scripts.values())
+        finished = sum(stats.finished for stats in self.scripts.values())
+        failed = sum(stats.failed for stats in self.scripts.values())
+        rate = self.throughput(now)
+        lines = ["Experiment Status (%s):" % time.strftime("%m/%d/%Y %H:%M:%S", time.localtime(now)),
+                 "     Total: %d" % total,
+                 "  Finished: %d (%.1f%%)" % (finished, 100 * finished / max(1, total)),
+                 "   Running: %d" % len(self.running),
+                 "    Failed: %d" % failed,
+                 "Throughput: %.2f trials/min (last %d min)" % (rate, self.window // 60),
+                 "       ETA: %s" % _fmt_eta(total - finished - failed, rate)]
+        lines.append("")
+        lines.append("  %-20s %8s %8s %8s %12s %10s" % ("script", "finished", "failed", "total",
+                                                         "trials/min", "ETA"))
+        for script in sorted(self.scripts, key=lambda s: (s is None, s)):
+            stats = self.scripts[script]
+            if stats.total == 0:
+                continue
+            script_rate = len(stats.completions) / self._window_length(now, stats.completions) * 60
+            lines.append("  %-20s %8d %8d %8d %12.2f %10s"
+                         % (script if script is not None else "(no script)", stats.finished,
+                            stats.failed, stats.total, script_rate,
+                            _fmt_eta(stats.total - stats.finished - stats.failed, script_rate)))
+        stalled = self.stalled(now)
+        if len(stalled) > 0:
+            lines.append("")
+            lines.append("Stalled trials (running much longer than finished trials like them):")
+            for trial_name, elapsed, median in stalled:
+                host = self.index[trial_name].get("host")
+                lines.append("  %-40s running %s (median %s)%s"
+                             % (trial_name, _fmt_duration(elapsed), _fmt_duration(median),
+                                " on %s" % host if host else ""))
+        return lines
+
+    def watch(self, interval=5.0):
+        """Prints the report every `interval` seconds until interrupted"""
+        try:
+            while True:
+                self.update()
+                lines = self.report()
+                # clear the terminal
+                print("\033[2J\033[H" + "\n".join(lines), flush=True)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+def _fmt_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 3600:
+        return "%dm%02ds" % (seconds // 60, seconds % 60)
+    return "%dh%02dm" % (seconds // 3600, (seconds % 3600) // 60)
+
+def _fmt_eta(remaining, rate):
+    if remaining <= 0:
+        return "done"
+    if rate <= 0:
+        return "-"
+    return _fmt_duration(remaining / rate * 60)
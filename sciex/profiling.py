@@ -0,0 +1,106 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Profiling of trials. With --profile, trial_runner.py and batch_runner
+run `trial.run` under cProfile and save the profile as profile.pstats
+in the trial directory. This module merges the profiles of all trials
+of an experiment (or of some specific_name groups) into one report of
+the functions where the trials spend their time:
+
+    python -m sciex.profiling {exp_path}
+    python -m sciex.profiling {exp_path} --specific pomcp greedy --sort tottime -n 20
+
+With --specific, one report is printed per specific_name, so that the
+hot functions of different settings can be compared.
+"""
+import argparse
+import cProfile
+import os
+import pstats
+from sciex.scheduling import parse_trial_name
+
+PROFILE_FILENAME = "profile.pstats"
+
+def run_profiled(func, profile_path, *args, **kwargs):
+    """Calls func(*args, **kwargs) under cProfile and saves
+    the profile to `profile_path`. Returns what func returns."""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)
+
+def profile_paths(exp_path, specific_names=None, global_names=None):
+    """Returns a mapping from trial name to the path of its
+    profile, for the trials of the experiment that were profiled,
+    optionally only those with one of the given specific or
+    global names."""
+    paths = {}
+    for fname in sorted(os.listdir(exp_path)):
+        path = os.path.join(exp_path, fname, PROFILE_FILENAME)
+        if not os.path.exists(path):
+            continue
+        parsed = parse_trial_name(fname)
+        if specific_names is not None and (parsed is None or parsed[2] not in specific_names):
+            continue
+        if global_names is not None and (parsed is None or parsed[0] not in global_names):
+            continue
+        paths[fname] = path
+    return paths
+
+def merge_profiles(paths):
+    """Returns a pstats.Stats with the profiles in `paths` added
+    together, or None if `paths` is empty."""
+    paths = list(paths)
+    if len(paths) == 0:
+        return None
+    stats = pstats.Stats(paths[0])
+    for path in paths[1:]:
+        stats.add(path)
+    return stats
+
+def report(stats, sort="cumulative", limit=30, title=None):
+    if title is not None:
+        print("=== %s ===" % title)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the hot functions of profiled trials.")
+    parser.add_argument("exp_path", type=str, help="Path to experiment root")
+    parser.add_argument("--specific", type=str, nargs="+", default=None,
+                        help="Report each of these specific_names separately")
+    parser.add_argument("--global", dest="global_names", type=str, nargs="+", default=None,
+                        help="Only include trials with these global_names")
+    parser.add_argument("-s", "--sort", type=str, default="cumulative",
+                        help="Sort key (cumulative, tottime, ncalls, ...; see pstats)")
+    parser.add_argument("-n", "--limit", type=int, default=30,
+                        help="Number of functions to list")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Also save the merged profile to this file (with --specific,"\
+                        " the specific_name is added to the file name)")
+    args = parser.parse_args()
+
+    groups = [None] if args.specific is None else args.specific
+    for specific_name in groups:
+        paths = profile_paths(args.exp_path,
+                              specific_names=None if specific_name is None else [specific_name],
+                              global_names=args.global_names)
+        title = "all trials" if specific_name is None else specific_name
+        stats = merge_profiles(paths.values())
+        if stats is None:
+            print("No profiles found for %s" % title)
+            continue
+        report(stats, sort=args.sort, limit=args.limit,
+               title="%s (%d trials)" % (title, len(paths)))
+        if args.output is not None:
+            output = args.output
+            if specific_name is not None:
+                root, ext = os.path.splitext(args.output)
+                output = "%s_%s%s" % (root, specific_name, ext)
+            stats.dump_stats(output)
+            print("Merged profile saved to %s" % output)
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,8 @@ import argparse
 import os
 import math
 import random
+from sciex.check_status import trial_name_in_command
+from sciex.scheduling import load_runtimes, estimate_costs, lpt_partition
 
 def main():
     parser = argparse.ArgumentParser(description="reorganize trial running commands in shell scripts.")
@@ -26,6 +28,12 @@ def main():
                         help="Shuffle the trials again")
     parser.add_argument("--prefix", default="run_",
                         help="Prefix to the existing .sh running scripts. Default 'run_'.")
+    parser.add_argument("--balance", action="store_true",
+                        help="Balance the scripts by expected runtime of the trials, estimated"\
+                        " from measured runtimes of finished trials (see --history)")
+    parser.add_argument("--history", type=str, nargs="*", default=[],
+                        help="Other experiment directories whose finished trials are used"\
+                        " to estimate runtimes for --balance, in addition to --exp-path")
     args = parser.parse_args()
 
     all_lines = []
@@ -41,14 +49,29 @@ def main():
     if args.shuffle:
         random.shuffle(all_lines)
 
-    lines_per_script = int(math.ceil(len(all_lines) / args.num_out_scripts))
-    for i in range(args.num_out_scripts):
-        begin = i*lines_per_script
-        if begin >= len(all_lines):
-            break
-        end = min((i+1)*lines_per_script, len(all_lines))
+    if args.balance:
+        # Lines that do not run a trial cost nothing
+        trial_names = [trial_name_in_command(line) for line in all_lines]
+        runtimes = load_runtimes([args.exp_path] + args.history)
+        named = [j for j in range(len(all_lines)) if trial_names[j] is not None]
+        costs = [0.0] * len(all_lines)
+        for j, cost in zip(named, estimate_costs([trial_names[j] for j in named], runtimes)):
+            costs[j] = cost
+        splits = [[all_lines[j] for j in indices]
+                  for indices in lpt_partition(costs, args.num_out_scripts)]
+    else:
+        splits = []
+        lines_per_script = int(math.ceil(len(all_lines) / args.num_out_scripts))
+        for i in range(args.num_out_scripts):
+            begin = i*lines_per_script
+            if begin >= len(all_lines):
+                break
+            end = min((i+1)*lines_per_script, len(all_lines))
+            splits.append(all_lines[begin:end])
 
-        lines = all_lines[begin:end]
+    for i, lines in enumerate(splits):
+        if len(lines) == 0:
+            continue
         run_script_filepath = os.path.join(args.exp_path, "run_{}_{}.sh".format(args.suffix, i))
         with open(run_script_filepath, "a") as f:
             f.writelines(lines)
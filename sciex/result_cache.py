@@ -0,0 +1,279 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Global cache of trial results, shared across experiments. Trials
+with the same class, config and seed as a trial that has finished
+before (e.g. when an experiment is regenerated, or baselines are
+added to another experiment) are not run again; their result files
+are hard-linked (or copied) from the cache into the trial directory.
+
+The cache is used by the runners when the environment variable
+SCIEX_RESULT_CACHE is set to its directory (or to "1" for the
+default, ~/.cache/sciex/results), or when they are given
+--result-cache. It is kept under SCIEX_RESULT_CACHE_MAX_BYTES
+(default 10GB) by evicting the least recently used entries.
+
+Only use it for trials whose results depend on nothing but their
+config and seed. A Trial class opts out with CACHEABLE = False, and
+bumping its CACHE_VERSION invalidates its cached results (e.g. after
+changing the code of `run`). Trials whose config holds values other
+than containers, numbers, strings, numpy arrays and large values in
+the blob store (see sciex.serialization) are not cached, since such
+values have no encoding that stays the same across runs. Since cached files may be hard links,
+result files should not be modified in place after they are saved.
+
+    python -m sciex.result_cache            # size of the cache
+    python -m sciex.result_cache --evict 5e9
+    python -m sciex.result_cache --clear
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from sciex.serialization import BlobRef
+
+ENV_VAR = "SCIEX_RESULT_CACHE"
+ENV_MAX_BYTES = "SCIEX_RESULT_CACHE_MAX_BYTES"
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "sciex", "results")
+DEFAULT_MAX_BYTES = 10 * 1024**3
+# Files in the trial directory that are not cached
+EXCLUDED_FILES = {"trial.pkl", "checkpoint.pkl", "profile.pstats"}
+# Minimum number of seconds between two automatic evictions
+EVICT_PERIOD = 600
+
+
+class _Uncacheable(Exception):
+    pass
+
+def _canonical(value, h):
+    """Feeds a stable encoding of `value` to the hash `h`; equal
+    configs give the same encoding regardless of dict order.
+    Raises _Uncacheable for values without a stable encoding."""
+    if isinstance(value, dict):
+        h.update(b"{")
+        items = sorted(value.items(), key=lambda item: repr(item[0]))
+        for key, item in items:
+            _canonical(key, h)
+            h.update(b":")
+            _canonical(item, h)
+        h.update(b"}")
+    elif isinstance(value, (list, tuple)):
+        h.update(b"[" if isinstance(value, list) else b"(")
+        for item in value:
+            _canonical(item, h)
+            h.update(b",")
+        h.update(b"]")
+    elif isinstance(value, (set, frozenset)):
+        h.update(b"<")
+        for digest in sorted(_digest(item) for item in value):
+            h.update(digest.encode())
+        h.update(b">")
+    elif value is None or isinstance(value, (bool, int, float, str, bytes)):
+        h.update(type(value).__name__.encode())
+        h.update(repr(value).encode())
+    elif hasattr(value, "tobytes") and hasattr(value, "dtype"):
+        # numpy arrays
+        h.update(("array%s%s" % (value.dtype, value.shape)).encode())
+        h.update(value.tobytes())
+    elif isinstance(value, BlobRef):
+        # the digest of a blob is the hash of its content
+        h.update(("blob%s" % value.digest).encode())
+    else:
+        raise _Uncacheable(type(value).__qualname__)
+
+def _digest(value):
+    h = hashlib.sha256()
+    _canonical(value, h)
+    return h.hexdigest()
+
+def trial_key(trial):
+    """Returns the key of the trial in the cache: a hash of its class
+    (and CACHE_VERSION), config and seed; None if the trial's class
+    opts out of caching, or its config cannot be hashed stably.
+
+    The config is hashed as it was saved, with large values in the blob
+    store hashed by their digest, so that they are not loaded. Accessing
+    `trial.config` loads them in place, so compute the key before."""
+    cls = type(trial)
+    if not getattr(cls, "CACHEABLE", True):
+        return None
+    h = hashlib.sha256()
+    _canonical(("%s.%s" % (cls.__module__, cls.__qualname__),
+                getattr(cls, "CACHE_VERSION", 0), trial.seed), h)
+    try:
+        _canonical(getattr(trial, "_config", None), h)
+    except _Uncacheable as ex:
+        print("Not caching the results of %s: its config has a value of type %s"
+              % (trial.name, ex))
+        return None
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def restore(self, trial, trial_path, key=None):
+        """If the results of a trial with the same key are cached, puts
+        them in `trial_path` and returns the metrics that were recorded
+        for that trial (with "cache_hit": True); otherwise None. `key`
+        is the key of the trial, if computed already (see `trial_key`)."""
+        if key is None:
+            key = trial_key(trial)
+        if key is None:
+            return None
+        entry_path = self._entry_path(key)
+        if not os.path.isdir(entry_path):
+            return None
+        os.makedirs(trial_path, exist_ok=True)
+        # config.yaml is the completion marker, so it is put in place last
+        fnames = sorted(os.listdir(entry_path), key=lambda fname: fname == "config.yaml")
+        metrics = {}
+        for fname in fnames:
+            src = os.path.join(entry_path, fname)
+            if fname == "metrics.json":
+                with open(src) as f:
+                    metrics = json.load(f)
+                continue
+            _link_or_copy(src, os.path.join(trial_path, fname))
+        # mark as recently used
+        os.utime(entry_path)
+        metrics["cache_hit"] = True
+        metrics["cache_key"] = key
+        return metrics
+
+    def store(self, trial, trial_path, key=None):
+        """Adds the results saved in `trial_path` to the cache.
+        Returns True if an entry was added."""
+        if key is None:
+            key = trial_key(trial)
+        if key is None:
+            return False
+        entry_path = self._entry_path(key)
+        if os.path.isdir(entry_path):
+            return False
+        tmp_path = "%s.%d.tmp" % (entry_path, os.getpid())
+        os.makedirs(tmp_path, exist_ok=True)
+        for fname in os.listdir(trial_path):
+            src = os.path.join(trial_path, fname)
+            if fname in EXCLUDED_FILES or fname.endswith(".tmp") or not os.path.isfile(src):
+                continue
+            _link_or_copy(src, os.path.join(tmp_path, fname))
+        try:
+            os.rename(tmp_path, entry_path)
+        except OSError:
+            # stored by another process in the meantime
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return False
+        self._maybe_evict()
+        return True
+
+    def entries(self):
+        """Returns a list of (last used time, size in bytes, path) of the cache entries"""
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for prefix in os.listdir(self.path):
+            prefix_path = os.path.join(self.path, prefix)
+            if not os.path.isdir(prefix_path):
+                continue
+            for key in os.listdir(prefix_path):
+                entry_path = os.path.join(prefix_path, key)
+                if key.endswith(".tmp"):
+                    continue
+                size = sum(os.path.getsize(os.path.join(entry_path, fname))
+                           for fname in os.listdir(entry_path))
+                entries.append((os.stat(entry_path).st_mtime, size, entry_path))
+        return entries
+
+    def evict(self, max_bytes=None):
+        """Removes the least recently used entries until the cache is
+        at most `max_bytes` in size. Returns the number removed."""
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry_path in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def _maybe_evict(self):
+        # Evicting scans the whole cache, so it is done at most
+        # every EVICT_PERIOD seconds.
+        marker = os.path.join(self.path, "last_evict")
+        try:
+            if time.time() - os.stat(marker).st_mtime < EVICT_PERIOD:
+                return
+        except FileNotFoundError:
+            pass
+        with open(marker, "w"):
+            pass
+        self.evict()
+
+    def clear(self):
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+
+def _link_or_copy(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def get_result_cache():
+    """Returns the ResultCache configured by the environment
+    variables, or None if the result cache is not enabled."""
+    path = os.environ.get(ENV_VAR)
+    if not path or path == "0":
+        return None
+    if path == "1":
+        path = DEFAULT_PATH
+    max_bytes = float(os.environ.get(ENV_MAX_BYTES, DEFAULT_MAX_BYTES))
+    return ResultCache(path, max_bytes=max_bytes)
+
+def enable_result_cache(path=None):
+    """Enables the result cache for this process and the processes it
+    starts (used by the --result-cache option of the runners)."""
+    os.environ[ENV_VAR] = path if path else "1"
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the global result cache.")
+    parser.add_argument("path", type=str, nargs="?", default=None,
+                        help="Cache directory (default: $%s or %s)" % (ENV_VAR, DEFAULT_PATH))
+    parser.add_argument("--evict", type=float, default=None,
+                        help="Evict least recently used entries down to this many bytes")
+    parser.add_argument("--clear", action="store_true", help="Remove the whole cache")
+    args = parser.parse_args()
+
+    if args.path is None:
+        cache = get_result_cache() or ResultCache()
+    else:
+        cache = ResultCache(args.path)
+    if args.clear:
+        cache.clear()
+        print("Cleared %s" % cache.path)
+        return
+    if args.evict is not None:
+        print("Evicted %d entries" % cache.evict(args.evict))
+    entries = cache.entries()
+    print("%s: %d entries, %.1f MB" % (cache.path, len(entries),
+                                       sum(size for _, size, _ in entries) / 1024**2))
+
+if __name__ == "__main__":
+    main()
@@ -2,19 +2,27 @@
 # 
 # Usage of this file is licensed under the MIT License.
 
-import yaml
+import os
 import pickle
 import csv
+import itertools
+import shutil
+import tempfile
 from sciex.components import Result
 
+__all__ = ["YamlResult", "PklResult", "CsvResult", "NpyResult", "NpzResult",
+           "PostProcessingResult", "Result", "csv", "pickle"]
+
 class YamlResult(Result):
     def __init__(self, things):
         self._things = things
     def save(self, path):
+        import yaml
         with open(path, "w") as f:
             yaml.dump(self._things, f)
     @classmethod
     def collect(cls, path):
+        import yaml
         with open(path) as f:
             return yaml.load(f, Loader=yaml.Loader)
 
@@ -30,25 +38,312 @@ class PklResult(Result):
             return pickle.load(f)
 
 class CsvResult(Result):
-    def __init__(self, rows, **fmtparams):
+    """Rows of values saved as a CSV file. If HEADER is True, the first
+    row holds the column names: `columns`, or "0", "1", ... if not given.
+
+    Rows can be given at once (a list, or a generator that is consumed
+    when the result is saved), or added while the trial runs with
+    `append` and `extend`. Added rows are written to a temporary file
+    (in `tmp_dir`) every BUFFER_SIZE rows, so they are not all kept in
+    memory; the file is moved to the result path when saved.
+
+    `collect` returns a dict from column name (or index, if HEADER is
+    False) to a numpy array of the column. Columns are parsed a chunk of
+    rows at a time, as int, float (empty values are nan) or str,
+    whichever fits all values; set DTYPES to give the types instead.
+    The format of the file (HEADER, and FMTPARAMS for the csv module)
+    is set on the class, so that `collect` reads it as it was saved."""
+    FMTPARAMS = {}
+    HEADER = True
+    DTYPES = {}
+    BUFFER_SIZE = 10000
+    CHUNK_SIZE = 100000
+    COLLECT_ATTRS = ("FMTPARAMS", "HEADER", "DTYPES")
+
+    def __init__(self, rows=None, columns=None, tmp_dir=None):
+        if columns is not None and not self.HEADER:
+            raise ValueError("%s has no header to save columns in (HEADER is False)"
+                             % type(self).__name__)
         self.rows = rows
-        self.fmt_params = fmt_params
+        self.columns = columns
+        self._tmp_dir = tmp_dir
+        self._tmp_path = None
+        self._buffer = []
+
+    def append(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.BUFFER_SIZE:
+            self.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def _write(self, f):
+        writer = csv.writer(f, **self.FMTPARAMS)
+        if self._tmp_path is None:
+            # first write: the header and the rows given at construction
+            rows = itertools.chain(self.rows if self.rows is not None else [], self._buffer)
+            if self.HEADER:
+                columns = self.columns
+                if columns is None:
+                    first = next(rows, None)
+                    if first is None:
+                        # no rows; nothing to name
+                        columns = []
+                    else:
+                        columns = [str(i) for i in range(len(first))]
+                        rows = itertools.chain([first], rows)
+                if len(columns) > 0:
+                    writer.writerow(columns)
+            writer.writerows(rows)
+            self.rows = None
+        else:
+            writer.writerows(self._buffer)
+        self._buffer = []
+
+    def flush(self):
+        """Writes the buffered rows to the temporary file"""
+        if self._tmp_path is None:
+            fd, tmp_path = tempfile.mkstemp(suffix=".csv", dir=self._tmp_dir)
+            with open(fd, "w", newline="") as f:
+                self._write(f)
+            self._tmp_path = tmp_path
+        else:
+            with open(self._tmp_path, "a", newline="") as f:
+                self._write(f)
+
     def save(self, path):
-        with open(path, "w") as f:
-            writer = csv.writer(f, **fmtparams)
-            for row in self.rows:
-                writer.writerow(row)
+        if self._tmp_path is None:
+            with open(path, "w", newline="") as f:
+                self._write(f)
+        else:
+            self.flush()
+            shutil.move(self._tmp_path, path)
+            self._tmp_path = None
+
+    @classmethod
+    def _read_chunks(cls, path):
+        """Yields (column names, rows) for chunks of CHUNK_SIZE rows"""
+        with open(path, newline="") as f:
+            reader = csv.reader(f, **cls.FMTPARAMS)
+            names = next(reader, []) if cls.HEADER else None
+            while True:
+                chunk = list(itertools.islice(reader, cls.CHUNK_SIZE))
+                if len(chunk) == 0:
+                    break
+                # skip blank lines
+                chunk = [row for row in chunk if len(row) > 0]
+                if len(chunk) == 0:
+                    continue
+                if names is None:
+                    names = list(range(len(chunk[0])))
+                for row in chunk:
+                    if len(row) != len(names):
+                        raise ValueError("%s: row %s has %d values, expected %d"
+                                         % (path, row, len(row), len(names)))
+                yield names, chunk
+
     @classmethod
     def collect(cls, path):
-        """Loads the rows from the csv file.
-        Note that it is possible to directly create
-        a pandas.DataFrame object using these rows as input."""
-        rows = []
-        with open(path) as f:
-            reader = csv.reader(f, **fmtparams)
-            for row in reader:
-                rows.append(row)
-        return rows
+        import numpy as np
+        names = []
+        columns = None
+        # str columns whose earlier chunks were parsed as numbers; they
+        # are read again, so that their values are kept as written
+        reread = set()
+        for names, chunk in cls._read_chunks(path):
+            if columns is None:
+                columns = {name: [] for name in names}
+                kinds = {name: None for name in names}
+            for name, values in zip(names, zip(*chunk)):
+                if name in reread:
+                    continue
+                if name in cls.DTYPES:
+                    columns[name].append(np.array(values, dtype=cls.DTYPES[name]))
+                    continue
+                # widen the type of the column if needed
+                for kind in _CSV_KINDS[_CSV_KINDS.index(kinds[name] or "int"):]:
+                    try:
+                        array = _csv_column(np, values, kind)
+                        break
+                    except ValueError:
+                        continue
+                if kind != kinds[name] and len(columns[name]) > 0:
+                    if kind == "str":
+                        reread.add(name)
+                        columns[name] = []
+                        continue
+                    columns[name] = [chunk_array.astype(array.dtype)
+                                     for chunk_array in columns[name]]
+                kinds[name] = kind
+                columns[name].append(array)
+        if columns is None:
+            # no rows; the columns are named in the header, if any
+            if cls.HEADER:
+                with open(path, newline="") as f:
+                    names = next(csv.reader(f, **cls.FMTPARAMS), [])
+            return {name: np.array([]) for name in names}
+        if len(reread) > 0:
+            for _, chunk in cls._read_chunks(path):
+                for name, values in zip(names, zip(*chunk)):
+                    if name in reread:
+                        columns[name].append(np.array(values, dtype=str))
+        return {name: np.concatenate(columns[name]) for name in names}
+
+_CSV_KINDS = ("int", "float", "str")
+
+def _csv_column(np, values, kind):
+    if kind == "int":
+        return np.array(values, dtype=np.int64)
+    elif kind == "float":
+        try:
+            return np.array(values, dtype=np.float64)
+        except ValueError:
+            return np.array([value if value.strip() else "nan" for value in values],
+                            dtype=np.float64)
+    return np.array(values, dtype=str)
+
+
+# Collected numpy results are memory-mapped: `collect` only reads the
+# header of the file, and the data is read from disk when it is used,
+# so gathering over many trials reads only the bytes actually touched.
+# A mapped array is pickled (e.g. into the collection cache of
+# gather_results.py, or from its worker processes) as a reference to
+# its file, not as its data.
+
+def _map_array(path, offset=0, mode="r"):
+    """Memory-maps the array stored in .npy format at byte `offset` of
+    the file at `path`. Arrays of Python objects cannot be mapped; they
+    are loaded instead."""
+    import numpy as np
+    with open(path, "rb") as f:
+        f.seek(offset)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        if dtype.hasobject:
+            f.seek(offset)
+            return np.lib.format.read_array(f, allow_pickle=True)
+        data_offset = f.tell()
+    if np.prod(shape, dtype=np.int64) == 0:
+        # empty arrays cannot be mapped
+        return np.empty(shape, dtype=dtype, order="F" if fortran_order else "C")
+    array = np.memmap(path, dtype=dtype, mode=mode, offset=data_offset, shape=shape,
+                      order="F" if fortran_order else "C").view(_mapped_array_class())
+    array._sciex_source = (path, offset, mode)
+    return array
+
+_MappedArray = None
+
+def _mapped_array_class():
+    global _MappedArray
+    if _MappedArray is None:
+        import numpy as np
+
+        class MappedArray(np.memmap):
+            """np.memmap that is pickled as a reference to its file"""
+            def __array_finalize__(self, obj):
+                super().__array_finalize__(obj)
+                # views (slices, ...) are pickled with their data
+                self._sciex_source = None
+
+            # np.memmap turns results that are not backed by the file
+            # into plain arrays only for its own type, not subclasses
+            def __array_wrap__(self, arr, context=None, return_scalar=False):
+                if self is arr:
+                    return arr
+                arr = arr.view(np.ndarray)
+                return arr[()] if return_scalar else arr
+
+            def __getitem__(self, index):
+                res = super().__getitem__(index)
+                if isinstance(res, np.memmap) and res._mmap is None:
+                    return res.view(np.ndarray)
+                return res
+
+            def __reduce__(self):
+                if self._sciex_source is None:
+                    return np.asarray(self).__reduce__()
+                return (_map_array, self._sciex_source)
+
+            def __reduce_ex__(self, protocol):
+                if self._sciex_source is None:
+                    return np.asarray(self).__reduce_ex__(protocol)
+                return self.__reduce__()
+
+        _MappedArray = MappedArray
+    return _MappedArray
+
+def _npz_member_offsets(path):
+    """Returns a mapping from array name to the offset of its .npy data
+    in the .npz file at `path`, for the members stored uncompressed."""
+    import struct
+    import zipfile
+    offsets = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED or not info.filename.endswith(".npy"):
+                continue
+            # The data follows the local file header, whose name and
+            # extra field lengths may differ from the central directory's
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            offsets[info.filename[:-len(".npy")]] = info.header_offset + 30 + name_length + extra_length
+    return offsets
+
+
+class NpyResult(Result):
+    """A numpy array, saved in .npy format. `collect` returns the array
+    memory-mapped (read-only), or loaded if MMAP_MODE is None."""
+    MMAP_MODE = "r"
+    COLLECT_ATTRS = ("MMAP_MODE",)
+
+    def __init__(self, array):
+        self._array = array
+    def save(self, path):
+        import numpy as np
+        with open(path, "wb") as f:
+            np.save(f, np.asarray(self._array))
+    @classmethod
+    def collect(cls, path):
+        import numpy as np
+        if cls.MMAP_MODE is None:
+            return np.load(path)
+        return _map_array(os.path.abspath(path), mode=cls.MMAP_MODE)
+
+class NpzResult(Result):
+    """A dict of numpy arrays, saved in .npz format. `collect` returns a
+    dict of the arrays, memory-mapped (read-only) unless the file was
+    saved with `compressed=True` or MMAP_MODE is None."""
+    MMAP_MODE = "r"
+    COLLECT_ATTRS = ("MMAP_MODE",)
+
+    def __init__(self, arrays, compressed=False):
+        self._arrays = arrays
+        self._compressed = compressed
+    def save(self, path):
+        import numpy as np
+        with open(path, "wb") as f:
+            if self._compressed:
+                np.savez_compressed(f, **self._arrays)
+            else:
+                np.savez(f, **self._arrays)
+    @classmethod
+    def collect(cls, path):
+        import numpy as np
+        path = os.path.abspath(path)
+        offsets = {} if cls.MMAP_MODE is None else _npz_member_offsets(path)
+        arrays = {}
+        with np.load(path, allow_pickle=True) as data:
+            for name in data.files:
+                if name in offsets:
+                    arrays[name] = _map_array(path, offsets[name], mode=cls.MMAP_MODE)
+                else:
+                    arrays[name] = data[name]
+        return arrays
 
 class PostProcessingResult(Result):
     """This kind of result does not save anything,
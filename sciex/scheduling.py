@@ -0,0 +1,160 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Cost-aware splitting of trials into run scripts.
+
+Splitting trials by count gives every split the same number of
+trials, but not the same amount of work. Here, each trial gets an
+expected cost (runtime), taken from its `cost_hint`, or from the
+measured runtimes (metrics.json) of earlier trials with the same
+specific_name / global_name, and the trials are packed into splits
+with the longest-processing-time-first (LPT) rule.
+"""
+import heapq
+import json
+import os
+
+METRICS_FILENAME = "metrics.json"
+# Directory in the experiment root with the calibration runs of
+# the computers (see sciex.divide)
+CALIBRATION_DIRNAME = "calibration"
+
+def parse_trial_name(trial_name):
+    """Returns (global_name, seed, specific_name) or None if
+    the name does not follow the trial naming convention."""
+    parts = trial_name.split("_")
+    if len(parts) == 2:
+        return parts[0], "no_seed", parts[1]
+    elif len(parts) == 3:
+        return parts[0], parts[1], parts[2]
+    return None
+
+def load_runtimes(exp_paths):
+    """Returns a mapping from trial name to the measured wall time (seconds)
+    of trials that have finished in any of the given experiment directories."""
+    runtimes = {}
+    for exp_path in exp_paths:
+        if not os.path.isdir(exp_path):
+            continue
+        for fname in os.listdir(exp_path):
+            metrics_path = os.path.join(exp_path, fname, METRICS_FILENAME)
+            if not os.path.exists(metrics_path):
+                continue
+            with open(metrics_path) as f:
+                metrics = json.load(f)
+            if metrics.get("wall_time") is not None:
+                runtimes[fname] = metrics["wall_time"]
+    return runtimes
+
+def load_host_runtimes(exp_paths):
+    """Returns a list of (trial name, host, wall time) of finished
+    trials whose metrics record the host they ran on."""
+    records = []
+    for exp_path in exp_paths:
+        if not os.path.isdir(exp_path):
+            continue
+        for fname in os.listdir(exp_path):
+            metrics_path = os.path.join(exp_path, fname, METRICS_FILENAME)
+            if not os.path.exists(metrics_path):
+                continue
+            with open(metrics_path) as f:
+                metrics = json.load(f)
+            if metrics.get("cache_hit", False):
+                continue
+            if metrics.get("wall_time") is not None and metrics.get("host") is not None:
+                records.append((fname, metrics["host"], metrics["wall_time"]))
+    return records
+
+def host_speeds(host_runtimes):
+    """Estimates the relative speed of each host from (trial name, host,
+    wall time) records. Each runtime is compared with the mean runtime of
+    trials with the same global_name and specific_name on all hosts, so
+    that hosts that happened to run slower kinds of trials are not
+    penalized. Returns a mapping from host to speed (1.0 is average)."""
+    groups = {}
+    for trial_name, host, runtime in host_runtimes:
+        parsed = parse_trial_name(trial_name)
+        key = (parsed[0], parsed[2]) if parsed is not None else trial_name
+        groups.setdefault(key, []).append(runtime)
+    group_means = {key: sum(values) / len(values) for key, values in groups.items()}
+    ratios = {}
+    for trial_name, host, runtime in host_runtimes:
+        parsed = parse_trial_name(trial_name)
+        key = (parsed[0], parsed[2]) if parsed is not None else trial_name
+        if group_means[key] > 0:
+            ratios.setdefault(host, []).append(runtime / group_means[key])
+    return {host: len(values) / sum(values) for host, values in ratios.items()
+            if sum(values) > 0}
+
+def estimate_costs(trial_names, runtimes, hints=None, default=1.0):
+    """Returns a list of expected costs for the given trial names.
+
+    The cost of a trial is, in order of preference: its hint (if `hints`,
+    a list aligned with `trial_names`, has one that is not None); its own
+    measured runtime; the mean runtime of measured trials with the same
+    global_name and specific_name; with the same specific_name; with the
+    same global_name; of all measured trials; and finally `default`."""
+    by_both, by_specific, by_global = {}, {}, {}
+    for name, runtime in runtimes.items():
+        parsed = parse_trial_name(name)
+        if parsed is None:
+            continue
+        global_name, _, specific_name = parsed
+        by_both.setdefault((global_name, specific_name), []).append(runtime)
+        by_specific.setdefault(specific_name, []).append(runtime)
+        by_global.setdefault(global_name, []).append(runtime)
+    if len(runtimes) > 0:
+        default = sum(runtimes.values()) / len(runtimes)
+
+    def _mean(values):
+        return sum(values) / len(values)
+
+    costs = []
+    for i, name in enumerate(trial_names):
+        if hints is not None and hints[i] is not None:
+            costs.append(hints[i])
+            continue
+        if name in runtimes:
+            costs.append(runtimes[name])
+            continue
+        parsed = parse_trial_name(name)
+        if parsed is not None:
+            global_name, _, specific_name = parsed
+            if (global_name, specific_name) in by_both:
+                costs.append(_mean(by_both[(global_name, specific_name)]))
+                continue
+            if specific_name in by_specific:
+                costs.append(_mean(by_specific[specific_name]))
+                continue
+            if global_name in by_global:
+                costs.append(_mean(by_global[global_name]))
+                continue
+        costs.append(default)
+    return costs
+
+def lpt_partition(costs, k, capacities=None):
+    """Partitions items with the given costs into `k` bins with the
+    longest-processing-time-first rule: items are assigned, from the most
+    to the least costly, to the bin that would finish earliest.
+
+    `capacities` optionally gives the relative speed of each bin; the finish
+    time of a bin is then its total cost divided by its capacity.
+
+    Returns a list of `k` lists of item indices (in increasing order)."""
+    order = sorted(range(len(costs)), key=lambda i: costs[i], reverse=True)
+    bins = [[] for _ in range(k)]
+    if capacities is None:
+        heap = [(0.0, b) for b in range(k)]
+        for i in order:
+            load, b = heapq.heappop(heap)
+            bins[b].append(i)
+            heapq.heappush(heap, (load + costs[i], b))
+    else:
+        loads = [0.0] * k
+        for i in order:
+            b = min(range(k), key=lambda b: (loads[b] + costs[i]) / capacities[b])
+            bins[b].append(i)
+            loads[b] += costs[i]
+    return [sorted(indices) for indices in bins]
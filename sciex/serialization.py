@@ -0,0 +1,154 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Serialization of trials when generating an experiment.
+
+Trials often share large config values (maps, datasets, ...). Pickled
+naively, every trial.pkl holds its own copy. With deduplication, each
+large top-level config value is pickled once into a content-addressed
+blob store (blobs/ in the experiment root), and the trials refer to it
+by hash (a BlobRef). The value is loaded, once per process, when the
+trial's config is first accessed (see `Trial.config`).
+
+Trials can also be pickled by a pool of forked processes; the trials
+are inherited by the workers, so they are not pickled twice.
+"""
+import hashlib
+import multiprocessing
+import os
+import pickle
+
+BLOBS_DIRNAME = "blobs"
+
+# Blob directories to look for blobs in, besides the one a BlobRef
+# was created with (e.g. when an experiment directory was moved).
+_blob_dirs = []
+# Loaded blobs, by digest, so that each blob is loaded once per process.
+_loaded = {}
+
+def add_blob_dir(exp_path):
+    """Registers the blob directory of an experiment for resolving BlobRefs"""
+    blob_dir = os.path.abspath(os.path.join(exp_path, BLOBS_DIRNAME))
+    if blob_dir not in _blob_dirs:
+        _blob_dirs.append(blob_dir)
+
+
+class BlobRef:
+    """Reference to a value pickled in a blob store"""
+    def __init__(self, digest, blob_dir):
+        self.digest = digest
+        self.blob_dir = blob_dir
+
+    def __repr__(self):
+        return "BlobRef(%s)" % self.digest[:12]
+
+    def resolve(self):
+        if self.digest not in _loaded:
+            for blob_dir in [self.blob_dir] + _blob_dirs:
+                path = BlobStore.blob_path(blob_dir, self.digest)
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        _loaded[self.digest] = pickle.load(f)
+                    break
+            else:
+                raise FileNotFoundError("Blob %s not found" % self.digest)
+        return _loaded[self.digest]
+
+
+def resolve_blobs(config):
+    """Replaces BlobRefs among the values of the dict `config`
+    with the values they refer to, in place."""
+    for key, value in config.items():
+        if isinstance(value, BlobRef):
+            config[key] = value.resolve()
+
+
+class BlobStore:
+    def __init__(self, exp_path):
+        self.path = os.path.abspath(os.path.join(exp_path, BLOBS_DIRNAME))
+
+    @staticmethod
+    def blob_path(blob_dir, digest):
+        return os.path.join(blob_dir, digest[:2], digest + ".pkl")
+
+    def put(self, data):
+        """Stores pickled `data` (bytes) unless a blob with the
+        same content exists. Returns the digest of the blob."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = BlobStore.blob_path(self.path, digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+
+def dedup_config_values(trials, exp_path, threshold, refs=None):
+    """Stores the top-level config values of `trials` whose pickled
+    size is at least `threshold` bytes in the blob store of the
+    experiment. Values shared by several trials (the same object, or
+    equal content) are stored once. Returns a mapping from id(value)
+    to its BlobRef, to be passed to `dumps_trial`. Values that have a
+    BlobRef in `refs` already are skipped."""
+    store = BlobStore(exp_path)
+    refs = dict(refs or {})
+    seen = set(refs)
+    for trial in trials:
+        config = trial.config
+        if not isinstance(config, dict):
+            continue
+        for value in config.values():
+            if id(value) in seen:
+                continue
+            seen.add(id(value))
+            data = pickle.dumps(value)
+            if len(data) >= threshold:
+                refs[id(value)] = BlobRef(store.put(data), store.path)
+    return refs
+
+def dumps_trial(trial, blob_refs=None):
+    """Pickles the trial, with config values that have a BlobRef
+    in `blob_refs` (see `dedup_config_values`) replaced by it."""
+    config = getattr(trial, "_config", None)
+    if not blob_refs or not isinstance(config, dict):
+        return pickle.dumps(trial)
+    trial._config = {key: blob_refs.get(id(value), value)
+                     for key, value in config.items()}
+    try:
+        return pickle.dumps(trial)
+    finally:
+        trial._config = config
+
+
+# Set before forking the workers of `serialize_trials`
+_pending = None
+
+def _serialize(i):
+    trials, blob_refs, paths = _pending
+    data = dumps_trial(trials[i], blob_refs)
+    if paths is None:
+        return data
+    with open(paths[i], "wb") as f:
+        f.write(data)
+
+def serialize_trials(trials, blob_refs=None, paths=None, num_workers=1):
+    """Pickles `trials`. If `paths` is given, trial i is written to
+    paths[i] and None is returned; otherwise, returns a list of the
+    pickled trials. With `num_workers` > 1, the trials are pickled by
+    that many forked processes (only where fork is available)."""
+    global _pending
+    _pending = (trials, blob_refs, paths)
+    try:
+        if num_workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            chunksize = max(1, len(trials) // (num_workers * 4))
+            with multiprocessing.get_context("fork").Pool(num_workers) as pool:
+                outputs = pool.map(_serialize, range(len(trials)), chunksize=chunksize)
+        else:
+            outputs = [_serialize(i) for i in range(len(trials))]
+    finally:
+        _pending = None
+    return None if paths is not None else outputs
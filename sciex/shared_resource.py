@@ -0,0 +1,180 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Sharing a read-only resource between the processes of batch_runner
+without copying it into each of them.
+
+`SharedResource` walks the resource (through dicts, lists and tuples) and
+moves every large numpy array and bytes buffer into shared memory
+(multiprocessing.shared_memory) or, if a directory is given, into
+memory-mapped files. What is left is a small "handle" version of
+the resource that is cheap to pickle; `attach()` turns it back into
+the resource in a worker process, with arrays that are views of the
+shared memory (or of the mapped files) rather than copies. This works
+with both the fork and the spawn start methods.
+
+The shared arrays are read-only; the resource should not be written
+to by the trials anyway.
+"""
+import mmap
+import os
+import numpy as np
+from multiprocessing import shared_memory
+
+DEFAULT_MIN_BYTES = 1024 * 1024
+
+
+class _SharedArray:
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def attach(self, keep):
+        shm = _attach_shared_memory(self.name)
+        keep.append(shm)
+        array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+        array.flags.writeable = False
+        return array
+
+
+class _SharedBytes:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def attach(self, keep):
+        shm = _attach_shared_memory(self.name)
+        keep.append(shm)
+        return shm.buf[:self.size].toreadonly()
+
+
+class _MappedArray:
+    def __init__(self, path):
+        self.path = path
+
+    def attach(self, keep):
+        return np.load(self.path, mmap_mode="r")
+
+
+class _MappedBytes:
+    def __init__(self, path):
+        self.path = path
+
+    def attach(self, keep):
+        with open(self.path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        keep.append(mapped)
+        return memoryview(mapped)
+
+
+_HANDLE_TYPES = (_SharedArray, _SharedBytes, _MappedArray, _MappedBytes)
+
+
+def _attach_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13, attaching also registers the segment with
+        # the resource tracker. The pool workers share the tracker of the
+        # parent, which already registered it, so this is harmless.
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedResource:
+    """Owns the shared memory segments or files that hold the large
+    parts of a resource. Use as a context manager, or call `close()`
+    once the workers are done, to release them."""
+    def __init__(self, resource, min_bytes=DEFAULT_MIN_BYTES, mmap_dir=None):
+        """
+        min_bytes: arrays and buffers smaller than this are left in the
+            resource (and pickled as usual).
+        mmap_dir: if given, the large parts are written as files to this
+            directory and memory-mapped by the workers, instead of being
+            put in shared memory.
+        """
+        self._min_bytes = min_bytes
+        self._mmap_dir = mmap_dir
+        self._segments = []
+        self._files = []
+        if mmap_dir is not None:
+            os.makedirs(mmap_dir, exist_ok=True)
+        self.handles = self._share(resource)
+
+    @property
+    def nbytes(self):
+        """Total size of the shared parts of the resource"""
+        return sum(shm.size for shm in self._segments)\
+            + sum(os.path.getsize(path) for path in self._files)
+
+    def _share(self, obj):
+        if isinstance(obj, dict):
+            return {key: self._share(value) for key, value in obj.items()}
+        elif isinstance(obj, list):
+            return [self._share(value) for value in obj]
+        elif isinstance(obj, tuple) and not hasattr(obj, "_fields"):
+            return tuple(self._share(value) for value in obj)
+        elif isinstance(obj, np.ndarray) and obj.dtype != object\
+             and obj.nbytes >= self._min_bytes:
+            return self._share_array(obj)
+        elif isinstance(obj, (bytes, bytearray)) and len(obj) >= self._min_bytes:
+            return self._share_bytes(obj)
+        return obj
+
+    def _share_array(self, array):
+        if self._mmap_dir is not None:
+            path = os.path.join(self._mmap_dir, "resource_%d_%d.npy" % (os.getpid(), len(self._files)))
+            np.save(path, array)
+            self._files.append(path)
+            return _MappedArray(path)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        self._segments.append(shm)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        return _SharedArray(shm.name, array.shape, array.dtype)
+
+    def _share_bytes(self, data):
+        if self._mmap_dir is not None:
+            path = os.path.join(self._mmap_dir, "resource_%d_%d.bin" % (os.getpid(), len(self._files)))
+            with open(path, "wb") as f:
+                f.write(data)
+            self._files.append(path)
+            return _MappedBytes(path)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        self._segments.append(shm)
+        shm.buf[:len(data)] = data
+        return _SharedBytes(shm.name, len(data))
+
+    def close(self):
+        for shm in self._segments:
+            shm.close()
+            shm.unlink()
+        for path in self._files:
+            os.remove(path)
+        self._segments = []
+        self._files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+# Shared memory segments and mappings attached by this process;
+# they must stay open for as long as the arrays that view them.
+_attached = []
+
+def attach(handles):
+    """Rebuilds the resource from the handles made by SharedResource,
+    with arrays and buffers that view the shared memory."""
+    if isinstance(handles, _HANDLE_TYPES):
+        return handles.attach(_attached)
+    elif isinstance(handles, dict):
+        return {key: attach(value) for key, value in handles.items()}
+    elif isinstance(handles, list):
+        return [attach(value) for value in handles]
+    elif isinstance(handles, tuple) and not hasattr(handles, "_fields"):
+        return tuple(attach(value) for value in handles)
+    return handles
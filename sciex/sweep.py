@@ -0,0 +1,201 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Declarative parameter sweeps, for generating experiments with very
+many trials without holding all of them in memory.
+
+A sweep is a re-iterable sequence of parameter dicts whose length is
+known without generating them:
+
+    Grid(env=["4x4", "8x8"], planner=["pomcp", "greedy"])   # all combinations
+    Zip(env=["4x4", "8x8"], size=[4, 8])                    # in lockstep
+    Random(100, seed=0, lr=lambda rng: 10**rng.uniform(-4, -2), batch=[32, 64])
+    Factory(lambda: ({"k": k} for k in primes()), 1000)    # any iterable
+
+Sweeps are combined with `*` (all combinations) and `+` (one after the
+other). `sweep.trials(make_trial)` turns a sweep into a lazy sequence
+of trials, made by calling `make_trial(**params)` for each parameter
+dict, which can be given to `Experiment` in place of a list:
+
+    sweep = Grid(env=envs, planner=planners) * Grid(seed=range(1000))
+    trials = sweep.trials(lambda env, planner, seed: MyTrial(
+        "%s_%d_%s" % (env, seed, planner), {"env": env, "planner": planner}))
+    Experiment("exp", trials, "results").generate_trial_scripts(split=100)
+
+Trials are then made, pickled and assigned to run scripts a chunk at
+a time, and dropped afterwards.
+
+`from sciex import *` provides Grid, Zip and Factory; import Random
+from sciex.sweep, so that it does not shadow random.Random.
+"""
+import itertools
+import random
+
+__all__ = ["Sweep", "Grid", "Zip", "Factory"]
+
+
+class Sweep:
+    """Base class of sweeps. Subclasses implement `__iter__`,
+    which yields parameter dicts, and `__len__`."""
+    def __iter__(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __mul__(self, other):
+        return Product(self, other)
+
+    def __add__(self, other):
+        return Chain(self, other)
+
+    def trials(self, make_trial):
+        return TrialSweep(self, make_trial)
+
+
+class Grid(Sweep):
+    """All combinations of the values of the axes. The last axis
+    varies fastest."""
+    def __init__(self, axes=None, **kwargs):
+        self.axes = dict(axes or {}, **kwargs)
+        for key, values in self.axes.items():
+            if not hasattr(values, "__len__"):
+                # e.g. a generator; it is iterated many times
+                self.axes[key] = list(values)
+
+    def __iter__(self):
+        keys = list(self.axes)
+        for values in itertools.product(*(self.axes[key] for key in keys)):
+            yield dict(zip(keys, values))
+
+    def __len__(self):
+        count = 1
+        for values in self.axes.values():
+            count *= len(values)
+        return count
+
+
+class Zip(Sweep):
+    """The i-th values of all axes together; the axes must have the
+    same length."""
+    def __init__(self, axes=None, **kwargs):
+        self.axes = dict(axes or {}, **kwargs)
+        for key, values in self.axes.items():
+            if not hasattr(values, "__len__"):
+                self.axes[key] = list(values)
+        lengths = {len(values) for values in self.axes.values()}
+        if len(lengths) > 1:
+            raise ValueError("Zip axes have different lengths: %s"
+                             % {key: len(values) for key, values in self.axes.items()})
+
+    def __iter__(self):
+        keys = list(self.axes)
+        for values in zip(*(self.axes[key] for key in keys)):
+            yield dict(zip(keys, values))
+
+    def __len__(self):
+        if len(self.axes) == 0:
+            return 0
+        return len(next(iter(self.axes.values())))
+
+
+class Random(Sweep):
+    """`n` random draws. Each axis is either a sequence, of which a
+    value is chosen uniformly, or a function that takes a
+    `random.Random` and returns a value. The draws are the same every
+    time the sweep is iterated."""
+    def __init__(self, n, seed=None, axes=None, **kwargs):
+        self.n = n
+        self.seed = seed if seed is not None else random.randrange(2**32)
+        self.axes = dict(axes or {}, **kwargs)
+
+    def __iter__(self):
+        rng = random.Random(self.seed)
+        for _ in range(self.n):
+            params = {}
+            for key, values in self.axes.items():
+                if callable(values):
+                    params[key] = values(rng)
+                else:
+                    params[key] = values[rng.randrange(len(values))]
+            yield params
+
+    def __len__(self):
+        return self.n
+
+
+class Factory(Sweep):
+    """Parameter dicts from a user function: `fn()` returns an
+    iterable of `length` parameter dicts. It is called each time the
+    sweep is iterated."""
+    def __init__(self, fn, length):
+        self.fn = fn
+        self.length = length
+
+    def __iter__(self):
+        count = 0
+        for params in self.fn():
+            count += 1
+            yield params
+        if count != self.length:
+            raise ValueError("Factory yielded %d parameter dicts, expected %d"
+                             % (count, self.length))
+
+    def __len__(self):
+        return self.length
+
+
+class Product(Sweep):
+    """All combinations of the parameter dicts of the sweeps, merged"""
+    def __init__(self, *sweeps):
+        self.sweeps = sweeps
+
+    def __iter__(self):
+        # Unlike itertools.product, this does not hold the parameter
+        # dicts of the sweeps in memory; the later sweeps are iterated
+        # again for every combination of the earlier ones.
+        return self._iter(0, {})
+
+    def _iter(self, i, params):
+        if i == len(self.sweeps):
+            yield params
+            return
+        for part in self.sweeps[i]:
+            yield from self._iter(i + 1, dict(params, **part))
+
+    def __len__(self):
+        count = 1
+        for sweep in self.sweeps:
+            count *= len(sweep)
+        return count
+
+
+class Chain(Sweep):
+    """The parameter dicts of the sweeps, one sweep after the other"""
+    def __init__(self, *sweeps):
+        self.sweeps = sweeps
+
+    def __iter__(self):
+        for sweep in self.sweeps:
+            yield from sweep
+
+    def __len__(self):
+        return sum(len(sweep) for sweep in self.sweeps)
+
+
+class TrialSweep:
+    """Lazy sequence of the trials `make_trial(**params)` for the
+    parameter dicts of a sweep. Trials are made when iterated, and
+    not kept."""
+    def __init__(self, sweep, make_trial):
+        self.sweep = sweep
+        self.make_trial = make_trial
+
+    def __iter__(self):
+        for params in self.sweep:
+            yield self.make_trial(**params)
+
+    def __len__(self):
+        return len(self.sweep)
@@ -0,0 +1,144 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Columnar table of the results of an experiment, with one row per
+trial: the global_name, specific_name and seed of the trial, and one
+column per scalar metric (see `Result.to_columns`). The table is
+written by `gather_results.py --table` as results.parquet (if pyarrow
+is installed) or results.npz, and can be loaded without gathering
+again:
+
+    table = ResultTable.load("path/to/experiment")
+    table.filter(specific_name=["pomcp", "greedy"])\\
+         .aggregate(["global_name", "specific_name"], "RewardsResult")
+"""
+import os
+import numpy as np
+from sciex.util import grouped_stats
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+TABLE_FILENAME = "results"
+KEY_COLUMNS = ["global_name", "specific_name", "seed"]
+
+class ResultTable:
+    def __init__(self, columns):
+        """columns: mapping from column name to a 1D array; all
+        columns have the same length"""
+        self._columns = {name: np.asarray(columns[name]) for name in columns}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Builds a table from a list of dicts. Values missing in a
+        row are NaN (for numeric columns) or "" (otherwise)."""
+        names = []
+        for row in rows:
+            for name in row:
+                if name not in names:
+                    names.append(name)
+        columns = {}
+        for name in names:
+            values = [row.get(name) for row in rows]
+            if all(isinstance(v, str) or v is None for v in values):
+                columns[name] = np.array(["" if v is None else v for v in values], dtype=str)
+            else:
+                columns[name] = np.array([np.nan if v is None else v for v in values], dtype=float)
+        return cls(columns)
+
+    @property
+    def columns(self):
+        return list(self._columns.keys())
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def __len__(self):
+        if len(self._columns) == 0:
+            return 0
+        return len(next(iter(self._columns.values())))
+
+    def __repr__(self):
+        return "ResultTable(%d rows; columns: %s)" % (len(self), ", ".join(self.columns))
+
+    def to_dict(self):
+        return dict(self._columns)
+
+    def save(self, path):
+        """Saves the table in the directory `path` as results.parquet,
+        or results.npz if pyarrow is not available. Returns the file path."""
+        if pyarrow is not None:
+            filepath = os.path.join(path, TABLE_FILENAME + ".parquet")
+            pyarrow.parquet.write_table(pyarrow.table(self._columns), filepath)
+        else:
+            filepath = os.path.join(path, TABLE_FILENAME + ".npz")
+            np.savez(filepath, **self._columns)
+        return filepath
+
+    @classmethod
+    def load(cls, path):
+        """Loads the table saved in the directory `path` (or the
+        file `path`)."""
+        if os.path.isdir(path):
+            parquet_path = os.path.join(path, TABLE_FILENAME + ".parquet")
+            path = parquet_path if os.path.exists(parquet_path)\
+                else os.path.join(path, TABLE_FILENAME + ".npz")
+        if path.endswith(".parquet"):
+            if pyarrow is None:
+                raise ImportError("pyarrow is required to load %s" % path)
+            table = pyarrow.parquet.read_table(path)
+            return cls({name: table.column(name).to_numpy() for name in table.column_names})
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+    def filter(self, mask=None, **conditions):
+        """Returns the rows where `mask` (boolean array) is True and,
+        for each column given as a keyword argument, the value equals
+        the argument (or is one of them, if a list, tuple or set is given)."""
+        if mask is None:
+            mask = np.ones(len(self), dtype=bool)
+        mask = np.asarray(mask, dtype=bool)
+        for name, value in conditions.items():
+            if isinstance(value, (list, tuple, set)):
+                mask = mask & np.isin(self._columns[name], list(value))
+            else:
+                mask = mask & (self._columns[name] == value)
+        return ResultTable({name: self._columns[name][mask] for name in self._columns})
+
+    def group_codes(self, by):
+        """Returns (codes, first) where codes[i] is the group of row i
+        when grouping by the columns `by`, and first[g] is the index of
+        the first row in group g. Groups are in sorted order of the keys."""
+        codes = np.zeros(len(self), dtype=np.int64)
+        for name in by:
+            _, inverse = np.unique(self._columns[name], return_inverse=True)
+            codes = codes * (inverse.max(initial=0) + 1) + inverse.ravel()
+        _, first, codes = np.unique(codes, return_index=True, return_inverse=True)
+        return codes.ravel(), first
+
+    def aggregate(self, by, column, confidence_interval=0.95):
+        """Groups rows by the columns `by` and computes statistics of
+        `column` in each group, ignoring NaN. Returns a table with the
+        `by` columns and count, mean, std, stderr and ci (half-width
+        of the confidence interval, see `util.ci_normal`) columns."""
+        if isinstance(by, str):
+            by = [by]
+        codes, first = self.group_codes(by)
+        values = self._columns[column].astype(float)
+        valid = ~np.isnan(values)
+        num_groups = len(first)
+        labels, mean, y_error, half_width = grouped_stats(values[valid], codes[valid],
+                                                          confidence_interval=confidence_interval)
+        counts = np.bincount(codes[valid], minlength=num_groups)
+        columns = {name: self._columns[name][first] for name in by}
+        columns["count"] = counts
+        for name, stat in (("mean", mean), ("stderr", y_error), ("ci", half_width)):
+            columns[name] = np.full(num_groups, np.nan)
+            columns[name][labels] = stat
+        columns["std"] = columns["stderr"] * np.sqrt(counts)
+        return ResultTable(columns)
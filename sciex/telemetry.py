@@ -0,0 +1,158 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Resource usage of trials. The runners measure, for each trial, the
+wall time, user and system CPU time, peak resident memory and bytes
+read and written, and save them in metrics.json in the trial
+directory (and in the manifest). `python check_status.py --metrics`
+summarizes them, which helps to size machines and pick --num-proc.
+
+The peak memory is that of the process running the trial. A trial
+run by trial_runner.py in its own process (or with --fork) gets its
+own peak. When one process runs many trials (--stdin without --fork,
+batch_runner, worker), a trial whose peak stays below the peak of
+earlier trials in the process cannot be measured; its metrics then
+have "peak_rss_inherited": True, and its peak_rss is only an upper
+bound, which is left out of the peaks per specific_name.
+"""
+import os
+import socket
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Number of trials measured by `usage_since` in this process
+_num_measured = 0
+
+def _read_proc_io():
+    """Returns (bytes read, bytes written) by this process, from
+    /proc/self/io (Linux), or None if not available."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(":") for line in f if ":" in line)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def snapshot():
+    """Returns the resource usage of this process so far"""
+    usage = {"time": time.time()}
+    if resource is not None:
+        rusage = resource.getrusage(resource.RUSAGE_SELF)
+        usage["cpu_user"] = rusage.ru_utime
+        usage["cpu_sys"] = rusage.ru_stime
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        usage["peak_rss"] = rusage.ru_maxrss * scale
+        usage["blocks"] = (rusage.ru_inblock, rusage.ru_oublock)
+    usage["io"] = _read_proc_io()
+    return usage
+
+def usage_since(start):
+    """Returns the metrics of what was done since the snapshot `start`"""
+    global _num_measured
+    end = snapshot()
+    metrics = {"wall_time": end["time"] - start["time"]}
+    if "cpu_user" in end:
+        metrics["cpu_user"] = end["cpu_user"] - start["cpu_user"]
+        metrics["cpu_sys"] = end["cpu_sys"] - start["cpu_sys"]
+        metrics["peak_rss"] = end["peak_rss"]
+        if _num_measured > 0 and end["peak_rss"] <= start["peak_rss"]:
+            # the peak was reached by an earlier trial in this process
+            metrics["peak_rss_inherited"] = True
+    _num_measured += 1
+    if end["io"] is not None and start["io"] is not None:
+        metrics["io_read_bytes"] = end["io"][0] - start["io"][0]
+        metrics["io_write_bytes"] = end["io"][1] - start["io"][1]
+    elif "blocks" in end:
+        # blocks of 512 bytes that actually went to disk
+        metrics["io_read_bytes"] = (end["blocks"][0] - start["blocks"][0]) * 512
+        metrics["io_write_bytes"] = (end["blocks"][1] - start["blocks"][1]) * 512
+    metrics["host"] = socket.gethostname()
+    return metrics
+
+def load_metrics(exp_path, trial_names=None):
+    """Returns a mapping from trial name to the metrics in its
+    metrics.json, for the trials of the experiment that have one."""
+    import json
+    metrics = {}
+    for fname in sorted(os.listdir(exp_path)) if trial_names is None else trial_names:
+        path = os.path.join(exp_path, fname, "metrics.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                metrics[fname] = json.load(f)
+    return metrics
+
+
+def _fmt_bytes(num):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(num) < 1024:
+            return "%.1f%s" % (num, unit)
+        num /= 1024
+    return "%.1fTB" % num
+
+def summarize(metrics, top=10):
+    """Prints a summary of `metrics`, a mapping from trial name to
+    its metrics: totals, the slowest trials, and per specific_name
+    the mean wall time and CPU time and the peak memory."""
+    from sciex.scheduling import parse_trial_name
+    metrics = {name: m for name, m in metrics.items() if m and "wall_time" in m}
+    # trials restored from the result cache (see sciex.result_cache) used no resources
+    num_cached = sum(1 for m in metrics.values() if m.get("cache_hit", False))
+    metrics = {name: m for name, m in metrics.items() if not m.get("cache_hit", False)}
+    if num_cached > 0:
+        print("Trials restored from the result cache: %d" % num_cached)
+    if len(metrics) == 0:
+        print("No trial metrics found.")
+        return
+    wall = sum(m["wall_time"] for m in metrics.values())
+    cpu = sum(m.get("cpu_user", 0.0) + m.get("cpu_sys", 0.0) for m in metrics.values())
+    print("Trials with metrics: %d" % len(metrics))
+    print("    Total wall time: %.2f hours" % (wall / 3600))
+    print("     Total CPU time: %.2f hours (user+sys)" % (cpu / 3600))
+    print("    Total I/O bytes: read %s, written %s"
+          % (_fmt_bytes(sum(m.get("io_read_bytes", 0) for m in metrics.values())),
+             _fmt_bytes(sum(m.get("io_write_bytes", 0) for m in metrics.values()))))
+    peak = max(m.get("peak_rss", 0) for m in metrics.values())
+    print("  Peak memory (RSS): %s" % _fmt_bytes(peak))
+
+    print("\nSlowest trials:")
+    slowest = sorted(metrics, key=lambda name: metrics[name]["wall_time"], reverse=True)
+    for name in slowest[:top]:
+        m = metrics[name]
+        print("  %-40s %9.1fs  cpu %9.1fs  rss %9s  %s"
+              % (name, m["wall_time"], m.get("cpu_user", 0.0) + m.get("cpu_sys", 0.0),
+                 _fmt_peak(m), m.get("host", "")))
+
+    groups = {}
+    for name, m in metrics.items():
+        parsed = parse_trial_name(name)
+        groups.setdefault(parsed[2] if parsed is not None else name, []).append(m)
+    print("\nBy specific_name:")
+    print("  %-24s %6s %12s %12s %12s" % ("specific_name", "count", "mean wall", "mean cpu", "peak rss"))
+    for specific_name in sorted(groups):
+        group = groups[specific_name]
+        print("  %-24s %6d %11.1fs %11.1fs %12s"
+              % (specific_name, len(group),
+                 sum(m["wall_time"] for m in group) / len(group),
+                 sum(m.get("cpu_user", 0.0) + m.get("cpu_sys", 0.0) for m in group) / len(group),
+                 _fmt_group_peak(group)))
+    if any(m.get("peak_rss_inherited", False) for m in metrics.values()):
+        print("(<= : peak not measured, at most that of the process that ran the trial;"
+              " left out of the peaks by specific_name)")
+
+def _fmt_peak(m):
+    if m.get("peak_rss_inherited", False):
+        return "<=" + _fmt_bytes(m.get("peak_rss", 0))
+    return _fmt_bytes(m.get("peak_rss", 0))
+
+def _fmt_group_peak(group):
+    peaks = [m.get("peak_rss", 0) for m in group if not m.get("peak_rss_inherited", False)]
+    if len(peaks) == 0:
+        return "-"
+    return _fmt_bytes(max(peaks))
@@ -0,0 +1,159 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+A work queue of trials, stored as a SQLite database in the
+experiment root. Any number of workers (see sciex.worker)
+can claim trials from the queue; each claim is atomic, so
+a trial is only handed out to one worker at a time.
+
+Unlike the run_{i}.sh scripts, which fix the assignment of
+trials to terminals in advance, the queue hands out the next
+pending trial whenever a worker becomes free, so slow trials
+do not hold up the rest of a split.
+"""
+import os
+import socket
+import sqlite3
+import time
+
+QUEUE_FILENAME = "trial_queue.db"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class TrialQueue:
+    """Queue of trial names backed by a SQLite database file."""
+    def __init__(self, exp_path, filename=QUEUE_FILENAME, timeout=60):
+        self.exp_path = exp_path
+        self.path = os.path.join(exp_path, filename)
+        self._timeout = timeout
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS trials ("
+                         "name TEXT PRIMARY KEY,"
+                         "status TEXT NOT NULL,"
+                         "worker TEXT,"
+                         "claimed_at REAL,"
+                         "finished_at REAL,"
+                         "attempts INTEGER NOT NULL DEFAULT 0)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self._timeout,
+                               isolation_level=None)
+        return _Connection(conn)
+
+    def add(self, trial_names):
+        """Adds trials to the queue as pending. Trials that
+        are already in the queue are left untouched.
+        Returns the number of trials added."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.execute("SELECT COUNT(*) FROM trials").fetchone()[0]
+            conn.executemany("INSERT OR IGNORE INTO trials (name, status) VALUES (?, ?)",
+                             [(name, PENDING) for name in trial_names])
+            after = conn.execute("SELECT COUNT(*) FROM trials").fetchone()[0]
+            conn.execute("COMMIT")
+        return after - before
+
+    def claim(self, worker=None):
+        """Atomically claims the next pending trial for `worker`.
+        Returns the trial name, or None if nothing is pending."""
+        if worker is None:
+            worker = default_worker_id()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT name FROM trials WHERE status=? "
+                               "ORDER BY rowid LIMIT 1", (PENDING,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("UPDATE trials SET status=?, worker=?, claimed_at=?,"
+                         " attempts=attempts+1 WHERE name=?",
+                         (RUNNING, worker, time.time(), row[0]))
+            conn.execute("COMMIT")
+        return row[0]
+
+    def mark_done(self, trial_name, worker=None):
+        """Marks the trial done. If `worker` is given, only if the trial
+        is still claimed by that worker (it may have been handed out to
+        another one since). Returns True if the trial was marked."""
+        return self._finish(trial_name, DONE, worker)
+
+    def mark_failed(self, trial_name, worker=None):
+        """Like `mark_done`, but marks the trial failed"""
+        return self._finish(trial_name, FAILED, worker)
+
+    def _finish(self, trial_name, status, worker=None):
+        query = "UPDATE trials SET status=?, finished_at=? WHERE name=?"
+        params = [status, time.time(), trial_name]
+        if worker is not None:
+            query += " AND worker=? AND status=?"
+            params += [worker, RUNNING]
+        with self._connect() as conn:
+            return conn.execute(query, params).rowcount > 0
+
+    def requeue(self, statuses=(FAILED,), older_than=None):
+        """Puts trials with the given statuses back to pending.
+        If `older_than` (seconds) is given, only trials claimed
+        longer ago than that are requeued; this is useful for
+        recovering trials claimed by workers that died.
+        Returns the number of trials requeued."""
+        query = "UPDATE trials SET status=?, worker=NULL WHERE status IN (%s)"\
+            % ",".join("?" * len(statuses))
+        params = [PENDING] + list(statuses)
+        if older_than is not None:
+            query += " AND claimed_at < ?"
+            params.append(time.time() - older_than)
+        with self._connect() as conn:
+            cursor = conn.execute(query, params)
+            return cursor.rowcount
+
+    def release(self, trial_names):
+        """Puts the given trials back to pending if they are running
+        (e.g. because their worker died). Returns the number released."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            count = 0
+            for name in trial_names:
+                count += conn.execute("UPDATE trials SET status=?, worker=NULL"
+                                      " WHERE name=? AND status=?",
+                                      (PENDING, name, RUNNING)).rowcount
+            conn.execute("COMMIT")
+        return count
+
+    def running(self):
+        """Returns a list of (trial name, worker, claimed_at) of running trials"""
+        with self._connect() as conn:
+            return conn.execute("SELECT name, worker, claimed_at FROM trials"
+                                " WHERE status=?", (RUNNING,)).fetchall()
+
+    def counts(self):
+        """Returns a mapping from status to number of trials"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM trials GROUP BY status").fetchall()
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+
+class _Connection:
+    """Closes the sqlite connection when leaving the context
+    (sqlite3.Connection's own context manager does not)."""
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        return self._conn
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None and self._conn.in_transaction:
+            self._conn.execute("ROLLBACK")
+        self._conn.close()
+
+
+def default_worker_id():
+    return "%s:%d" % (socket.gethostname(), os.getpid())
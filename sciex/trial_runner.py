@@ -2,37 +2,268 @@
 # 
 # Usage of this file is licensed under the MIT License.
 
+"""
+Runs a trial and saves its results:
+
+    python trial_runner.py {path/to/trial/trial.pkl} {exp_path} --logging
+
+With --stdin, a single process runs many trials, one after another,
+so that Python and the imports of the trials are loaded once instead
+of once per trial. Each line of the standard input is either a path to
+a trial pickle file or a line of a run script, so a run script can be
+piped in as it is:
+
+    python trial_runner.py --stdin {exp_path} < run_1.sh
+
+Lines of run scripts generated with a timeout (`timeout 20m python
+trial_runner.py ...`) are run in a forked child process that is killed
+after that time, as with --fork and --timeout.
+
+With --fork, each trial is run in a forked child process, so that a trial
+that crashes (or leaks memory or modifies global state) does not affect
+the next ones; the imports done before forking are still shared.
+"""
 import argparse
-import pickle
 import os
-import yaml
+import json
+import shlex
+import signal
+import sys
+import traceback
+from sciex import telemetry
 from sciex.check_status import trial_completed
+from sciex.checkpoint import CHECKPOINT_FILENAME, remove_checkpoint
+from sciex.event_log import LOG_JSONL_FILENAME, read_event_log
+from sciex.manifest import append_records, completed_record, started_record, failed_record
+from sciex.result_cache import get_result_cache, enable_result_cache, trial_key
+from sciex.trial_store import load_trial_file
 
 def main():
     parser = argparse.ArgumentParser(description='Run a trial.')
-    parser.add_argument("pickle_file", type=str,
-                        help="Path to trial pickle file")
-    parser.add_argument("exp_path", type=str,
+    parser.add_argument("pickle_file", type=str, nargs="?",
+                        help="Path to trial pickle file (omitted with --stdin)")
+    parser.add_argument("exp_path", type=str, nargs="?",
                         help="Path to experiment root")
     parser.add_argument("--logging", action="store_true")
+    parser.add_argument("--stdin", action="store_true",
+                        help="Run the trials whose paths (or run script lines)"\
+                        " are read from the standard input")
+    parser.add_argument("--fork", action="store_true",
+                        help="With --stdin, run each trial in a forked process")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="With --fork, kill a trial after this many seconds")
+    parser.add_argument("--profile", action="store_true",
+                        help="Run the trial under cProfile and save profile.pstats"\
+                        " in the trial directory (see sciex.profiling)")
+    parser.add_argument("--result-cache", type=str, nargs="?", const="1", default=None,
+                        help="Reuse the results of identical trials from the result"\
+                        " cache, in this directory or the default one (see sciex.result_cache)")
     args = parser.parse_args()
 
-    if not os.path.exists(args.pickle_file):
-        print("{} not found".format(args.pickle_file))
-        return
+    # `timeout` in run scripts stops the runner with SIGTERM; the failure
+    # of the running trial is then recorded before the runner exits
+    signal.signal(signal.SIGTERM, _exit_on_signal)
+
+    if args.result_cache is not None:
+        enable_result_cache(args.result_cache)
+
+    if args.stdin:
+        # the only positional argument is the experiment path
+        exp_path = args.exp_path or args.pickle_file
+        if exp_path is None:
+            parser.error("exp_path is required")
+        run_trials(sys.stdin, exp_path, logging=args.logging,
+                   fork=args.fork, timeout=args.timeout, profile=args.profile)
+    else:
+        if args.pickle_file is None or args.exp_path is None:
+            parser.error("pickle_file and exp_path are required")
+        run_trial(args.pickle_file, args.exp_path, logging=args.logging,
+                  profile=args.profile)
+
+def _exit_on_signal(signum, frame):
+    raise SystemExit("Terminated by signal %d" % signum)
+
+def parse_trial_line(line):
+    """Returns (pickle_file, exp_path, logging, timeout) of a line that is
+    either a path to a trial pickle file, or a line of a run script, in
+    which case exp_path and logging are those of the command, and timeout
+    is the duration in seconds given to `timeout` before the command, if
+    any (or else None). Returns None for empty lines, comments and other
+    commands."""
+    line = line.strip()
+    if len(line) == 0 or line.startswith("#"):
+        return None
+    tokens = shlex.split(line)
+    if "trial_runner.py" not in tokens:
+        if len(tokens) == 1 and tokens[0].endswith(".pkl"):
+            return tokens[0], None, False, None
+        return None
+    index = tokens.index("trial_runner.py")
+    args = tokens[index + 1:]
+    positional = [arg for arg in args if not arg.startswith("-")]
+    if len(positional) == 0:
+        return None
+    exp_path = positional[1] if len(positional) > 1 else None
+    return positional[0], exp_path, "--logging" in args, _parse_timeout(tokens[:index])
+
+def _parse_timeout(tokens):
+    """Returns the duration in seconds of a `timeout [options] duration`
+    command prefix in `tokens`, or None if there is none."""
+    if "timeout" not in tokens:
+        return None
+    i = tokens.index("timeout") + 1
+    while i < len(tokens) and tokens[i].startswith("-"):
+        # options of timeout; -s and -k take a value
+        i += 2 if tokens[i] in ("-s", "-k", "--signal", "--kill-after") else 1
+    if i >= len(tokens):
+        return None
+    duration = tokens[i]
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    try:
+        if duration[-1] in units:
+            return float(duration[:-1]) * units[duration[-1]]
+        return float(duration)
+    except ValueError:
+        raise ValueError("Cannot parse the duration of timeout in: %s" % " ".join(tokens))
 
-    with open(args.pickle_file, "rb") as f:
-        trial = pickle.load(f)
+def run_trials(lines, exp_path, logging=False, fork=False, timeout=None, profile=False):
+    """Runs the trials given by `lines` (see `parse_trial_line`) one after
+    another in this process, or each in a forked child process if `fork`.
+    A trial whose line has a timeout is run in a forked child process
+    that is killed after that time (or `timeout`, if shorter).
+    A trial that fails is reported and does not stop the others.
+    Returns the number of trials that were run successfully."""
+    num_done = 0
+    for line in lines:
+        parsed = parse_trial_line(line)
+        if parsed is None:
+            continue
+        pickle_file, line_exp_path, line_logging, line_timeout = parsed
+        trial_exp_path = line_exp_path or exp_path
+        trial_logging = logging or line_logging
+        trial_timeout = timeout
+        if line_timeout is not None:
+            trial_timeout = line_timeout if timeout is None else min(timeout, line_timeout)
+        if fork or line_timeout is not None:
+            ok = _run_trial_forked(pickle_file, trial_exp_path, trial_logging, trial_timeout, profile)
+        else:
+            try:
+                ok = run_trial(pickle_file, trial_exp_path, logging=trial_logging,
+                               profile=profile)
+            except Exception:
+                traceback.print_exc()
+                print("Trial {} failed".format(pickle_file))
+                ok = False
+        if ok:
+            num_done += 1
+        sys.stdout.flush()
+    print("Ran {} trials".format(num_done))
+    return num_done
 
-    if trial_completed(os.path.join(args.exp_path, trial.name)):
+def _run_trial_forked(pickle_file, exp_path, logging, timeout, profile=False):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            if timeout is not None:
+                signal.alarm(max(1, int(round(timeout))))
+            ran = run_trial(pickle_file, exp_path, logging=logging, profile=profile)
+            status = 0 if ran else 2
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+    _, status = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(status):
+        print("Trial {} was killed by signal {}".format(pickle_file, os.WTERMSIG(status)))
+        # the child could not record the failure itself
+        trial_name = os.path.basename(os.path.dirname(os.path.normpath(pickle_file)))
+        append_records(exp_path, [failed_record(trial_name, "killed by signal %d"
+                                                % os.WTERMSIG(status))],
+                       create=False)
+        return False
+    code = os.WEXITSTATUS(status)
+    if code == 1:
+        print("Trial {} failed".format(pickle_file))
+    return code == 0
+
+def run_trial(pickle_file, exp_path, logging=False, profile=False):
+    """Loads the trial in `pickle_file` (which may be in the packed
+    trial store, see sciex.trial_store), runs it and saves its
+    results under `exp_path`. Trials that are already completed
+    are skipped. Returns True if the trial was run."""
+    try:
+        trial = load_trial_file(pickle_file)
+    except FileNotFoundError:
+        print("{} not found".format(pickle_file))
+        return False
+
+    if trial_completed(os.path.join(exp_path, trial.name)):
         print("Skipping {} because it seems to be done".format(trial.name))
-        return
+        return False
+
+    execute_trial(trial, exp_path, logging=logging, profile=profile)
+    return True
+
+def execute_trial(trial, exp_path, logging=False, profile=False):
+    """Runs a loaded trial and saves its results under `exp_path`.
+    If `profile`, the run is profiled (see sciex.profiling)."""
+    # The trial directory may not exist yet if the trial is in a packed store
+    trial_path = os.path.join(exp_path, trial.name)
+    os.makedirs(trial_path, exist_ok=True)
+
+    # an identical trial may have been run before (see sciex.result_cache)
+    result_cache = get_result_cache()
+    # computed before the run loads the config values in the blob store
+    cache_key = trial_key(trial) if result_cache is not None else None
+    if cache_key is not None:
+        metrics = result_cache.restore(trial, trial_path, key=cache_key)
+        if metrics is not None:
+            print("Results of {} found in the result cache".format(trial.name))
+            save_trial_metrics(exp_path, trial.name, metrics)
+            return
 
-    # run trial
-    results = trial.run(logging=args.logging)
-    save_trial_results(args.exp_path, trial.name, results, trial.log, trial.config)
+    # experiments without a manifest are checked by their directories instead
+    append_records(exp_path, [started_record(trial.name)], create=False)
 
-def save_trial_results(exp_path, trial_name, trial_results, log, config):
+    # stream the events the trial logs to disk as they happen
+    log_path = os.path.join(trial_path, LOG_JSONL_FILENAME)
+    checkpoint_path = os.path.join(trial_path, CHECKPOINT_FILENAME)
+    trial.start_log_stream(log_path)
+    try:
+        try:
+            # resume from the checkpoint of an earlier, interrupted run, if any
+            if trial.resume(checkpoint_path):
+                print("Resuming {} from checkpoint".format(trial.name))
+
+            # run trial
+            start = telemetry.snapshot()
+            if profile:
+                from sciex.profiling import run_profiled, PROFILE_FILENAME
+                results = run_profiled(trial.run, os.path.join(trial_path, PROFILE_FILENAME),
+                                       logging=logging)
+            else:
+                results = trial.run(logging=logging)
+            metrics = telemetry.usage_since(start)
+        finally:
+            trial.stop_log_stream()
+        save_trial_results(exp_path, trial.name, results, read_event_log(log_path),
+                           trial.config, metrics=metrics)
+    except BaseException as ex:
+        # so that the trial is not taken to be still running
+        append_records(exp_path, [failed_record(trial.name, "%s: %s" % (type(ex).__name__, ex))],
+                       create=False)
+        raise
+    remove_checkpoint(checkpoint_path)
+    if cache_key is not None:
+        result_cache.store(trial, trial_path, key=cache_key)
+
+def save_trial_results(exp_path, trial_name, trial_results, log, config, metrics=None):
+    import yaml
     trial_path = os.path.join(exp_path, trial_name)
     if not os.path.exists(trial_path):
         os.makedirs(trial_path)
@@ -53,5 +284,15 @@ def save_trial_results(exp_path, trial_name, trial_results, log, config):
         for event in log:
             f.write(str(event) + "\n")
 
+    save_trial_metrics(exp_path, trial_name, metrics)
+
+def save_trial_metrics(exp_path, trial_name, metrics=None):
+    """Saves the metrics of a finished trial and records
+    its completion in the manifest"""
+    if metrics is not None:
+        with open(os.path.join(exp_path, trial_name, "metrics.json"), "w") as f:
+            json.dump(metrics, f)
+    append_records(exp_path, [completed_record(trial_name, metrics)], create=False)
+
 if __name__ == "__main__":
     main()
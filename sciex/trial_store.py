@@ -0,0 +1,167 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+Packed trial store: instead of one directory with a trial.pkl per
+trial, all pickled trials are appended to a single file (trials.pack)
+in the experiment root, with an index (trials.pack.idx) of the offset
+and length of each trial. This avoids creating hundreds of thousands
+of directories and files when generating large experiments, which is
+slow on network file systems and can exhaust inode quotas.
+
+Run scripts still refer to trials as {exp_path}/{trial_name}/trial.pkl;
+when that file does not exist, the runners load the trial from the
+store, and the trial directory is created when the trial starts.
+Use `load_trial` and `trial_names` to read trials in either layout.
+"""
+import os
+import pickle
+from sciex.serialization import add_blob_dir
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+STORE_FILENAME = "trials.pack"
+INDEX_FILENAME = "trials.pack.idx"
+
+
+class TrialStore:
+    def __init__(self, exp_path):
+        self.exp_path = exp_path
+        self.path = os.path.join(exp_path, STORE_FILENAME)
+        self.index_path = os.path.join(exp_path, INDEX_FILENAME)
+        self._index = None
+        self._index_size = 0
+
+    @staticmethod
+    def exists(exp_path):
+        return os.path.exists(os.path.join(exp_path, INDEX_FILENAME))
+
+    def _read_index(self):
+        """Reads index entries appended since the last read"""
+        if self._index is None:
+            self._index = {}
+            self._index_size = 0
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_size)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._index_size += len(line)
+                name, offset, length = line.decode().rstrip("\n").split("\t")
+                self._index[name] = (int(offset), int(length))
+
+    @property
+    def index(self):
+        """Mapping from trial name to (offset, length) in the store"""
+        if self._index is None:
+            self._read_index()
+        return self._index
+
+    def names(self):
+        return list(self.index.keys())
+
+    def __contains__(self, trial_name):
+        if trial_name not in self.index:
+            # the store may have grown since the index was read
+            self._read_index()
+        return trial_name in self._index
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, items):
+        """Appends trials to the store. `items` is a list of
+        (trial_name, pickled trial bytes). Trials that the store
+        already holds with the same bytes are not appended again.
+        Returns the number of trials appended."""
+        with open(self.path, "ab") as f, open(self.index_path, "a") as fi:
+            if fcntl is not None:
+                fcntl.lockf(f, fcntl.LOCK_EX)
+            try:
+                index_lines = []
+                for trial_name, data in items:
+                    if self._holds(trial_name, data):
+                        continue
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(data)
+                    index_lines.append("%s\t%d\t%d\n" % (trial_name, offset, len(data)))
+                f.flush()
+                # The index is written after the data, so that an
+                # index entry always points to complete data.
+                fi.write("".join(index_lines))
+                fi.flush()
+                if self._index is not None:
+                    # so that entries replaced here are not read stale
+                    self._read_index()
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(f, fcntl.LOCK_UN)
+        return len(index_lines)
+
+    def _holds(self, trial_name, data):
+        """True if the latest entry of `trial_name` is `data`"""
+        if trial_name not in self or self._index[trial_name][1] != len(data):
+            return False
+        return self.load_bytes(trial_name) == data
+
+    def load_bytes(self, trial_name):
+        if trial_name not in self:
+            raise KeyError("Trial %s not in %s" % (trial_name, self.path))
+        offset, length = self._index[trial_name]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def load(self, trial_name):
+        return pickle.loads(self.load_bytes(trial_name))
+
+
+_stores = {}
+def get_store(exp_path):
+    """Returns the TrialStore of the experiment (cached for
+    this process), or None if the experiment has no store."""
+    exp_path = os.path.abspath(exp_path)
+    if exp_path not in _stores:
+        if not TrialStore.exists(exp_path):
+            return None
+        _stores[exp_path] = TrialStore(exp_path)
+    return _stores[exp_path]
+
+def load_trial(exp_path, trial_name):
+    """Loads a trial from {exp_path}/{trial_name}/trial.pkl, or
+    from the packed store of the experiment if that file does
+    not exist. Raises FileNotFoundError if neither has it."""
+    # Large config values of the trial may be in the blob store of the experiment
+    add_blob_dir(exp_path)
+    pickle_file = os.path.join(exp_path, trial_name, "trial.pkl")
+    if os.path.exists(pickle_file):
+        with open(pickle_file, "rb") as f:
+            return pickle.load(f)
+    store = get_store(exp_path)
+    if store is not None and trial_name in store:
+        return store.load(trial_name)
+    raise FileNotFoundError("Trial %s not found in %s" % (trial_name, exp_path))
+
+def load_trial_file(pickle_file):
+    """Loads a trial given the path to its trial.pkl, which
+    may be a path into the packed store (see `load_trial`)."""
+    trial_path = os.path.dirname(os.path.normpath(pickle_file))
+    return load_trial(os.path.dirname(trial_path), os.path.basename(trial_path))
+
+def trial_names(exp_path):
+    """Returns the names of all trials in the experiment: those
+    with a trial.pkl in their directory, and those in the store."""
+    names = []
+    for fname in sorted(os.listdir(exp_path)):
+        if os.path.exists(os.path.join(exp_path, fname, "trial.pkl")):
+            names.append(fname)
+    store = get_store(exp_path)
+    if store is not None:
+        seen = set(names)
+        names.extend(name for name in store.names() if name not in seen)
+    return names
@@ -2,8 +2,14 @@
 # 
 # Usage of this file is licensed under the MIT License.
 
-from scipy import stats
 import numpy as np
+import functools
+
+def _stats():
+    # scipy takes about a second to import, and is only needed for
+    # computing statistics, so it is imported on first use.
+    from scipy import stats
+    return stats
 
 # Printing
 def json_safe(obj):
@@ -35,14 +41,80 @@ def ci_normal(series, confidence_interval=None, c=0.95):
         confidence_interval = c
         
     series = np.asarray(series)
-    # this is the "percentage point function" which is the inverse of a cdf
-    # divide by 2 because we are making a two-tailed claim
-    tscore = stats.t.ppf((1 + confidence_interval)/2.0, df=len(series)-1)
-    y_error = stats.sem(series)
-    half_width = y_error * tscore
+    y_error = _stats().sem(series)
+    half_width = y_error * tscore(len(series)-1, confidence_interval)
     return half_width
 
 def stderr(series):
     """computes the standard error of the mean"""
-    return stats.sem(series)
+    return _stats().sem(series)
+
+@functools.lru_cache(maxsize=None)
+def tscore(df, confidence_interval=0.95):
+    """t-score for a two-tailed confidence interval with `df`
+    degrees of freedom. Cached, since the same few degrees of
+    freedom come up over and over."""
+    if df < 1:
+        return float("nan")
+    # this is the "percentage point function" which is the inverse of a cdf
+    # divide by 2 because we are making a two-tailed claim
+    return float(_stats().t.ppf((1 + confidence_interval)/2.0, df=df))
+
+def _tscores(dfs, confidence_interval):
+    """t-scores for an array of degrees of freedom"""
+    unique_dfs, inverse = np.unique(dfs, return_inverse=True)
+    scores = np.array([tscore(int(df), confidence_interval) for df in unique_dfs])
+    return scores[inverse].reshape(np.shape(dfs))
+
+def _summarize(n, sums, sum_squared_deviations, confidence_interval):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = sums / n
+        y_error = np.sqrt(sum_squared_deviations / (n - 1) / n)
+    y_error = np.where(n > 1, y_error, np.nan)
+    half_width = y_error * _tscores(n - 1, confidence_interval)
+    return mean, y_error, half_width
+
+def batch_stats(values, lengths=None, confidence_interval=0.95):
+    """Mean, standard error and confidence interval half-width (see
+    `ci_normal`) of many series at once.
+
+    `values` is either a list of series of different lengths, or a 2D
+    array of series padded to the same length, in which case `lengths`
+    gives the length of each series.
+
+    Returns three arrays (mean, stderr, half_width), one entry per series."""
+    if lengths is None:
+        lengths = np.array([len(series) for series in values])
+        padded = np.zeros((len(values), max(lengths, default=0)))
+        for i, series in enumerate(values):
+            padded[i, :lengths[i]] = series
+        values = padded
+    values = np.asarray(values, dtype=float)
+    n = np.asarray(lengths)
+    mask = np.arange(values.shape[1]) < n[:, None]
+    sums = np.where(mask, values, 0.0).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = sums / n
+    deviations = np.where(mask, values - mean[:, None], 0.0)
+    return _summarize(n, sums, (deviations**2).sum(axis=1), confidence_interval)
+
+def grouped_stats(values, groups, confidence_interval=0.95):
+    """Mean, standard error and confidence interval half-width (see
+    `ci_normal`) of the values in each group, where `values` is a
+    flat array and `groups` gives the group (any sortable label) of
+    each value.
+
+    Returns four arrays (labels, mean, stderr, half_width), one entry
+    per group, in the sorted order of the labels."""
+    values = np.asarray(values, dtype=float)
+    labels, inverse = np.unique(groups, return_inverse=True)
+    inverse = inverse.ravel()
+    n = np.bincount(inverse, minlength=len(labels))
+    sums = np.bincount(inverse, weights=values, minlength=len(labels))
+    mean = sums / n
+    deviations = values - mean[inverse]
+    mean, y_error, half_width = _summarize(
+        n, sums, np.bincount(inverse, weights=deviations**2, minlength=len(labels)),
+        confidence_interval)
+    return labels, mean, y_error, half_width
     
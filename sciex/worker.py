@@ -0,0 +1,196 @@
+# Copyright 2022 Kaiyu Zheng
+#
+# Usage of this file is licensed under the MIT License.
+
+"""
+worker: Runs trials from the experiment's trial queue (see
+sciex.trial_queue) until the queue is empty. Start as many
+workers as you like, on any machine that sees the experiment
+directory; each one claims the next pending trial, runs it, and
+marks it done. For example:
+
+$ python -m sciex.worker path/to/experiment --init
+$ python -m sciex.worker path/to/experiment --logging    # on every terminal
+
+The queue is filled by Experiment.generate_trial_scripts(queue=True),
+or with --init, which enqueues the trials of the run scripts
+(matching --prefix) in the experiment root.
+
+Note: SQLite relies on file locking; most network file systems
+support it, but check yours before running workers on many nodes.
+Otherwise, or to reassign the trials of workers that die, run a
+coordinator (see sciex.coordinator) and start the workers with
+--coordinator URL; then only the coordinator touches the queue.
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+from sciex.trial_queue import TrialQueue, default_worker_id, RUNNING, FAILED
+from sciex.trial_runner import run_trial
+from sciex.result_cache import enable_result_cache
+from sciex.check_status import load_trial_names_in_run_script
+
+def enqueue_run_scripts(exp_path, prefix="run"):
+    """Adds the trials in run scripts (whose file names start
+    with `prefix`) in `exp_path` to the trial queue."""
+    trial_names = []
+    for fname in sorted(os.listdir(exp_path)):
+        filepath = os.path.join(exp_path, fname)
+        if os.path.isdir(filepath):
+            continue
+        if fname.startswith(prefix) and fname.endswith(".sh"):
+            trial_names.extend(load_trial_names_in_run_script(filepath))
+    return TrialQueue(exp_path).add(trial_names)
+
+def work(exp_path, logging=False, worker=None, max_trials=None):
+    """Claims and runs trials from the queue in `exp_path` until
+    there is nothing left (or `max_trials` trials have been run).
+    Returns the number of trials processed."""
+    if worker is None:
+        worker = default_worker_id()
+    queue = TrialQueue(exp_path)
+    count = 0
+    while max_trials is None or count < max_trials:
+        trial_name = queue.claim(worker)
+        if trial_name is None:
+            break
+        print("[%s] Claimed %s" % (worker, trial_name))
+        try:
+            run_trial(os.path.join(exp_path, trial_name, "trial.pkl"),
+                      exp_path, logging=logging)
+        except Exception:
+            traceback.print_exc()
+            print("[%s] Trial %s failed" % (worker, trial_name))
+            queue.mark_failed(trial_name, worker)
+        else:
+            queue.mark_done(trial_name, worker)
+        count += 1
+    return count
+
+def _post(url, path, body, retries=5):
+    """Posts JSON to the coordinator; retries with backoff if it
+    cannot be reached (e.g. while it restarts). Error replies
+    (urllib.error.HTTPError) are raised without retrying."""
+    data = json.dumps(body).encode()
+    for attempt in range(retries):
+        try:
+            request = urllib.request.Request(url.rstrip("/") + path, data=data,
+                                             headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError:
+            raise
+        except OSError as ex:
+            if attempt == retries - 1:
+                raise
+            print("Could not reach coordinator (%s); retrying" % ex)
+            time.sleep(2 ** attempt)
+
+def work_remote(url, exp_path, logging=False, worker=None, max_trials=None,
+                heartbeat_interval=10):
+    """Like `work`, but claims trials from the coordinator at `url`
+    (see sciex.coordinator), sending it heartbeats meanwhile.
+    Returns the number of trials processed."""
+    if worker is None:
+        worker = default_worker_id()
+    host = socket.gethostname()
+    current = []
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(heartbeat_interval):
+            try:
+                _post(url, "/heartbeat", {"worker": worker, "host": host,
+                                          "trials": list(current)}, retries=1)
+            except OSError:
+                pass
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+
+    count = 0
+    try:
+        while max_trials is None or count < max_trials:
+            trial_name = _post(url, "/claim", {"worker": worker, "host": host})["trial"]
+            if trial_name is None:
+                break
+            print("[%s] Claimed %s" % (worker, trial_name))
+            current.append(trial_name)
+            ok = True
+            try:
+                run_trial(os.path.join(exp_path, trial_name, "trial.pkl"),
+                          exp_path, logging=logging)
+            except Exception:
+                traceback.print_exc()
+                print("[%s] Trial %s failed" % (worker, trial_name))
+                ok = False
+            current.remove(trial_name)
+            if not _post(url, "/done", {"worker": worker, "trial": trial_name, "ok": ok})["ok"]:
+                print("[%s] %s was handed out to another worker meanwhile" % (worker, trial_name))
+            count += 1
+    finally:
+        stop.set()
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Run trials from the experiment's trial queue.")
+    parser.add_argument("exp_path", type=str,
+                        help="Path to experiment root")
+    parser.add_argument("--init", action="store_true",
+                        help="Enqueue the trials in the run scripts (see --prefix) and exit")
+    parser.add_argument("--prefix", type=str, default="run",
+                        help="Prefix to run scripts used by --init. Default 'run'")
+    parser.add_argument("--requeue-failed", action="store_true",
+                        help="Put failed trials back to pending and exit")
+    parser.add_argument("--requeue-stale", type=float, default=None,
+                        help="Put trials claimed more than this many seconds ago, "
+                        "and not finished, back to pending and exit")
+    parser.add_argument("--status", action="store_true",
+                        help="Print the number of trials in each state and exit")
+    parser.add_argument("--max-trials", type=int, default=None,
+                        help="Stop after running this many trials")
+    parser.add_argument("--worker-id", type=str, default=None,
+                        help="Name of this worker. Default is hostname:pid")
+    parser.add_argument("--logging", action="store_true")
+    parser.add_argument("--coordinator", type=str, default=None,
+                        help="URL of a coordinator (see sciex.coordinator) to claim trials from")
+    parser.add_argument("--heartbeat-interval", type=float, default=10,
+                        help="Seconds between heartbeats sent to the coordinator")
+    parser.add_argument("--result-cache", type=str, nargs="?", const="1", default=None,
+                        help="Reuse the results of identical trials from the result"\
+                        " cache, in this directory or the default one (see sciex.result_cache)")
+    args = parser.parse_args()
+
+    if args.result_cache is not None:
+        enable_result_cache(args.result_cache)
+
+    exp_path = os.path.abspath(args.exp_path)
+    if args.init or args.requeue_failed or args.requeue_stale is not None or args.status:
+        queue = TrialQueue(exp_path)
+        if args.init:
+            print("Enqueued %d trials" % enqueue_run_scripts(exp_path, prefix=args.prefix))
+        if args.requeue_failed:
+            print("Requeued %d failed trials" % queue.requeue((FAILED,)))
+        if args.requeue_stale is not None:
+            print("Requeued %d stale trials" % queue.requeue((RUNNING,),
+                                                             older_than=args.requeue_stale))
+        for status, count in queue.counts().items():
+            print("%10s: %d" % (status, count))
+        return
+
+    if args.coordinator is not None:
+        count = work_remote(args.coordinator, exp_path, logging=args.logging,
+                            worker=args.worker_id, max_trials=args.max_trials,
+                            heartbeat_interval=args.heartbeat_interval)
+    else:
+        count = work(exp_path, logging=args.logging,
+                     worker=args.worker_id, max_trials=args.max_trials)
+    print("Worker finished after processing %d trials" % count)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import threading
+import time
+import urllib.error
+import pytest
+from http.server import ThreadingHTTPServer
+from sciex.coordinator import Coordinator, make_handler
+from sciex.trial_queue import TrialQueue, DONE, RUNNING
+from sciex import worker as sciex_worker
+
+
+@pytest.fixture
+def server(tmp_path):
+    coordinator = Coordinator(str(tmp_path), heartbeat_timeout=0.2)
+    coordinator.queue.add(["g_0_a"])
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(coordinator))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield coordinator, "http://127.0.0.1:%d" % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _status(exp_path, trial_name):
+    with TrialQueue(exp_path)._connect() as conn:
+        return conn.execute("SELECT status, worker FROM trials WHERE name=?",
+                            (trial_name,)).fetchone()
+
+
+def test_late_done_of_dead_worker_is_ignored(server, tmp_path):
+    coordinator, url = server
+    post = sciex_worker._post
+    assert post(url, "/claim", {"worker": "w1"})["trial"] == "g_0_a"
+    post(url, "/heartbeat", {"worker": "w1", "trials": ["g_0_a"]})
+    assert coordinator.reassign_dead() == []
+
+    time.sleep(0.3)
+    assert coordinator.reassign_dead() == ["g_0_a"]
+    assert post(url, "/claim", {"worker": "w2"})["trial"] == "g_0_a"
+
+    assert post(url, "/done", {"worker": "w1", "trial": "g_0_a", "ok": False}) == {"ok": False}
+    assert tuple(_status(str(tmp_path), "g_0_a")) == (RUNNING, "w2")
+    assert post(url, "/done", {"worker": "w2", "trial": "g_0_a"}) == {"ok": True}
+    assert tuple(_status(str(tmp_path), "g_0_a")) == (DONE, "w2")
+    assert coordinator.workers["w1"].failed == 0
+    assert coordinator.workers["w2"].done == 1
+
+
+def test_bad_request_is_not_retried(server, monkeypatch):
+    _, url = server
+    monkeypatch.setattr(sciex_worker.time, "sleep", lambda seconds: pytest.fail("retried"))
+    with pytest.raises(urllib.error.HTTPError) as ex:
+        sciex_worker._post(url, "/done", {"worker": "w1"})
+    assert ex.value.code == 400
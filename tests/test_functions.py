@@ -0,0 +1,37 @@
+import os
+from sciex import Experiment
+from sciex.functions import add_baseline
+from sciex.manifest import manifest_path
+from sciex.trial_store import get_store, load_trial
+from test_manifest import CountTrial
+
+
+def _generate(tmp_path, **kwargs):
+    trials = [CountTrial("g_%d_a" % seed, {"count": seed, "data": list(range(10000))})
+              for seed in range(3)]
+    Experiment("exp", trials, str(tmp_path), add_timestamp=False)\
+        .generate_trial_scripts(split=1, **kwargs)
+    return os.path.join(str(tmp_path), "exp")
+
+
+def test_baselines_take_configs_of_original_trials(tmp_path):
+    exp_path = _generate(tmp_path)
+    os.remove(manifest_path(exp_path))
+    add_baseline("b", exp_path, lambda global_name, seed, config: CountTrial(
+        "%s_%s_b" % (global_name, seed), {"count": -1}), save_trials=True)
+    trials = add_baseline("c", exp_path, lambda global_name, seed, config: CountTrial(
+        "%s_%s_c" % (global_name, seed), config), save_trials=True)
+    assert sorted(trial.config["count"] for trial in trials) == [0, 1, 2]
+
+
+def test_baselines_of_packed_experiment_with_blobs(tmp_path):
+    exp_path = _generate(tmp_path, packed=True, dedup_threshold=1000)
+    add_baseline("b", exp_path, lambda global_name, seed, config: CountTrial(
+        "%s_%s_b" % (global_name, seed), config), save_trials=True)
+    store = get_store(exp_path)
+    for seed in range(3):
+        trial_name = "g_%d_b" % seed
+        assert not os.path.exists(os.path.join(exp_path, trial_name))
+        # the data is referred to in the blob store, not pickled again
+        assert store.index[trial_name][1] < 1000
+        assert load_trial(exp_path, trial_name).config["data"] == list(range(10000))
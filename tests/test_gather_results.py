@@ -0,0 +1,36 @@
+import os
+from sciex import Experiment, YamlResult
+from sciex.collection_cache import CollectionCache
+from sciex.gather_results import collect_trial
+from test_manifest import CountTrial, CountResult, _finish
+
+
+class OtherResult(YamlResult):
+    @classmethod
+    def FILENAME(cls):
+        return "config.yaml"
+
+
+def test_cached_trial_reads_current_result_types(tmp_path, monkeypatch):
+    Experiment("exp", [CountTrial("g_0_a", {"count": 0})], str(tmp_path),
+               add_timestamp=False).generate_trial_scripts(split=1)
+    exp_path = os.path.join(str(tmp_path), "exp")
+    _finish(exp_path, "g_0_a")
+    root = os.path.join(exp_path, "g_0_a")
+    cache = CollectionCache(exp_path)
+
+    assert collect_trial(root, cache=cache)[3] == [CountResult]
+    monkeypatch.setattr(CountTrial, "RESULT_TYPES", [CountResult, OtherResult])
+    result_types, collected = collect_trial(root, cache=cache)[3:]
+    assert result_types == [CountResult, OtherResult]
+    assert set(collected) == {CountResult, OtherResult}
+
+
+def test_trial_dirs_skip_blobs_and_calibration(tmp_path):
+    from sciex.gather_results import trial_dirs
+    Experiment("exp", [CountTrial("g_0_a", {"count": list(range(1000))})], str(tmp_path),
+               add_timestamp=False).generate_trial_scripts(split=1, dedup_threshold=100)
+    exp_path = os.path.join(str(tmp_path), "exp")
+    os.makedirs(os.path.join(exp_path, "calibration"))
+    assert os.path.isdir(os.path.join(exp_path, "blobs"))
+    assert trial_dirs(exp_path) == [os.path.join(exp_path, "g_0_a")]
@@ -0,0 +1,18 @@
+def test_star_import_does_not_leak_helpers():
+    namespace = {}
+    exec("from sciex import *", namespace)
+    for name in ["Experiment", "Trial", "Grid", "add_baselines", "NpyResult"]:
+        assert name in namespace
+    for name in ["Random", "random", "itertools", "TrialQueue", "lpt_partition",
+                 "dedup_config_values", "time", "collections", "json", "multiprocessing"]:
+        assert name not in namespace
+    # names that were always provided
+    for name in ["os", "pickle", "dt", "pprint"]:
+        assert name in namespace
+
+
+def test_star_import_provides_util_and_yaml():
+    namespace = {}
+    exec("from sciex import *", namespace)
+    assert hasattr(namespace["util"], "json_safe")
+    assert hasattr(namespace["yaml"], "dump")
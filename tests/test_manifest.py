@@ -0,0 +1,79 @@
+import argparse
+import os
+from sciex import Experiment, Trial, YamlResult
+from sciex import check_status
+from sciex.divide import divide_by_trial
+from sciex.functions import add_baseline
+from sciex.manifest import (append_records, load_index, manifest_path, started_record,
+                            completed_record)
+
+
+class CountResult(YamlResult):
+    @classmethod
+    def FILENAME(cls):
+        return "count.yaml"
+
+
+class CountTrial(Trial):
+    RESULT_TYPES = [CountResult]
+    def run(self, logging=False):
+        return [CountResult(self.config["count"])]
+
+
+def _finish(exp_path, trial_name):
+    # what a trial directory looks like after the trial ran
+    for fname in ["config.yaml", "count.yaml"]:
+        with open(os.path.join(exp_path, trial_name, fname), "w") as f:
+            f.write("0\n")
+
+
+def _status(exp_path, monkeypatch, prefix=""):
+    monkeypatch.setattr(check_status, "EXPERIMENT_PATH", exp_path)
+    return check_status.status_from_manifest(argparse.Namespace(prefix=prefix, run_script_path=""))
+
+
+def _pre_manifest_experiment(tmp_path):
+    """4 trials generated before manifests existed, 2 of them finished"""
+    trials = [CountTrial("g_%d_a" % seed, {"count": seed}) for seed in range(4)]
+    Experiment("exp", trials, str(tmp_path), add_timestamp=False).generate_trial_scripts(split=2)
+    exp_path = os.path.join(str(tmp_path), "exp")
+    os.remove(manifest_path(exp_path))
+    _finish(exp_path, "g_0_a")
+    _finish(exp_path, "g_1_a")
+    return exp_path
+
+
+def test_manifest_covers_trials_generated_before_it(tmp_path, monkeypatch):
+    exp_path = _pre_manifest_experiment(tmp_path)
+    add_baseline("b", exp_path, lambda global_name, seed, config: CountTrial(
+        "%s_%s_b" % (global_name, seed), config), save_trials=True, split=1)
+
+    index = load_index(exp_path)
+    assert len(index) == 8
+    assert sorted(name for name in index if index[name]["completed"]) == ["g_0_a", "g_1_a"]
+    assert _status(exp_path, monkeypatch) == {"total": 8, "finished": 2}
+
+    divide_by_trial(exp_path, ["run_0.sh", "run_1.sh"], ["h1"], [1], [1.0])
+    with open(os.path.join(exp_path, "group_h1_0.sh")) as f:
+        names = sorted(check_status.trial_name_in_command(line) for line in f)
+    assert names == ["g_2_a", "g_3_a"]
+
+
+def test_prefix_of_scripts_not_in_manifest(tmp_path, monkeypatch):
+    trials = [CountTrial("g_%d_a" % seed, {"count": seed}) for seed in range(4)]
+    Experiment("exp", trials, str(tmp_path), add_timestamp=False).generate_trial_scripts(split=2)
+    exp_path = os.path.join(str(tmp_path), "exp")
+    _finish(exp_path, "g_0_a")
+    append_records(exp_path, [completed_record("g_0_a")])
+    # a script written by hand, which the manifest does not know of
+    with open(os.path.join(exp_path, "group_h1_0.sh"), "w") as f:
+        f.write("source run_0.sh\n")
+    monkeypatch.chdir(exp_path)
+    assert _status(exp_path, monkeypatch, prefix="group") == {"total": 2, "finished": 1}
+    assert _status(exp_path, monkeypatch, prefix="run") == {"total": 4, "finished": 1}
+
+
+def test_runner_records_do_not_create_manifest(tmp_path):
+    exp_path = str(tmp_path)
+    append_records(exp_path, [started_record("g_0_a")], create=False)
+    assert not os.path.exists(manifest_path(exp_path))
@@ -0,0 +1,35 @@
+import os
+from sciex import Experiment
+from sciex.result_cache import trial_key, ENV_VAR
+from sciex.serialization import BlobRef
+from sciex.trial_runner import execute_trial
+from sciex.trial_store import load_trial
+from test_manifest import CountTrial
+
+
+def _generate(tmp_path, name):
+    Experiment(name, [CountTrial("g_0_a", {"count": 1, "data": list(range(1000))})],
+               str(tmp_path), add_timestamp=False).generate_trial_scripts(split=1, dedup_threshold=100)
+    return os.path.join(str(tmp_path), name)
+
+
+def test_key_does_not_load_blobs(tmp_path):
+    exp_path = _generate(tmp_path, "exp")
+    trial = load_trial(exp_path, "g_0_a")
+    key = trial_key(trial)
+    assert isinstance(trial._config["data"], BlobRef)
+    assert key == trial_key(load_trial(exp_path, "g_0_a"))
+
+
+def test_config_without_stable_encoding_is_not_cached():
+    assert trial_key(CountTrial("g_0_a", {"count": object()})) is None
+
+
+def test_results_of_trial_with_blobs_are_reused(tmp_path, monkeypatch):
+    monkeypatch.setenv(ENV_VAR, os.path.join(str(tmp_path), "cache"))
+    exp_path = _generate(tmp_path, "exp")
+    execute_trial(load_trial(exp_path, "g_0_a"), exp_path)
+    other_path = _generate(tmp_path, "other")
+    execute_trial(load_trial(other_path, "g_0_a"), other_path)
+    with open(os.path.join(other_path, "g_0_a", "metrics.json")) as f:
+        assert '"cache_hit": true' in f.read()
@@ -0,0 +1,49 @@
+import os
+from sciex.result_types import CsvResult
+
+
+def test_csv_round_trip_without_columns(tmp_path):
+    path = os.path.join(tmp_path, "rows.csv")
+    CsvResult([[1, 2], [3, 4], [5, 6]]).save(path)
+    columns = CsvResult.collect(path)
+    assert list(columns) == ["0", "1"]
+    assert columns["0"].tolist() == [1, 3, 5]
+    assert columns["1"].tolist() == [2, 4, 6]
+
+
+def test_csv_round_trip_with_fmtparams(tmp_path):
+    class SemicolonResult(CsvResult):
+        FMTPARAMS = {"delimiter": ";"}
+    path = os.path.join(tmp_path, "rows.csv")
+    SemicolonResult([[1, 2.5], [2, 3.5]], columns=["x", "y"]).save(path)
+    columns = SemicolonResult.collect(path)
+    assert columns["x"].tolist() == [1, 2]
+    assert columns["y"].tolist() == [2.5, 3.5]
+
+
+def test_csv_widened_column_keeps_values(tmp_path):
+    class SmallChunks(CsvResult):
+        CHUNK_SIZE = 2
+        BUFFER_SIZE = 2
+    path = os.path.join(tmp_path, "rows.csv")
+    result = SmallChunks(columns=["a", "b"])
+    result.extend([[123456, "0.123456"], [7, "1.50"], ["abc", "x"]])
+    result.save(path)
+    columns = SmallChunks.collect(path)
+    assert columns["a"].tolist() == ["123456", "7", "abc"]
+    assert columns["b"].tolist() == ["0.123456", "1.50", "x"]
+
+
+def test_csv_format_changes_collection_version():
+    from sciex.collection_cache import result_type_version
+
+    class Typed(CsvResult):
+        DTYPES = {"a": "float32"}
+
+    class Untyped(CsvResult):
+        pass
+
+    assert result_type_version(Typed)[3] == result_type_version(Untyped)[3]
+    version = result_type_version(Typed)
+    Typed.DTYPES = {"a": "float64"}
+    assert result_type_version(Typed) != version
@@ -0,0 +1,64 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+from sciex import Experiment, Trial
+from sciex.manifest import load_index
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+class SleepTrial(Trial):
+    RESULT_TYPES = []
+    def run(self, logging=False):
+        with open(os.path.join(self.config["path"], "started"), "w"):
+            pass
+        time.sleep(60)
+        return []
+
+
+def test_terminated_trial_is_recorded_as_failed(tmp_path):
+    Experiment("exp", [SleepTrial("g_0_a", {"path": str(tmp_path)})], str(tmp_path),
+               add_timestamp=False).generate_trial_scripts(split=1)
+    exp_path = os.path.join(str(tmp_path), "exp")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([TESTS_PATH, os.path.dirname(TESTS_PATH)]))
+    proc = subprocess.Popen([sys.executable, "-m", "sciex.trial_runner",
+                             os.path.join(exp_path, "g_0_a", "trial.pkl"), exp_path],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 30
+        while not os.path.exists(os.path.join(str(tmp_path), "started")):
+            assert time.time() < deadline and proc.poll() is None
+            time.sleep(0.05)
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+    entry = load_index(exp_path)["g_0_a"]
+    assert entry["failed"]
+    assert "signal %d" % signal.SIGTERM in entry["error"]
+
+
+def test_parse_timeout_of_run_script_line():
+    from sciex.trial_runner import parse_trial_line
+    line = 'timeout 20m python trial_runner.py "./g_0_a/trial.pkl" "./" --logging'
+    assert parse_trial_line(line) == ("./g_0_a/trial.pkl", "./", True, 1200)
+    line = 'timeout -k 5 1.5h python trial_runner.py "./g_0_a/trial.pkl" "./"'
+    assert parse_trial_line(line)[3] == 5400
+    assert parse_trial_line('python trial_runner.py "./g_0_a/trial.pkl" "./"')[3] is None
+
+
+def test_stdin_applies_timeout_of_run_script_line(tmp_path):
+    from sciex.trial_runner import run_trials
+    Experiment("exp", [SleepTrial("g_0_a", {"path": str(tmp_path)})], str(tmp_path),
+               add_timestamp=False).generate_trial_scripts(split=1, timeout="1s")
+    exp_path = os.path.join(str(tmp_path), "exp")
+    with open(os.path.join(exp_path, "run_0.sh")) as f:
+        lines = f.readlines()
+    assert lines[0].startswith("timeout 1s ")
+    start = time.time()
+    assert run_trials(lines, exp_path) == 0
+    assert time.time() - start < 30
+    assert load_index(exp_path)["g_0_a"]["failed"]
@@ -0,0 +1,27 @@
+import os
+from sciex import Experiment
+from sciex.manifest import read_records
+from sciex.trial_store import TrialStore, STORE_FILENAME
+from test_manifest import CountTrial
+
+
+def test_store_appends_only_changed_trials(tmp_path):
+    store = TrialStore(str(tmp_path))
+    assert store.append([("g_0_a", b"one"), ("g_1_a", b"two")]) == 2
+    assert store.append([("g_0_a", b"one"), ("g_1_a", b"three")]) == 1
+    assert store.load_bytes("g_0_a") == b"one"
+    assert store.load_bytes("g_1_a") == b"three"
+    assert os.path.getsize(os.path.join(str(tmp_path), STORE_FILENAME)) == len(b"onetwothree")
+
+
+def test_regenerating_packed_experiment(tmp_path):
+    trials = [CountTrial("g_%d_a" % seed, {"count": list(range(1000))}) for seed in range(4)]
+    exp_path = os.path.join(str(tmp_path), "exp")
+    sizes = []
+    for _ in range(3):
+        Experiment("exp", trials, str(tmp_path), add_timestamp=False)\
+            .generate_trial_scripts(split=2, exist_ok=True, packed=True)
+        sizes.append(os.path.getsize(os.path.join(exp_path, STORE_FILENAME)))
+    assert sizes[0] == sizes[1] == sizes[2]
+    records, _ = read_records(exp_path)
+    assert len(records) == 4